@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+'''
+Cache for the RDF serializations of individual datasets
+
+Entries are stored per dataset id and keyed by the dataset
+`metadata_modified` value, the profiles and the format used, so any change
+in the dataset metadata will lead to a new serialization. Entries for a
+dataset can also be explicitly removed (eg when the dataset is updated or
+deleted). Serializations also include details of the dataset organization
+(`org_id`), so the entries of all its datasets are removed when it is
+updated.
+
+The backend is chosen with the `ckanext.dcat.dataset_cache.backend` config
+option (`memory`, `redis` or `file`). If not set, no caching is done.
+'''
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+
+from ckantoolkit import config
+import ckan.plugins.toolkit as toolkit
+
+log = logging.getLogger(__name__)
+
+DATASET_CACHE_BACKEND_CONFIG = 'ckanext.dcat.dataset_cache.backend'
+DATASET_CACHE_SIZE_CONFIG = 'ckanext.dcat.dataset_cache.size'
+DATASET_CACHE_EXPIRES_CONFIG = 'ckanext.dcat.dataset_cache.expires'
+DATASET_CACHE_DIRECTORY_CONFIG = 'ckanext.dcat.dataset_cache.directory'
+STRUCTURED_DATA_CACHE_SIZE_CONFIG = 'ckanext.dcat.structured_data.cache_size'
+
+DEFAULT_DATASET_CACHE_SIZE = 1000
+DEFAULT_DATASET_CACHE_EXPIRES = 24 * 60 * 60
+DEFAULT_STRUCTURED_DATA_CACHE_SIZE = 1000
+
+
+def dataset_cache_version(pkg):
+    '''
+    Returns the `metadata_modified` value used to key the cache entries of
+    a dataset, from its model object
+
+    All callers build it from the model, so the same dataset version always
+    gets the same key.
+    '''
+    return pkg.metadata_modified.isoformat()
+
+
+def _entry_key(metadata_modified, profiles, _format):
+    return '{0}|{1}|{2}'.format(
+        metadata_modified, ','.join(profiles or []), _format or '')
+
+
+class DatasetCache(object, metaclass=ABCMeta):
+    '''
+    Base class for the dataset serialization cache backends
+    '''
+
+    @abstractmethod
+    def get(self, dataset_id, metadata_modified, profiles, _format, org_id=None):
+        '''
+        Returns the cached serialization or None if not found
+        '''
+
+    @abstractmethod
+    def set(self, dataset_id, metadata_modified, profiles, _format, output,
+            org_id=None):
+        '''
+        Stores a serialization of the dataset
+        '''
+
+    @abstractmethod
+    def invalidate(self, dataset_id):
+        '''
+        Removes all cached serializations of the dataset
+        '''
+
+    def invalidate_datasets(self, dataset_ids):
+        '''
+        Removes all cached serializations of the datasets
+        '''
+        for dataset_id in dataset_ids:
+            self.invalidate(dataset_id)
+
+    def invalidate_organization(self, org_id, dataset_ids):
+        '''
+        Removes all cached serializations of the datasets of an organization
+        '''
+        self.invalidate_datasets(dataset_ids)
+
+    @abstractmethod
+    def clear(self):
+        '''
+        Removes all cached serializations
+        '''
+
+
+class MemoryDatasetCache(DatasetCache):
+    '''
+    In-process cache that keeps the serializations of the `size` most
+    recently used datasets
+    '''
+
+    def __init__(self, size=DEFAULT_DATASET_CACHE_SIZE):
+        self.size = size
+        self._datasets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, dataset_id, metadata_modified, profiles, _format, org_id=None):
+        key = _entry_key(metadata_modified, profiles, _format)
+        with self._lock:
+            entries = self._datasets.get(dataset_id)
+            if entries is None:
+                return None
+            self._datasets.move_to_end(dataset_id)
+            return entries.get(key)
+
+    def set(self, dataset_id, metadata_modified, profiles, _format, output,
+            org_id=None):
+        key = _entry_key(metadata_modified, profiles, _format)
+        with self._lock:
+            entries = self._datasets.get(dataset_id)
+            if entries is None:
+                entries = self._datasets[dataset_id] = {}
+            else:
+                self._datasets.move_to_end(dataset_id)
+            # Drop serializations of previous versions of the dataset
+            prefix = '{0}|'.format(metadata_modified)
+            for stale_key in [k for k in entries if not k.startswith(prefix)]:
+                del entries[stale_key]
+            entries[key] = output
+
+            while len(self._datasets) > self.size:
+                self._datasets.popitem(last=False)
+
+    def invalidate(self, dataset_id):
+        with self._lock:
+            self._datasets.pop(dataset_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._datasets.clear()
+
+
+class RedisDatasetCache(DatasetCache):
+    '''
+    Cache shared by all CKAN processes, stored in the CKAN Redis instance
+
+    Each dataset is stored as a hash that expires after `expires` seconds.
+    '''
+
+    prefix = 'ckanext-dcat:dataset:'
+
+    def __init__(self, expires=DEFAULT_DATASET_CACHE_EXPIRES):
+        from ckan.lib.redis import connect_to_redis
+
+        self.expires = expires
+        self._redis = connect_to_redis()
+
+    def _key(self, dataset_id):
+        return self.prefix + dataset_id
+
+    def get(self, dataset_id, metadata_modified, profiles, _format, org_id=None):
+        output = self._redis.hget(
+            self._key(dataset_id),
+            _entry_key(metadata_modified, profiles, _format))
+        if output is None:
+            return None
+        return output.decode('utf-8') if isinstance(output, bytes) else output
+
+    def set(self, dataset_id, metadata_modified, profiles, _format, output,
+            org_id=None):
+        key = self._key(dataset_id)
+        pipeline = self._redis.pipeline()
+        pipeline.hset(key, _entry_key(metadata_modified, profiles, _format), output)
+        pipeline.expire(key, self.expires)
+        pipeline.execute()
+
+    def invalidate(self, dataset_id):
+        self._redis.delete(self._key(dataset_id))
+
+    def invalidate_datasets(self, dataset_ids):
+        keys = [self._key(dataset_id) for dataset_id in dataset_ids]
+        if keys:
+            self._redis.delete(*keys)
+
+    def clear(self):
+        for key in self._redis.scan_iter(self.prefix + '*'):
+            self._redis.delete(key)
+
+
+class FileDatasetCache(DatasetCache):
+    '''
+    Cache stored as files in a local directory, with one folder per dataset
+    grouped by organization
+
+    Files are written to a subdirectory created by the cache, so other
+    contents of `directory` are never removed.
+    '''
+
+    subdirectory = 'ckanext-dcat-datasets'
+
+    # Folder for the datasets without organization
+    no_organization = '_'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.root = os.path.join(directory, self.subdirectory)
+
+    def _org_dir(self, org_id):
+        return os.path.join(self.root, org_id or self.no_organization)
+
+    def _dataset_dir(self, dataset_id, org_id):
+        return os.path.join(self._org_dir(org_id), dataset_id[:2], dataset_id)
+
+    def _path(self, dataset_id, metadata_modified, profiles, _format, org_id):
+        key = _entry_key(metadata_modified, profiles, _format)
+        return os.path.join(
+            self._dataset_dir(dataset_id, org_id),
+            hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, dataset_id, metadata_modified, profiles, _format, org_id=None):
+        path = self._path(dataset_id, metadata_modified, profiles, _format, org_id)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, dataset_id, metadata_modified, profiles, _format, output,
+            org_id=None):
+        path = self._path(dataset_id, metadata_modified, profiles, _format, org_id)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file first so readers never get partial content
+            tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(output)
+            os.replace(tmp_path, path)
+        except (IOError, OSError) as e:
+            log.warning('Could not write dataset cache file %s: %s', path, e)
+
+    def invalidate(self, dataset_id):
+        # The dataset could have been moved to another organization
+        pattern = os.path.join(glob.escape(self.root), '*',
+                               glob.escape(dataset_id[:2]), glob.escape(dataset_id))
+        for path in glob.glob(pattern):
+            shutil.rmtree(path, ignore_errors=True)
+
+    def invalidate_organization(self, org_id, dataset_ids):
+        # Move the whole folder away first, so the entries are gone at once
+        org_dir = self._org_dir(org_id)
+        removed_dir = os.path.join(
+            self.root, '.removed-{0}'.format(uuid.uuid4().hex))
+        try:
+            os.rename(org_dir, removed_dir)
+        except (IOError, OSError):
+            return
+        shutil.rmtree(removed_dir, ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class TTLCache(object):
+    '''
+    Thread safe in-process cache that keeps up to `size` items, each of them
+    for `ttl` seconds
+
+    Used for small lookups like organization or license details, where
+    values can be missing (`None` is a valid value).
+    '''
+
+    _missing = object()
+
+    def __init__(self, size=1000, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key, self._missing)
+            if item is self._missing:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def __contains__(self, key):
+        return self.get(key, self._missing) is not self._missing
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_dataset_cache = None
+_dataset_cache_settings = None
+_structured_data_cache = None
+
+
+def get_dataset_cache():
+    '''
+    Returns the dataset cache configured for this site, or None if the cache
+    is not enabled
+    '''
+    global _dataset_cache, _dataset_cache_settings
+
+    backend = config.get(DATASET_CACHE_BACKEND_CONFIG)
+    directory = config.get(DATASET_CACHE_DIRECTORY_CONFIG)
+    if (backend, directory) == _dataset_cache_settings:
+        return _dataset_cache
+
+    if not backend:
+        cache = None
+    elif backend == 'memory':
+        cache = MemoryDatasetCache(
+            size=toolkit.asint(config.get(DATASET_CACHE_SIZE_CONFIG,
+                                          DEFAULT_DATASET_CACHE_SIZE)))
+    elif backend == 'redis':
+        cache = RedisDatasetCache(
+            expires=toolkit.asint(config.get(DATASET_CACHE_EXPIRES_CONFIG,
+                                             DEFAULT_DATASET_CACHE_EXPIRES)))
+    elif backend == 'file':
+        if not directory:
+            raise ValueError(
+                '"{0}" must be set to use the file dataset cache'.format(
+                    DATASET_CACHE_DIRECTORY_CONFIG))
+        cache = FileDatasetCache(directory)
+    else:
+        raise ValueError(
+            'Unknown value for "{0}": {1}'.format(
+                DATASET_CACHE_BACKEND_CONFIG, backend))
+
+    _dataset_cache = cache
+    _dataset_cache_settings = (backend, directory)
+
+    return _dataset_cache
+
+
+def get_structured_data_cache():
+    '''
+    Returns the cache used for the structured data of the dataset pages
+
+    This is the dataset cache if enabled, otherwise an in-process cache of
+    `ckanext.dcat.structured_data.cache_size` datasets. Returns None if the
+    dataset cache is not enabled and the size is 0.
+    '''
+    global _structured_data_cache
+
+    cache = get_dataset_cache()
+    if cache:
+        return cache
+
+    size = toolkit.asint(config.get(STRUCTURED_DATA_CACHE_SIZE_CONFIG,
+                                    DEFAULT_STRUCTURED_DATA_CACHE_SIZE))
+    if not size:
+        return None
+
+    if _structured_data_cache is None or _structured_data_cache.size != size:
+        _structured_data_cache = MemoryDatasetCache(size=size)
+
+    return _structured_data_cache
+
+
+def get_shared_dataset_cache():
+    '''
+    Returns the dataset cache if it is shared by all processes (`redis` or
+    `file` backends), otherwise None
+    '''
+    cache = get_dataset_cache()
+    if cache is None or isinstance(cache, MemoryDatasetCache):
+        return None
+    return cache
+
+
+def invalidate_organization_datasets(org_id):
+    '''
+    Removes the cached serializations and structured data of all the datasets
+    of an organization
+
+    Organization details (eg the publisher) are part of the serializations,
+    but changing them does not change the `metadata_modified` of the datasets.
+    With the `memory` backend only the entries of the current process are
+    removed.
+    '''
+    caches = []
+    for cache in (get_dataset_cache(), _structured_data_cache):
+        if cache is not None and cache not in caches:
+            caches.append(cache)
+    if not caches:
+        return
+
+    from ckan import model
+
+    dataset_ids = [
+        dataset_id for (dataset_id,) in
+        model.Session.query(model.Package.id)
+        .filter(model.Package.owner_org == org_id)
+    ]
+    for cache in caches:
+        cache.invalidate_organization(org_id, dataset_ids)
@@ -1,6 +1,7 @@
 from builtins import str
 import re
 import json
+import threading
 
 from abc import ABCMeta, abstractmethod
 from collections import OrderedDict
@@ -11,6 +12,7 @@ from ckan import plugins as p
 from ckan.lib.munge import substitute_ascii_equivalents
 from ckan.logic import NotFound, get_action
 from ckanext.dcat.converters import get_bbox_geojson
+from ckanext.dcat.extras import get_extras_index
 
 
 def munge_to_length(string, min_length, max_length):
@@ -31,14 +33,18 @@ def munge_tag(tag):
 
 
 def get_extra(key, package_dict):
-    for extra in package_dict.get('extras', []):
-        if extra['key'] == key:
-            return extra
+    return get_extras_index(package_dict).get_extra(key)
 
 
 class BaseConfigProcessor:
     __metaclass__ = ABCMeta
 
+    # Source config keys used by `modify_package_dict()`. If none of them is
+    # set the processor has nothing to do, and it is left out of the
+    # `ConfigProcessorPipeline`. None means the processor is always used, and
+    # an empty tuple that it is only used to validate the config.
+    config_keys = None
+
     @staticmethod
     @abstractmethod
     def check_config(config_obj):
@@ -49,9 +55,27 @@ class BaseConfigProcessor:
     def modify_package_dict(package_dict, config, dcat_dict):
         raise NotImplementedError
 
+    @classmethod
+    def compile(cls, config):
+        '''
+        Returns a function that modifies the package dict for this source
+        config, with the `(package_dict, dcat_dict)` arguments, or None if the
+        processor is not used by the config
+        '''
+        if cls.config_keys is not None and \
+                not any(config.get(key) for key in cls.config_keys):
+            return None
+
+        def modify_package_dict(package_dict, dcat_dict):
+            cls.modify_package_dict(package_dict, config, dcat_dict)
+
+        return modify_package_dict
+
 
 class ParseID(BaseConfigProcessor):
 
+    config_keys = ()
+
     @staticmethod
     def check_config(config_obj):
         if 'parse_id_if_url' in config_obj:
@@ -65,6 +89,8 @@ class ParseID(BaseConfigProcessor):
 
 class DefaultTags(BaseConfigProcessor):
 
+    config_keys = ('default_tags',)
+
     @staticmethod
     def check_config(config_obj):
         if 'default_tags' in config_obj:
@@ -87,6 +113,8 @@ class DefaultTags(BaseConfigProcessor):
 
 class CleanTags(BaseConfigProcessor):
 
+    config_keys = ('clean_tags',)
+
     @staticmethod
     def check_config(config_obj):
         if 'clean_tags' in config_obj:
@@ -118,6 +146,8 @@ class CleanTags(BaseConfigProcessor):
 
 class DefaultGroups(BaseConfigProcessor):
 
+    config_keys = ('default_groups',)
+
     @staticmethod
     def check_config(config_obj):
         if 'default_groups' in config_obj:
@@ -154,6 +184,8 @@ class DefaultGroups(BaseConfigProcessor):
 
 class DefaultExtras(BaseConfigProcessor):
 
+    config_keys = ('default_extras',)
+
     @staticmethod
     def check_config(config_obj):
         if 'default_extras' in config_obj:
@@ -169,11 +201,6 @@ class DefaultExtras(BaseConfigProcessor):
         # Set default extras if needed
         default_extras = config.get('default_extras', {})
 
-        def get_extra(key, package_dict):
-            for extra in package_dict.get('extras', []):
-                if extra['key'] == key:
-                    return extra
-
         if not 'extras' in package_dict:
             package_dict['extras'] = []
 
@@ -191,6 +218,8 @@ class DefaultExtras(BaseConfigProcessor):
 
 class DefaultValues(BaseConfigProcessor):
 
+    config_keys = ('default_values',)
+
     @staticmethod
     def check_config(config_obj):
         if 'default_values' in config_obj:
@@ -221,6 +250,8 @@ class DefaultValues(BaseConfigProcessor):
 
 class MappingFields(BaseConfigProcessor):
 
+    config_keys = ('map_fields',)
+
     @staticmethod
     def check_config(config_obj):
         if 'map_fields' in config_obj:
@@ -316,6 +347,8 @@ class MappingFields(BaseConfigProcessor):
 
 class CompositeMapping(BaseConfigProcessor):
 
+    config_keys = ('composite_field_mapping',)
+
     @staticmethod
     def check_config(config_obj):
         if 'composite_field_mapping' in config_obj:
@@ -354,6 +387,8 @@ class CompositeMapping(BaseConfigProcessor):
 
 class Publisher(BaseConfigProcessor):
 
+    config_keys = ('publisher',)
+
     @staticmethod
     def check_config(config_obj):
         if 'publisher' in config_obj:
@@ -379,6 +414,8 @@ class Publisher(BaseConfigProcessor):
 
 class ContactPoint(BaseConfigProcessor):
 
+    config_keys = ('contact_point',)
+
     @staticmethod
     def check_config(config_obj):
         if 'contact_point' in config_obj:
@@ -416,8 +453,76 @@ class ContactPoint(BaseConfigProcessor):
                 package_dict['extras'].remove(existing_extra)
 
 
+class GroupIndex(object):
+    '''
+    Index of the site groups by lowercase name and title, used to find the
+    local groups of remote themes
+
+    Groups are listed once, the first time the index is used, and the groups
+    created with `create()` are added to it. It can be shared by threads.
+    '''
+
+    def __init__(self):
+        self._groups = None
+        self._user_name = None
+        self._lock = threading.Lock()
+
+    def _add(self, group_dict):
+        group = {'id': group_dict['id'], 'name': group_dict['name']}
+        for key in (group_dict.get('title'), group_dict.get('name')):
+            # Like scanning the list, the first group found wins
+            if key:
+                self._groups.setdefault(key.lower(), group)
+        return group
+
+    def _load(self):
+        if self._groups is None:
+            self._groups = {}
+            for group_dict in get_action('group_list')({}, {'all_fields': True}):
+                self._add(group_dict)
+
+    def get(self, theme):
+        '''
+        Returns the id and name of the group with the theme as name or title,
+        or None if not found
+        '''
+        with self._lock:
+            self._load()
+            return self._groups.get(theme.lower())
+
+    def create(self, theme):
+        '''
+        Returns the id and name of the group for the theme, creating it if it
+        does not exist. Returns None if it could not be created.
+        '''
+        with self._lock:
+            self._load()
+            group = self._groups.get(theme.lower())
+            if group:
+                return group
+
+            group_dict = {
+                'name': theme,
+                'title': theme
+            }
+            try:
+                if self._user_name is None:
+                    site_user = get_action('get_site_user')({'model': model, 'ignore_auth': True, 'defer_commit': True}, {})
+                    self._user_name = site_user['name']
+                new_group = get_action('group_create')({'model': model, 'user': self._user_name}, group_dict)
+            except Exception:
+                # It may have been created after the groups were listed
+                try:
+                    new_group = get_action('group_show')({'model': model}, {'id': theme})
+                except Exception:
+                    return None
+            return self._add(new_group)
+
+
 class RemoteGroups(BaseConfigProcessor):
 
+    config_keys = ('remote_groups',)
+
     @staticmethod
     def check_config(config_obj):
         if 'remote_groups' in config_obj:
@@ -425,8 +530,7 @@ class RemoteGroups(BaseConfigProcessor):
                 raise ValueError('remote_groups must be either "only_local" or "create"')
 
     @staticmethod
-    def modify_package_dict(package_dict, config, dcat_dict):
-        remote_groups = config.get('remote_groups')
+    def _add_groups(package_dict, remote_groups, dcat_dict, group_index):
         if remote_groups not in ('only_local', 'create'):
             return
 
@@ -436,35 +540,41 @@ class RemoteGroups(BaseConfigProcessor):
         # check if remote groups exist locally
         validated_groups = []
 
-        existing_groups = get_action('group_list')({}, {'all_fields': True})
-        for theme in dcat_dict.get('theme'):
-            found_group = False
-            for existing_group in existing_groups:
-                # Found local group
-                if theme == existing_group.get('title') or theme == existing_group.get('name'):
-                    found_group = True
-                    validated_groups.append({'id': existing_group['id'], 'name': existing_group['name']})
-                    break
-
-            if remote_groups == 'create' and not found_group:
-                # Group does not exist, create it
-                try:
-                    site_user = get_action('get_site_user')({'model': model, 'ignore_auth': True, 'defer_commit': True}, {})
-                    user_name = site_user['name']
-                    group_dict = {
-                        'name': theme,
-                        'title': theme
-                    }
-                    new_group = get_action('group_create')({'model': model, 'user': user_name}, group_dict)
-                    validated_groups.append({'id': new_group['id'], 'name': new_group['name']})
-                except Exception:
-                    pass
+        for theme in dcat_dict.get('theme') or []:
+            if remote_groups == 'create':
+                # Group is created if it does not exist
+                group = group_index.create(theme)
+            else:
+                group = group_index.get(theme)
+            if group:
+                validated_groups.append(dict(group))
 
         package_dict['groups'].extend(validated_groups)
 
+    @staticmethod
+    def modify_package_dict(package_dict, config, dcat_dict):
+        RemoteGroups._add_groups(
+            package_dict, config.get('remote_groups'), dcat_dict, GroupIndex())
+
+    @classmethod
+    def compile(cls, config):
+        remote_groups = config.get('remote_groups')
+        if remote_groups not in ('only_local', 'create'):
+            return None
+
+        # The site groups are listed once for all the datasets of the job
+        group_index = GroupIndex()
+
+        def modify_package_dict(package_dict, dcat_dict):
+            cls._add_groups(package_dict, remote_groups, dcat_dict, group_index)
+
+        return modify_package_dict
+
 
 class OrganizationFilter(BaseConfigProcessor):
 
+    config_keys = ()
+
     @staticmethod
     def check_config(config_obj):
         if 'organizations_filter_include' in config_obj \
@@ -486,6 +596,8 @@ class OrganizationFilter(BaseConfigProcessor):
 
 class FormatFilter(BaseConfigProcessor):
 
+    config_keys = ()
+
     @staticmethod
     def check_config(config_obj):
         for key in ['format_filter_exclude', 'format_filter_include']:
@@ -504,6 +616,8 @@ class FormatFilter(BaseConfigProcessor):
 
 class TagFilter(BaseConfigProcessor):
 
+    config_keys = ()
+
     @staticmethod
     def check_config(config_obj):
         for key in ['tag_filter_exclude', 'tag_filter_include']:
@@ -519,8 +633,132 @@ class TagFilter(BaseConfigProcessor):
         pass
 
 
+def _dcat_publisher_name(dataset):
+    publisher = dataset.get('publisher')
+    if isinstance(publisher, str):
+        return publisher
+    elif isinstance(publisher, dict) and publisher.get('name'):
+        return publisher.get('name')
+    elif isinstance(publisher, dict) and publisher.get('source'):
+        return publisher.get('source')
+    return ''
+
+
+def _dcat_formats(dataset):
+    return [
+        dist.get('format', '').lower()
+        for dist in dataset.get('distribution', [])
+        if dist.get('format')
+    ]
+
+
+def _dcat_tags(dataset):
+    keywords = dataset.get('keyword') or []
+    if isinstance(keywords, str):
+        # A single keyword can be serialized as a plain string
+        return [keywords]
+    return keywords
+
+
+def _ckan_publisher_name(dataset_dict):
+    publisher = dataset_dict.get('publisher')
+    if isinstance(publisher, list) and publisher and isinstance(publisher[0], dict):
+        # Scheming field
+        return publisher[0].get('name') or ''
+    return get_extras_index(dataset_dict).get('publisher_name') or ''
+
+
+def _ckan_formats(dataset_dict):
+    return [
+        resource.get('format', '').lower()
+        for resource in dataset_dict.get('resources', [])
+        if resource.get('format')
+    ]
+
+
+def _ckan_tags(dataset_dict):
+    return [tag['name'] for tag in dataset_dict.get('tags', [])]
+
+
+class DatasetFilter(object):
+    '''
+    The organization, format and tag filters of a harvest source config
+    (see `OrganizationFilter`, `FormatFilter` and `TagFilter`), compiled
+    once into sets so they can be checked quickly on every dataset
+
+    Use `matches()` with DCAT JSON datasets and `matches_package_dict()`
+    with CKAN dataset dicts (eg the ones returned by the RDF parser).
+    '''
+
+    def __init__(self, config_obj):
+        config_obj = config_obj or {}
+
+        def _set(key, lower=False):
+            values = config_obj.get(key)
+            if not values:
+                return None
+            return frozenset(
+                value.lower() if lower else value for value in values)
+
+        self.organizations_include = _set('organizations_filter_include')
+        self.organizations_exclude = _set('organizations_filter_exclude')
+        self.formats_include = _set('format_filter_include', lower=True)
+        self.formats_exclude = _set('format_filter_exclude', lower=True)
+        self.tags_include = _set('tag_filter_include')
+        self.tags_exclude = _set('tag_filter_exclude')
+
+        self.active = any([
+            self.organizations_include, self.organizations_exclude,
+            self.formats_include, self.formats_exclude,
+            self.tags_include, self.tags_exclude,
+        ])
+
+    def _matches(self, dataset, publisher_name, formats, tags):
+        # Values are only extracted from the dataset if a filter uses them
+        if self.organizations_include:
+            if publisher_name(dataset) not in self.organizations_include:
+                return False
+        elif self.organizations_exclude:
+            if publisher_name(dataset) in self.organizations_exclude:
+                return False
+
+        if self.formats_include or self.formats_exclude:
+            dataset_formats = formats(dataset)
+            if self.formats_exclude and not self.formats_exclude.isdisjoint(dataset_formats):
+                return False
+            if self.formats_include and self.formats_include.isdisjoint(dataset_formats):
+                return False
+
+        if self.tags_include or self.tags_exclude:
+            dataset_tags = tags(dataset)
+            if self.tags_exclude and not self.tags_exclude.isdisjoint(dataset_tags):
+                return False
+            if self.tags_include and self.tags_include.isdisjoint(dataset_tags):
+                return False
+
+        return True
+
+    def matches(self, dataset):
+        '''
+        Returns True if the DCAT JSON dataset passes all the filters
+        '''
+        if not self.active:
+            return True
+        return self._matches(dataset, _dcat_publisher_name, _dcat_formats, _dcat_tags)
+
+    def matches_package_dict(self, dataset_dict):
+        '''
+        Returns True if the CKAN dataset dict passes all the filters
+        '''
+        if not self.active:
+            return True
+        return self._matches(dataset_dict, _ckan_publisher_name, _ckan_formats, _ckan_tags)
+
+
 class ResourceFormatOrder(BaseConfigProcessor):
 
+    config_keys = ('resource_format_order',)
+
     @staticmethod
     def check_config(config_obj):
         if 'resource_format_order' in config_obj:
@@ -530,19 +768,19 @@ class ResourceFormatOrder(BaseConfigProcessor):
                 raise ValueError('resource_format_order must be a list of strings')
 
     @staticmethod
-    def modify_package_dict(package_dict, config_obj, dcat_dict):
-        resource_order = config_obj.get('resource_format_order')
-        if not resource_order:
-            return package_dict
-        resource_order = [res_format.strip().lower() for res_format in resource_order]
+    def _resource_order(config_obj):
+        return [res_format.strip().lower()
+                for res_format in config_obj.get('resource_format_order') or []]
 
+    @staticmethod
+    def _order_resources(package_dict, resource_order):
         # create OrderedDict to group resources by format
         result = OrderedDict([(res_format, []) for res_format in resource_order])
         result['unspecified_format'] = []
 
         for resource in package_dict['resources']:
             res_format = resource.get('format', '').strip().lower()
-            if res_format not in resource_order:
+            if res_format not in result:
                 result['unspecified_format'].append(resource)
                 continue
             result[res_format].append(resource)
@@ -552,9 +790,30 @@ class ResourceFormatOrder(BaseConfigProcessor):
         for val in result.values():
             package_dict['resources'] += val
 
+    @staticmethod
+    def modify_package_dict(package_dict, config_obj, dcat_dict):
+        resource_order = ResourceFormatOrder._resource_order(config_obj)
+        if not resource_order:
+            return package_dict
+        ResourceFormatOrder._order_resources(package_dict, resource_order)
+
+    @classmethod
+    def compile(cls, config):
+        # The format order is normalized once for all datasets
+        resource_order = cls._resource_order(config)
+        if not resource_order:
+            return None
+
+        def modify_package_dict(package_dict, dcat_dict):
+            cls._order_resources(package_dict, resource_order)
+
+        return modify_package_dict
+
 
 class KeepExistingResources(BaseConfigProcessor):
 
+    config_keys = ()
+
     @staticmethod
     def check_config(config_obj):
         if 'keep_existing_resources' in config_obj:
@@ -568,6 +827,8 @@ class KeepExistingResources(BaseConfigProcessor):
 
 class UploadToDatastore(BaseConfigProcessor):
 
+    config_keys = ()
+
     @staticmethod
     def check_config(config_obj):
         if 'upload_to_datastore' in config_obj:
@@ -577,3 +838,32 @@ class UploadToDatastore(BaseConfigProcessor):
     @staticmethod
     def modify_package_dict(package_dict, config, dcat_dict):
         pass
+
+
+class ConfigProcessorPipeline(object):
+    '''
+    The config processors used by a harvest source config, compiled once
+    (see `BaseConfigProcessor.compile()`) so they can be applied to all the
+    datasets of a harvest job
+
+    Processors not used by the config are left out.
+    '''
+
+    def __init__(self, processors, config):
+        self.processors = []
+        self.steps = []
+        for processor in processors:
+            step = processor.compile(config or {})
+            if step is not None:
+                self.processors.append(processor)
+                self.steps.append(step)
+
+    def modify_package_dict(self, package_dict, dcat_dict):
+        # Processors expect the extras list to be there
+        if 'extras' not in package_dict:
+            package_dict['extras'] = []
+
+        for step in self.steps:
+            step(package_dict, dcat_dict)
+
+        return package_dict
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+'''
+Indexed access to the `extras` of CKAN dicts
+
+Getting an extra by key from a dataset or resource dict requires scanning
+the whole `extras` list. `get_extras_index()` returns an index of the extras
+keys, built with a single scan, so callers that look up several keys of the
+same dict can keep it for the duration of the call instead of scanning the
+list for every key.
+
+The index is a snapshot of the dict when it was built, and is not shared
+between calls, as the dict can be modified at any point afterwards.
+'''
+
+
+class ExtrasIndex(object):
+    '''
+    Index of the `extras` list of a CKAN dict, keyed by the extra key
+
+    Changes to the values of existing extras are reflected, as the extras
+    dicts themselves are indexed, but extras added, removed or renamed
+    after the index was built are not.
+    '''
+
+    def __init__(self, _dict):
+        index = {}
+        for position, extra in enumerate(_dict.get('extras') or []):
+            key = extra.get('key')
+            # Like scanning the list, the first extra with a key wins
+            if key not in index:
+                index[key] = (position, extra)
+        self._index = index
+
+    def get_extra(self, *keys):
+        '''
+        Returns the first extra dict with any of the provided keys, or None
+        if not found
+        '''
+        found = None
+        for key in keys:
+            item = self._index.get(key)
+            if item and (found is None or item[0] < found[0]):
+                found = item
+        return found[1] if found else None
+
+    def get(self, key, default=None):
+        '''
+        Returns the value of the first extra with the provided key, or the
+        default value if not found
+        '''
+        extra = self.get_extra(key)
+        return extra['value'] if extra else default
+
+    def __contains__(self, key):
+        return key in self._index
+
+
+def get_extras_index(_dict):
+    '''
+    Returns a new `ExtrasIndex` for the given CKAN dict
+    '''
+    return ExtrasIndex(_dict)
+
+
+def get_extra_value(_dict, key, default=None):
+    '''
+    Returns the value of the extra with the provided key on a CKAN dict, or
+    the default value if not found
+    '''
+    return get_extras_index(_dict).get(key, default)
@@ -1,8 +1,8 @@
 from builtins import str
-from past.builtins import basestring
 import json
 import logging
 from hashlib import sha1
+import io
 import traceback
 import uuid
 
@@ -16,8 +16,9 @@ from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
 from ckanext.harvest.logic.schema import unicode_safe
 from ckanext.dcat import converters
 from ckanext.dcat import utils
-from ckanext.dcat.harvesters.base import DCATHarvester
+from ckanext.dcat.harvesters.base import DCATHarvester, NOT_MODIFIED
 from ckanext.dcat.exceptions import JSONDecodeErrorContext
+from ckanext.dcat.json_stream import iter_datasets
 
 log = logging.getLogger(__name__)
 
@@ -32,7 +33,34 @@ class DCATJSONHarvester(DCATHarvester):
                            'serialized as JSON'
         }
 
-    def _get_guids_and_datasets(self, content):
+    def validate_config(self, config):
+        config = super(DCATJSONHarvester, self).validate_config(config)
+        if not config:
+            return config
+
+        config_obj = json.loads(config)
+        if 'stream_parsing' in config_obj:
+            if not isinstance(config_obj['stream_parsing'], bool):
+                raise ValueError('stream_parsing must be a boolean')
+
+        return config
+
+    def _get_datasets(self, content):
+        '''
+        Generator that returns tuples with each dataset of the document and
+        its source text (None if not available)
+        '''
+        if self.config.get('stream_parsing'):
+            # Decode one dataset at a time
+            if hasattr(content, 'read'):
+                stream = content
+            elif isinstance(content, (bytes, bytearray)):
+                stream = io.BytesIO(content)
+            else:
+                stream = io.StringIO(content)
+            for dataset, as_string in iter_datasets(stream):
+                yield dataset, as_string
+            return
 
         try:
             doc = json.loads(content)
@@ -48,67 +76,31 @@ class DCATJSONHarvester(DCATHarvester):
         else:
             raise ValueError('Wrong JSON object')
 
-        # Filter datasets from particular organizations
-        org_filter_include = self.config.get('organizations_filter_include', [])
-        org_filter_exclude = self.config.get('organizations_filter_exclude', [])
-
-        # Filter datasets with particular formats
-        format_filter_exclude = self.config.get('format_filter_exclude', [])
-        format_filter_include = self.config.get('format_filter_include', [])
+        for dataset in datasets:
+            yield dataset, None
 
-        # Filter datasets with particular tags
-        tag_filter_exclude = self.config.get('tag_filter_exclude', [])
-        tag_filter_include = self.config.get('tag_filter_include', [])
+    def _get_guids_and_datasets(self, content):
 
-        for dataset in datasets:
-            # Get the organization name for the dataset
-            dcat_publisher = dataset.get('publisher')
-            if isinstance(dcat_publisher, basestring):
-                dcat_publisher_name = dcat_publisher
-            elif isinstance(dcat_publisher, dict) and dcat_publisher.get('name'):
-                dcat_publisher_name = dcat_publisher.get('name')
-            elif isinstance(dcat_publisher, dict) and dcat_publisher.get('source'):
-                dcat_publisher_name = dcat_publisher.get('source')
-            else:
-                dcat_publisher_name = ''
-
-            # Include/exclude dataset if from particular organizations
-            if org_filter_include:
-                if dcat_publisher_name not in org_filter_include:
-                    continue
-            elif org_filter_exclude:
-                if dcat_publisher_name in org_filter_exclude:
-                    continue
-
-            # Exclude/include dataset based on particular formats
-            if format_filter_exclude or format_filter_include:
-                resource_formats = [
-                    dist.get('format', '').lower()
-                    for dist in dataset.get('distribution', [])
-                    if dist.get('format')
-                ]
-            if format_filter_exclude:
-                if any(fmt in resource_formats for fmt in format_filter_exclude):
-                    continue
-            if format_filter_include:
-                if not any(fmt in resource_formats for fmt in format_filter_include):
-                    continue
-
-            # Exclude/include dataset based on particular tags
-            if tag_filter_exclude:
-                if any(tag in dataset.get('keyword', []) for tag in tag_filter_exclude):
-                    continue
-            if tag_filter_include:
-                if not any(tag in dataset.get('keyword', []) for tag in tag_filter_include):
-                    continue
-
-            as_string = json.dumps(dataset)
+        for dataset, as_string in self._get_datasets(content):
+            # Include/exclude dataset based on the organization, format and
+            # tag filters
+            if not self.dataset_filter.matches(dataset):
+                continue
 
             # Get identifier
             guid = dataset.get('identifier')
+
+            # The dump is used as content unless the source text is
+            # available, and for the guid of datasets without identifier
+            dumped = None
+            if as_string is None or not guid:
+                dumped = json.dumps(dataset)
+            if as_string is None:
+                as_string = dumped
+
             if not guid:
                 # This is bad, any ideas welcomed
-                guid = sha1(as_string.encode('utf-8')).hexdigest()
+                guid = sha1(dumped.encode('utf-8')).hexdigest()
 
             if self.config.get('parse_id_if_url'):
                 # Get id from identifier if it is a url
@@ -141,21 +133,35 @@ class DCATJSONHarvester(DCATHarvester):
         for guid, package_id in query:
             guid_to_package_id[guid] = package_id
 
-        guids_in_db = list(guid_to_package_id.keys())
-        guids_in_source = []
+        guids_in_source = set()
 
         self._set_config(harvest_job.source.config)
 
         # Get file contents
         url = harvest_job.source.url
 
-        previous_guids = []
+        # Pages downloaded on previous jobs, to make conditional requests
+        previous_pages = {}
+        if self._conditional_requests_enabled() and not self.force_import:
+            previous_pages = self._get_previous_pages(harvest_job)
+
+        # Guids of the previous page, and its fingerprint to detect when the
+        # server returns the same page again
+        previous_guids = set()
+        previous_fingerprint = None
         page = 1
         while True:
 
+            page_url = self._get_page_url(url, page)
+            previous_page = previous_pages.get(page_url)
+
             try:
+                # When streaming, the content is spooled to a file and
+                # decoded as it is parsed
                 content, content_type = \
-                    self._get_content_and_type(url, harvest_job, page)
+                    self._get_content_and_type(
+                        url, harvest_job, page, validators=previous_page,
+                        stream=bool(self.config.get('stream_parsing')))
             except requests.exceptions.HTTPError as error:
                 if error.response.status_code == 404:
                     if page > 1:
@@ -173,21 +179,32 @@ class DCATJSONHarvester(DCATHarvester):
                     # This should never happen. Raising just in case.
                     raise
 
+            if content is NOT_MODIFIED:
+                # Keep the datasets harvested from this page on previous jobs
+                log.info('Page %s not modified since the last harvest, '
+                         'skipping', page_url)
+                batch_guids = previous_page['guids']
+                guids_in_source.update(batch_guids)
+                page = page + 1
+                previous_guids = set(batch_guids)
+                previous_fingerprint = _guids_fingerprint(batch_guids)
+                continue
+
             if not content:
                 return None
 
             try:
 
                 batch_guids = []
+                page_ids = []
                 for guid, as_string in self._get_guids_and_datasets(content):
 
-                    log.debug('Got identifier: {0}'
-                              .format(guid.encode('utf8')))
+                    log.debug('Got identifier: %s', guid)
                     batch_guids.append(guid)
 
                     if guid not in previous_guids:
 
-                        if guid in guids_in_db:
+                        if guid in guid_to_package_id:
                             # Dataset needs to be udpated
                             obj = HarvestObject(
                                 guid=guid, job=harvest_job,
@@ -203,11 +220,13 @@ class DCATJSONHarvester(DCATHarvester):
                                 extras=[HarvestObjectExtra(key='status',
                                                            value='new')])
                         obj.save()
-                        ids.append(obj.id)
+                        page_ids.append(obj.id)
+
+                ids.extend(page_ids)
+                self._save_page_extras(harvest_job, page_ids, page_url)
 
                 if len(batch_guids) > 0:
-                    guids_in_source.extend(set(batch_guids)
-                                           - set(previous_guids))
+                    guids_in_source.update(batch_guids)
                 else:
                     log.debug('Empty document, no more records')
                     # Empty document, no more ids
@@ -217,38 +236,58 @@ class DCATJSONHarvester(DCATHarvester):
                 msg = 'Error parsing file: {0}'.format(str(e))
                 self._save_gather_error(msg, harvest_job)
                 return None
+            finally:
+                if hasattr(content, 'close'):
+                    content.close()
 
-            if sorted(previous_guids) == sorted(batch_guids):
+            fingerprint = _guids_fingerprint(batch_guids)
+            if fingerprint == previous_fingerprint:
                 # Server does not support pagination or no more pages
                 log.debug('Same content, no more pages')
                 break
 
             page = page + 1
 
-            previous_guids = batch_guids
+            previous_guids = set(batch_guids)
+            previous_fingerprint = fingerprint
 
         # Check datasets that need to be deleted
-        guids_to_delete = set(guids_in_db) - set(guids_in_source)
-        for guid in guids_to_delete:
-            obj = HarvestObject(
-                guid=guid, job=harvest_job,
-                package_id=guid_to_package_id[guid],
-                extras=[HarvestObjectExtra(key='status', value='delete')])
-            ids.append(obj.id)
-            model.Session.query(HarvestObject).\
-                filter_by(guid=guid).\
-                update({'current': False}, False)
-            obj.save()
-
-            # Rename package before delete so that its url can be reused
+        guids_to_delete = set(guid_to_package_id) - guids_in_source
+        ids.extend(self._mark_guids_for_deletion(
+            guids_to_delete, guid_to_package_id, harvest_job))
+
+        # Rename packages before delete so that their urls can be reused
+        self._rename_datasets_for_deletion(
+            [guid_to_package_id[guid] for guid in guids_to_delete])
+
+        return ids
+
+    def _rename_datasets_for_deletion(self, package_ids):
+        '''
+        Appends `-deleted` to the name of the given datasets
+
+        Datasets are renamed with `package_patch`, so validation, plugin
+        hooks, activities and the search index are updated as usual, but the
+        changes are committed once per batch of datasets instead of once per
+        dataset.
+        '''
+        package_ids = sorted(
+            package_id for package_id in package_ids if package_id)
+        if not package_ids:
+            return
+
+        user_name = self._get_user_name()
+        batch_size = self.HARVEST_OBJECTS_BATCH_SIZE
+        for i, package_id in enumerate(package_ids, 1):
             context = {'model': model, 'session': model.Session,
-                       'user': self._get_user_name()}
+                       'user': user_name, 'defer_commit': True}
             p.toolkit.get_action('package_patch')(context, {
-                'id': guid_to_package_id[guid],
-                'name': guid_to_package_id[guid] + '-deleted'
+                'id': package_id,
+                'name': package_id + '-deleted'
             })
-
-        return ids
+            if i % batch_size == 0:
+                model.Session.commit()
+        model.Session.commit()
 
     def fetch_stage(self, harvest_object):
         return True
@@ -259,10 +298,7 @@ class DCATJSONHarvester(DCATHarvester):
             log.error('No harvest object received')
             return False
 
-        try:
-            self._set_config(harvest_object.job.source.config)
-        except:
-            self._set_config('')
+        self._set_job_config(harvest_object)
 
         if self.force_import:
             status = 'change'
@@ -390,6 +426,14 @@ class DCATJSONHarvester(DCATHarvester):
 
         return True
 
+
+def _guids_fingerprint(guids):
+    '''
+    Returns a hash of the guids of a page that does not depend on their order
+    '''
+    return sha1(json.dumps(sorted(guids)).encode('utf-8')).hexdigest()
+
+
 def copy_across_resource_ids(existing_dataset, harvested_dataset, config=None):
     '''Compare the resources in a dataset existing in the CKAN database with
     the resources in a freshly harvested copy, and for any resources that are
@@ -1,5 +1,8 @@
 import os
+import tempfile
+import hashlib
 import logging
+from collections import defaultdict
 
 import requests
 import rdflib
@@ -11,7 +14,7 @@ from ckantoolkit import config
 import ckan.plugins.toolkit as toolkit
 
 from ckanext.harvest.harvesters import HarvesterBase
-from ckanext.harvest.model import HarvestObject
+from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
 
 from ckanext.dcat.interfaces import IDCATRDFHarvester
 
@@ -27,21 +30,38 @@ from ckanext.dcat.configuration_processors import (
     TagFilter,
     ResourceFormatOrder,
     KeepExistingResources,
-    UploadToDatastore
+    UploadToDatastore,
+    DatasetFilter,
+    ConfigProcessorPipeline,
 )
 
 
 log = logging.getLogger(__name__)
 
+CONDITIONAL_REQUESTS_CONFIG = 'ckanext.dcat.conditional_requests'
+
+# Returned as content by `_get_content_and_type` when the server responds
+# with 304 Not Modified to a conditional request
+NOT_MODIFIED = object()
+
 
 class DCATHarvester(HarvesterBase):
 
     DEFAULT_MAX_FILE_SIZE_MB = 50
     CHUNK_SIZE = 1024 * 512
+    SPOOL_MAX_SIZE = 1024 * 1024 * 10
+    HARVEST_OBJECTS_BATCH_SIZE = 1000
 
     force_import = False
 
     config = None
+    # Filters and config processors of the source config, compiled in
+    # `_set_config()`
+    dataset_filter = DatasetFilter({})
+    config_pipeline = None
+    # Job and source config last set with `_set_job_config()`
+    _config_job = None
+    _response_validators = {}
     config_processors = [
         DefaultTags,
         CleanTags,
@@ -62,7 +82,8 @@ class DCATHarvester(HarvesterBase):
     ]
 
     def _get_content_and_type(self, url, harvest_job, page=1,
-                              content_type=None):
+                              content_type=None, decode=True, validators=None,
+                              stream=False):
         '''
         Gets the content and type of the given url.
 
@@ -70,14 +91,34 @@ class DCATHarvester(HarvesterBase):
         :param harvest_job: the job, used for error reporting
         :param page: adds paging to the url
         :param content_type: will be returned as type
+        :param decode: if False, the content is returned as bytes (a
+            `bytearray` for remote files) instead of being decoded to a
+            string
+        :param stream: if True, the content is returned as a binary file
+            object positioned at the start, instead of being loaded in
+            memory (empty files are returned as empty bytes). Remote files
+            are spooled to a temporary file once they exceed
+            `SPOOL_MAX_SIZE`. Callers should close it when done.
+        :param validators: a dict with the `etag` and `last_modified` values
+            returned by the server on a previous download of the url. If
+            provided, a conditional request is made and `NOT_MODIFIED` is
+            returned as content if the server responds with 304.
         :return: a tuple containing the content and content-type
         '''
 
+        # Validators of the downloaded file, see `_save_page_extras`
+        self._response_validators = {}
+
         if not url.lower().startswith('http'):
             # Check local file
             if os.path.exists(url):
-                with open(url, 'r') as f:
-                    content = f.read()
+                if stream:
+                    # Empty files are returned as empty bytes, so callers
+                    # can check the content as usual
+                    content = open(url, 'rb') if os.path.getsize(url) else b''
+                else:
+                    with open(url, 'r' if decode else 'rb') as f:
+                        content = f.read()
                 content_type = content_type or rdflib.util.guess_format(url)
                 return content, content_type
             else:
@@ -87,12 +128,17 @@ class DCATHarvester(HarvesterBase):
 
         try:
 
-            if page > 1:
-                url = url + '&' if '?' in url else url + '?'
-                url = url + 'page={0}'.format(page)
+            url = self._get_page_url(url, page)
 
             log.debug('Getting file %s', url)
 
+            headers = {}
+            if validators:
+                if validators.get('etag'):
+                    headers['If-None-Match'] = validators['etag']
+                if validators.get('last_modified'):
+                    headers['If-Modified-Since'] = validators['last_modified']
+
             # get the `requests` session object
             with requests.Session() as session:
                 for harvester in p.PluginImplementations(IDCATRDFHarvester):
@@ -100,11 +146,14 @@ class DCATHarvester(HarvesterBase):
 
                 # first we try a HEAD request which may not be supported
                 did_get = False
-                r = session.head(url)
+                r = session.head(url, headers=headers)
 
                 if r.status_code == 405 or r.status_code == 400:
-                    r = session.get(url, stream=True)
+                    r = session.get(url, stream=True, headers=headers)
                     did_get = True
+                if r.status_code == 304:
+                    log.debug('File %s not modified', url)
+                    return NOT_MODIFIED, content_type
                 r.raise_for_status()
 
                 max_file_size = 1024 * 1024 * toolkit.asint(config.get('ckanext.dcat.max_file_size', self.DEFAULT_MAX_FILE_SIZE_MB))
@@ -117,21 +166,49 @@ class DCATHarvester(HarvesterBase):
                     return None, None
 
                 if not did_get:
-                    r = session.get(url, stream=True)
-
+                    r = session.get(url, stream=True, headers=headers)
+                    if r.status_code == 304:
+                        log.debug('File %s not modified', url)
+                        return NOT_MODIFIED, content_type
+
+                # Chunks are appended to a single buffer (or spooled to a
+                # temporary file), the size limit is checked as they are
+                # received
+                if stream:
+                    content = tempfile.SpooledTemporaryFile(
+                        max_size=self.SPOOL_MAX_SIZE)
+                else:
+                    content = bytearray()
                 length = 0
-                content = b''
                 for chunk in r.iter_content(chunk_size=self.CHUNK_SIZE):
-                    content = content + chunk
-
+                    if stream:
+                        content.write(chunk)
+                    else:
+                        content.extend(chunk)
                     length += len(chunk)
 
                     if length >= max_file_size:
+                        if stream:
+                            content.close()
                         self._save_gather_error('Remote file is too big.',
                                                 harvest_job)
                         return None, None
 
-                content = content.decode('utf-8')
+                if stream:
+                    if length:
+                        content.seek(0)
+                    else:
+                        content.close()
+                        content = b''
+                elif decode:
+                    content = content.decode('utf-8')
+
+                self._response_validators = dict(
+                    (key, value) for key, value in (
+                        ('etag', r.headers.get('etag')),
+                        ('last_modified', r.headers.get('last-modified')),
+                    ) if value
+                )
 
                 if content_type is None and r.headers.get('content-type'):
                     content_type = r.headers.get('content-type').split(";", 1)[0]
@@ -158,6 +235,141 @@ class DCATHarvester(HarvesterBase):
             self._save_gather_error(msg, harvest_job)
             return None, None
 
+    def _get_page_url(self, url, page=1):
+        if page > 1:
+            url = url + '&' if '?' in url else url + '?'
+            url = url + 'page={0}'.format(page)
+        return url
+
+    def _conditional_requests_enabled(self):
+        return toolkit.asbool(config.get(CONDITIONAL_REQUESTS_CONFIG, False))
+
+    def _get_source_config_hash(self, harvest_source):
+        return hashlib.sha1(
+            (harvest_source.config or '').encode('utf-8')).hexdigest()
+
+    def _get_previous_pages(self, harvest_job):
+        '''
+        Returns the details of the pages downloaded on previous jobs of the
+        source, keyed by the page url
+
+        Each page is a dict with the `etag`, `last_modified` and `next_url`
+        values stored by `_save_page_extras`, plus the `guids` and
+        `package_ids` of the datasets in it.
+
+        Only pages whose datasets are all current and were imported
+        successfully with the current source config are returned, so they
+        can be safely skipped if they have not been modified.
+        '''
+        query = model.Session.query(HarvestObject.guid,
+                                    HarvestObject.package_id,
+                                    HarvestObjectExtra.value) \
+            .join(HarvestObjectExtra,
+                  HarvestObjectExtra.harvest_object_id == HarvestObject.id) \
+            .filter(HarvestObject.current == True) \
+            .filter(HarvestObject.state == 'COMPLETE') \
+            .filter(HarvestObject.harvest_source_id == harvest_job.source.id) \
+            .filter(HarvestObjectExtra.key == 'page')
+
+        objects_by_page = defaultdict(list)
+        for guid, package_id, value in query:
+            objects_by_page[value].append((guid, package_id))
+
+        config_hash = self._get_source_config_hash(harvest_job.source)
+
+        pages = {}
+        for value, objects in objects_by_page.items():
+            try:
+                page = json.loads(value)
+            except ValueError:
+                continue
+            if (page.get('size') != len(objects)
+                    or page.get('config') != config_hash):
+                continue
+            page['guids'] = set(guid for guid, package_id in objects)
+            page['package_ids'] = [package_id for guid, package_id in objects
+                                   if package_id]
+            pages[page['url']] = page
+
+        return pages
+
+    def _save_page_extras(self, harvest_job, object_ids, page_url,
+                          next_page_url=None):
+        '''
+        Stores the validators of the last downloaded page (if the server
+        returned any) as a `page` extra on each harvest object created from
+        it, so the next job can make a conditional request for the page
+        '''
+        if not object_ids or not self._response_validators:
+            return
+
+        value = json.dumps({
+            'url': page_url,
+            'etag': self._response_validators.get('etag'),
+            'last_modified': self._response_validators.get('last_modified'),
+            'next_url': next_page_url,
+            'size': len(object_ids),
+            'config': self._get_source_config_hash(harvest_job.source),
+        }, sort_keys=True)
+
+        model.Session.add_all([
+            HarvestObjectExtra(harvest_object_id=object_id, key='page',
+                               value=value)
+            for object_id in object_ids
+        ])
+        model.Session.commit()
+
+    def _save_harvest_objects(self, harvest_objects):
+        '''
+        Adds the given harvest objects to the session and commits them all
+        at once
+
+        Returns a list with the ids of the saved objects, in the same order.
+        '''
+        if not harvest_objects:
+            return []
+
+        model.Session.add_all(harvest_objects)
+        # Flush first so the ids are generated
+        model.Session.flush()
+        object_ids = [obj.id for obj in harvest_objects]
+        model.Session.commit()
+
+        return object_ids
+
+    def _mark_guids_for_deletion(self, guids_to_delete, guid_to_package_id,
+                                 harvest_job):
+        '''
+        Creates a HarvestObject flagged for deletion for each of the given
+        guids, and marks all previous objects for these guids as not current
+
+        Guids are processed in chunks of `HARVEST_OBJECTS_BATCH_SIZE`, with
+        a single UPDATE and a single commit per chunk.
+
+        Returns a list with the ids of the Harvest Objects to delete.
+        '''
+        object_ids = []
+
+        guids_to_delete = sorted(guids_to_delete)
+        batch_size = self.HARVEST_OBJECTS_BATCH_SIZE
+        for i in range(0, len(guids_to_delete), batch_size):
+            guids = guids_to_delete[i:i + batch_size]
+
+            model.Session.query(HarvestObject) \
+                         .filter(HarvestObject.guid.in_(guids)) \
+                         .update({'current': False}, synchronize_session=False)
+
+            objs = [
+                HarvestObject(guid=guid, job=harvest_job,
+                              package_id=guid_to_package_id[guid],
+                              extras=[HarvestObjectExtra(key='status',
+                                                         value='delete')])
+                for guid in guids
+            ]
+            object_ids.extend(self._save_harvest_objects(objs))
+
+        return object_ids
+
     def _get_object_extra(self, harvest_object, key):
         '''
         Helper function for retrieving the value from a harvest object extra,
@@ -237,16 +449,10 @@ class DCATHarvester(HarvesterBase):
             creating or updating the actual package.
         '''
 
-        try:
-            self._set_config(harvest_object.job.source.config)
-        except:
-            self._set_config('')
-
-        # Modify package_dict using config_processors
-        for processor in self.config_processors:
-            processor.modify_package_dict(package_dict, self.config, dcat_dict)
+        self._set_job_config(harvest_object)
 
-        return package_dict
+        # Modify package_dict using the config_processors used by the source
+        return self.config_pipeline.modify_package_dict(package_dict, dcat_dict)
 
     def _set_config(self, config_str):
         if config_str:
@@ -254,6 +460,33 @@ class DCATHarvester(HarvesterBase):
             log.debug('Using config: %r', self.config)
         else:
             self.config = {}
+        self.dataset_filter = DatasetFilter(self.config)
+        self.config_pipeline = ConfigProcessorPipeline(
+            self.config_processors, self.config)
+        self._config_job = None
+
+    def _set_job_config(self, harvest_object):
+        '''
+        Sets the config of the harvest object source, unless it was already
+        set for the same job and source config, so it is only parsed and
+        compiled once per job
+        '''
+        try:
+            job_id = harvest_object.job.id
+            config_str = harvest_object.job.source.config
+        except Exception:
+            job_id = None
+            config_str = ''
+
+        config_job = (job_id, config_str)
+        if job_id is not None and config_job == self._config_job:
+            return
+
+        try:
+            self._set_config(config_str)
+        except Exception:
+            self._set_config('')
+        self._config_job = config_job
 
     def validate_config(self, config):
         if not config:
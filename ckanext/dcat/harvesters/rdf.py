@@ -1,13 +1,19 @@
 from builtins import str
 from past.builtins import basestring
+import io
 import json
 import uuid
 import logging
 import hashlib
 import traceback
+from collections import Counter
 
+import rdflib.plugin
+import rdflib.store
 import sqlalchemy as sa
 
+from ckantoolkit import config
+
 import ckan.plugins as p
 import ckan.model as model
 
@@ -15,12 +21,26 @@ import ckan.lib.plugins as lib_plugins
 
 from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
 from ckanext.harvest.logic.schema import unicode_safe
-from ckanext.dcat.harvesters.base import DCATHarvester
-from ckanext.dcat.processors import RDFParserException, RDFParser
+from ckanext.dcat.configuration_processors import (
+    OrganizationFilter,
+    FormatFilter,
+    TagFilter,
+    DatasetFilter,
+)
+from ckanext.dcat.harvesters.base import DCATHarvester, NOT_MODIFIED
+from ckanext.dcat.extras import get_extras_index
+from ckanext.dcat.processors import (
+    RDFParserException,
+    RDFParser,
+    LINE_BASED_FORMATS,
+)
 from ckanext.dcat.interfaces import IDCATRDFHarvester
 
 log = logging.getLogger(__name__)
 
+PARSER_WORKERS_CONFIG = 'ckanext.dcat.parser_workers'
+SKIP_UNCHANGED_CONFIG = 'ckanext.dcat.skip_unchanged_datasets'
+
 
 class DCATRDFHarvester(DCATHarvester):
 
@@ -31,7 +51,8 @@ class DCATRDFHarvester(DCATHarvester):
             'description': 'Harvester for DCAT datasets from an RDF graph'
         }
 
-    _names_taken = []
+    _names_taken = set()
+    _name_prefixes = Counter()
 
     def _get_dict_value(self, _dict, key, default=None):
         '''
@@ -47,12 +68,51 @@ class DCATRDFHarvester(DCATHarvester):
         if key in _dict:
             return _dict[key]
 
-        for extra in _dict.get('extras', []):
-            if extra['key'] == key or extra['key'] == 'dcat_' + key:
-                return extra['value']
+        extra = get_extras_index(_dict).get_extra(key, 'dcat_' + key)
+        if extra:
+            return extra['value']
 
         return default
 
+    def _reset_names_taken(self):
+        self._names_taken = set()
+        self._name_prefixes = Counter()
+
+    def _get_unique_name(self, name):
+        '''
+        Returns the name to use for a dataset harvested in this job
+
+        If the name was already used by another dataset a suffix is added,
+        with the number of names taken that start with `<name>-` plus one.
+
+        To avoid scanning all names taken, `_name_prefixes` keeps how many of
+        them start with each possible `<prefix>-`.
+        '''
+        if name in self._names_taken:
+            name = '{}-{}'.format(name, self._name_prefixes[name] + 1)
+
+        self._add_name_taken(name)
+
+        return name
+
+    def _add_name_taken(self, name):
+        self._names_taken.add(name)
+        for index, char in enumerate(name):
+            if char == '-':
+                self._name_prefixes[name[:index]] += 1
+
+    def _add_dataset_names_taken(self, package_ids):
+        '''
+        Registers the names of existing datasets that were not downloaded
+        again, so new datasets with the same name get a suffix as before
+        '''
+        batch_size = self.HARVEST_OBJECTS_BATCH_SIZE
+        for i in range(0, len(package_ids), batch_size):
+            query = model.Session.query(model.Package.name) \
+                .filter(model.Package.id.in_(package_ids[i:i + batch_size]))
+            for name, in query:
+                self._add_name_taken(name)
+
     def _get_guid(self, dataset_dict, source_url=None):
         '''
         Try to get a unique identifier for a harvested dataset
@@ -97,8 +157,6 @@ class DCATRDFHarvester(DCATHarvester):
         Returns a list with the ids of the Harvest Objects to delete.
         '''
 
-        object_ids = []
-
         # Get all previous current guids and dataset ids for this source
         query = model.Session.query(HarvestObject.guid, HarvestObject.package_id) \
                              .filter(HarvestObject.current==True) \
@@ -108,26 +166,47 @@ class DCATRDFHarvester(DCATHarvester):
         for guid, package_id in query:
             guid_to_package_id[guid] = package_id
 
-        guids_in_db = list(guid_to_package_id.keys())
-
         # Get objects/datasets to delete (ie in the DB but not in the source)
-        guids_to_delete = set(guids_in_db) - set(guids_in_source)
+        guids_to_delete = set(guid_to_package_id) - set(guids_in_source)
 
         # Create a harvest object for each of them, flagged for deletion
-        for guid in guids_to_delete:
-            obj = HarvestObject(guid=guid, job=harvest_job,
-                                package_id=guid_to_package_id[guid],
-                                extras=[HarvestObjectExtra(key='status',
-                                                           value='delete')])
-
-            # Mark the rest of objects for this guid as not current
-            model.Session.query(HarvestObject) \
-                         .filter_by(guid=guid) \
-                         .update({'current': False}, False)
-            obj.save()
-            object_ids.append(obj.id)
+        return self._mark_guids_for_deletion(guids_to_delete, guid_to_package_id,
+                                             harvest_job)
 
-        return object_ids
+    def _get_content_hash(self, dataset_dict, harvest_job):
+        '''
+        Returns a hash of the parsed dataset and the harvest source config,
+        used to check if the dataset changed since the last harvest
+        '''
+        content_hash = hashlib.sha1()
+        content_hash.update(self._get_source_config_hash(harvest_job.source).encode('utf8'))
+        content_hash.update(json.dumps(dataset_dict, sort_keys=True).encode('utf8'))
+        return content_hash.hexdigest()
+
+    def _is_unchanged(self, harvest_object, previous_object):
+        '''
+        Checks if the dataset of the harvest object is the same as the one
+        successfully imported from the previous object, and the dataset still
+        exists
+
+        Always False unless `ckanext.dcat.skip_unchanged_datasets` is enabled.
+        '''
+        if not p.toolkit.asbool(config.get(SKIP_UNCHANGED_CONFIG, False)):
+            return False
+
+        if self.force_import or not previous_object or not previous_object.package_id:
+            return False
+
+        # Failed imports are flagged as current too
+        if previous_object.state != 'COMPLETE':
+            return False
+
+        content_hash = self._get_object_extra(harvest_object, 'content_hash')
+        if not content_hash or content_hash != self._get_object_extra(previous_object, 'content_hash'):
+            return False
+
+        package = model.Package.get(previous_object.package_id)
+        return bool(package and package.state == 'active')
 
     def validate_config(self, source_config):
         if not source_config:
@@ -142,6 +221,22 @@ class DCATRDFHarvester(DCATHarvester):
             if rdf_format not in supported_formats:
                 raise ValueError('rdf_format should be one of: ' + ", ".join(supported_formats))
 
+        if 'stream_parsing' in source_config_obj:
+            if not isinstance(source_config_obj['stream_parsing'], bool):
+                raise ValueError('stream_parsing must be a boolean')
+
+        if 'graph_store' in source_config_obj:
+            graph_store = source_config_obj['graph_store']
+            if not isinstance(graph_store, basestring):
+                raise ValueError('graph_store must be a string')
+            try:
+                rdflib.plugin.get(graph_store, rdflib.store.Store)
+            except rdflib.plugin.PluginException:
+                raise ValueError('Unknown graph_store: {0}'.format(graph_store))
+
+        for processor in [OrganizationFilter, FormatFilter, TagFilter]:
+            processor.check_config(source_config_obj)
+
         return source_config
 
     def gather_stage(self, harvest_job):
@@ -149,16 +244,30 @@ class DCATRDFHarvester(DCATHarvester):
         log.debug('In DCATRDFHarvester gather_stage')
 
         rdf_format = None
+        stream_parsing = False
+        graph_store = None
+        dataset_filter = DatasetFilter({})
         if harvest_job.source.config:
-            rdf_format = json.loads(harvest_job.source.config).get("rdf_format")
+            source_config = json.loads(harvest_job.source.config)
+            rdf_format = source_config.get("rdf_format")
+            stream_parsing = source_config.get("stream_parsing", False)
+            graph_store = source_config.get("graph_store")
+            dataset_filter = DatasetFilter(source_config)
 
         # Get file contents of first page
         next_page_url = harvest_job.source.url
 
-        guids_in_source = []
+        guids_in_source = set()
         object_ids = []
         last_content_hash = None
-        self._names_taken = []
+        self._reset_names_taken()
+
+        parser_workers = p.toolkit.asint(config.get(PARSER_WORKERS_CONFIG, 1))
+
+        # Pages downloaded on previous jobs, to make conditional requests
+        previous_pages = {}
+        if self._conditional_requests_enabled() and not self.force_import:
+            previous_pages = self._get_previous_pages(harvest_job)
 
         while next_page_url:
             for harvester in p.PluginImplementations(IDCATRDFHarvester):
@@ -170,21 +279,51 @@ class DCATRDFHarvester(DCATHarvester):
                 if not next_page_url:
                     return []
 
-            content, rdf_format = self._get_content_and_type(next_page_url, harvest_job, 1, content_type=rdf_format)
+            page_url = next_page_url
+            previous_page = previous_pages.get(page_url)
+
+            # Get a file object with the raw bytes, rdflib will take care of
+            # decoding them
+            content, rdf_format = self._get_content_and_type(page_url, harvest_job, 1,
+                                                             content_type=rdf_format,
+                                                             validators=previous_page,
+                                                             stream=True)
+
+            if content is NOT_MODIFIED:
+                # Keep the datasets harvested from this page on previous jobs
+                log.info('Page %s not modified since the last harvest, skipping', page_url)
+                guids_in_source.update(previous_page['guids'])
+                self._add_dataset_names_taken(previous_page['package_ids'])
+                next_page_url = previous_page['next_url']
+                continue
 
             content_hash = hashlib.md5()
             if content:
-                content_hash.update(content.encode('utf8'))
+                for chunk in iter(lambda: content.read(self.CHUNK_SIZE), b''):
+                    content_hash.update(chunk)
+                content.seek(0)
 
             if last_content_hash:
                 if content_hash.digest() == last_content_hash.digest():
                     log.warning('Remote content was the same even when using a paginated URL, skipping')
+                    if content:
+                        content.close()
                     break
             else:
                 last_content_hash = content_hash
 
+            # Extensions get the content as a string, so only load it in
+            # memory if any of them actually modifies it
+            after_download_plugins = [
+                harvester for harvester in p.PluginImplementations(IDCATRDFHarvester)
+                if type(harvester).after_download is not IDCATRDFHarvester.after_download
+            ]
+            if content and after_download_plugins:
+                with content:
+                    content = content.read().decode('utf-8')
+
             # TODO: store content?
-            for harvester in p.PluginImplementations(IDCATRDFHarvester):
+            for harvester in after_download_plugins:
                 content, after_download_errors = harvester.after_download(content, harvest_job)
 
                 for error_msg in after_download_errors:
@@ -194,13 +333,22 @@ class DCATRDFHarvester(DCATHarvester):
                 return []
 
             # TODO: profiles conf
-            parser = RDFParser()
+            parser = RDFParser(graph_store=graph_store)
 
             try:
-                parser.parse(content, _format=rdf_format)
+                if stream_parsing and rdf_format in LINE_BASED_FORMATS:
+                    # Build the graph of each dataset on its own
+                    stream = (io.StringIO(content) if isinstance(content, str)
+                              else content)
+                    parser.parse_stream(stream, _format=rdf_format)
+                else:
+                    parser.parse(content, _format=rdf_format)
             except RDFParserException as e:
                 self._save_gather_error('Error parsing the RDF file: {0}'.format(e), harvest_job)
                 return []
+            finally:
+                if hasattr(content, 'close'):
+                    content.close()
 
             for harvester in p.PluginImplementations(IDCATRDFHarvester):
                 parser, after_parsing_errors = harvester.after_parsing(parser, harvest_job)
@@ -215,13 +363,23 @@ class DCATRDFHarvester(DCATHarvester):
 
                 source_dataset = model.Package.get(harvest_job.source.id)
 
-                for dataset in parser.datasets():
+                if parser_workers > 1:
+                    datasets = parser.datasets(workers=parser_workers)
+                else:
+                    datasets = parser.datasets()
+
+                # Harvest objects are saved in batches to avoid a commit per dataset
+                pending_objects = []
+                page_object_ids = []
+                for dataset in datasets:
+                    # Include/exclude dataset based on the organization,
+                    # format and tag filters
+                    if not dataset_filter.matches_package_dict(dataset):
+                        continue
+
                     if not dataset.get('name'):
                         dataset['name'] = self._gen_new_name(dataset['title'])
-                    if dataset['name'] in self._names_taken:
-                        suffix = len([i for i in self._names_taken if i.startswith(dataset['name'] + '-')]) + 1
-                        dataset['name'] = '{}-{}'.format(dataset['name'], suffix)
-                    self._names_taken.append(dataset['name'])
+                    dataset['name'] = self._get_unique_name(dataset['name'])
 
                     # Unless already set by the parser, get the owner organization (if any)
                     # from the harvest source dataset
@@ -238,20 +396,33 @@ class DCATRDFHarvester(DCATHarvester):
                         continue
 
                     dataset['extras'].append({'key': 'guid', 'value': guid})
-                    guids_in_source.append(guid)
+                    guids_in_source.add(guid)
 
+                    content = json.dumps(dataset)
                     obj = HarvestObject(guid=guid, job=harvest_job,
-                                        content=json.dumps(dataset))
-
-                    obj.save()
-                    object_ids.append(obj.id)
+                                        content=content,
+                                        extras=[HarvestObjectExtra(
+                                            key='content_hash',
+                                            value=self._get_content_hash(dataset, harvest_job))])
+
+                    pending_objects.append(obj)
+                    if len(pending_objects) >= self.HARVEST_OBJECTS_BATCH_SIZE:
+                        page_object_ids.extend(self._save_harvest_objects(pending_objects))
+                        pending_objects = []
+
+                page_object_ids.extend(self._save_harvest_objects(pending_objects))
+                object_ids.extend(page_object_ids)
             except Exception as e:
                 self._save_gather_error('Error when processsing dataset: %r / %s' % (e, traceback.format_exc()),
                                         harvest_job)
+                parser.close()
                 return []
 
             # get the next page
             next_page_url = parser.next_page()
+            parser.close()
+
+            self._save_page_extras(harvest_job, page_object_ids, page_url, next_page_url)
 
         # Check if some datasets need to be deleted
         object_ids_to_delete = self._mark_datasets_for_deletion(guids_in_source, harvest_job)
@@ -310,6 +481,13 @@ class DCATRDFHarvester(DCATHarvester):
         harvest_object.current = True
         harvest_object.add()
 
+        if self._is_unchanged(harvest_object, previous_object):
+            harvest_object.package_id = previous_object.package_id
+            harvest_object.add()
+            model.Session.commit()
+            log.info('Dataset with guid %s has not changed, skipping' % harvest_object.guid)
+            return 'unchanged'
+
         context = {
             'user': self._get_user_name(),
             'return_id_only': True,
@@ -61,6 +61,9 @@ class IDCATRDFHarvester(Interface):
         This extension point can be useful to validate the file contents using
         an external service.
 
+        It is not called for pages that were not modified since the previous
+        harvest (see ``ckanext.dcat.conditional_requests``).
+
         :param content: The remote RDF file contents
         :type content: string
         :param harvest_job: A ``HarvestJob`` domain object which contains a
@@ -110,6 +113,10 @@ class IDCATRDFHarvester(Interface):
         Called just before the ``package_update`` action.
         It may be used to preprocess the dataset dict.
 
+        Not called for datasets that have not changed since the last harvest
+        if ``ckanext.dcat.skip_unchanged_datasets`` is enabled, as they are
+        not updated.
+
         If the content of the dataset dict is emptied (i.e. set to ``None``), 
         the dataset will not be updated in CKAN, but simply ignored.
 
@@ -133,6 +140,9 @@ class IDCATRDFHarvester(Interface):
         Called just after a successful ``package_update`` action has been
         performed.
 
+        Not called for the datasets skipped by
+        ``ckanext.dcat.skip_unchanged_datasets``.
+
         :param harvest_object: A ``HarvestObject`` domain object.
         :type harvest_job: object
         :param dataset_dict: The dataset dict that has just been stored into
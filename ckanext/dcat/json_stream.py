@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+'''
+Incremental decoding of large DCAT JSON documents (eg DCAT-US `data.json`)
+
+`iter_datasets()` reads the document from a stream in chunks and returns the
+datasets one at a time, together with their source text, so the whole
+document is never decoded into memory at once.
+'''
+import codecs
+import json
+
+# Number of bytes (or characters) read from the stream at a time
+CHUNK_SIZE = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+
+class _Reader(object):
+    '''
+    Keeps the part of the document that has not been decoded yet
+    '''
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        # Position in the buffer, and position of the buffer in the document
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+        self._text_decoder = None
+
+    def error(self, msg, pos=None):
+        return ValueError('{0} (char {1})'.format(
+            msg, self.offset + (self.pos if pos is None else pos)))
+
+    def read(self, size=None):
+        '''
+        Adds the next chunk of the stream to the buffer
+
+        Returns False if the end of the stream was already reached
+        '''
+        if self.eof:
+            return False
+
+        data = self.stream.read(size or self.chunk_size)
+        if isinstance(data, bytes):
+            if self._text_decoder is None:
+                self._text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+            text = self._text_decoder.decode(data, final=not data)
+        else:
+            text = data
+
+        if not data:
+            self.eof = True
+        self.buffer += text
+        return True
+
+    def compact(self):
+        '''
+        Removes the text already decoded from the buffer
+        '''
+        if self.pos >= self.chunk_size:
+            self.buffer = self.buffer[self.pos:]
+            self.offset += self.pos
+            self.pos = 0
+
+    def peek(self):
+        '''
+        Skips whitespace and returns the next character, or None at the
+        end of the document
+        '''
+        while True:
+            while (self.pos < len(self.buffer)
+                    and self.buffer[self.pos] in _whitespace):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read():
+                return None
+
+    def value(self):
+        '''
+        Decodes the next JSON value
+
+        Returns a tuple with the value and its source text
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # The value may continue in the next chunks
+                if self.read(max(self.chunk_size, len(self.buffer) - self.pos)):
+                    continue
+                raise self.error(e.msg, e.pos)
+
+            # Numbers may continue in the next chunks as well
+            if end == len(self.buffer) and self.read():
+                continue
+
+            text = self.buffer[self.pos:end]
+            self.pos = end
+            return value, text
+
+    def array_items(self):
+        '''
+        Generator that returns the values of the array starting at the
+        current position (after the opening bracket)
+        '''
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+            self.compact()
+
+            char = self.peek()
+            if char == ',':
+                self.pos += 1
+            elif char == ']':
+                self.pos += 1
+                return
+            else:
+                raise self.error("Expecting ',' delimiter")
+
+    def object_keys(self):
+        '''
+        Generator that returns the keys of the object starting at the current
+        position (after the opening brace). The value of each key must be
+        read before getting the next key.
+        '''
+        char = self.peek()
+        if char == '}':
+            self.pos += 1
+            return
+
+        while True:
+            if char != '"':
+                raise self.error(
+                    'Expecting property name enclosed in double quotes')
+            key, _ = self.value()
+
+            if self.peek() != ':':
+                raise self.error("Expecting ':' delimiter")
+            self.pos += 1
+
+            yield key
+
+            char = self.peek()
+            if char == ',':
+                self.pos += 1
+                char = self.peek()
+            elif char == '}':
+                self.pos += 1
+                return
+            else:
+                raise self.error("Expecting ',' delimiter")
+
+
+def iter_datasets(stream, chunk_size=CHUNK_SIZE):
+    '''
+    Generator that returns the datasets of a DCAT JSON document
+
+    The document can be a list of datasets or an object with a `dataset`
+    list (like DCAT-US catalogs). `stream` is a file-like object, opened
+    in binary (UTF-8) or text mode, that is read in chunks of `chunk_size`.
+
+    Returns tuples with the decoded dataset and its source text. Raises
+    ValueError if the document is not valid JSON or has another structure.
+    '''
+    reader = _Reader(stream, chunk_size)
+
+    char = reader.peek()
+    if char == '[':
+        reader.pos += 1
+        for item in reader.array_items():
+            yield item
+    elif char == '{':
+        reader.pos += 1
+        for key in reader.object_keys():
+            if key == 'dataset':
+                if reader.peek() != '[':
+                    raise ValueError('Wrong JSON object')
+                reader.pos += 1
+                for item in reader.array_items():
+                    yield item
+            else:
+                reader.value()
+                reader.compact()
+    elif char is None:
+        raise reader.error('Expecting value')
+    else:
+        # Other JSON values
+        reader.value()
+        raise ValueError('Wrong JSON object')
+
+    if reader.peek() is not None:
+        raise reader.error('Extra data')
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+'''
+Fast JSON-LD output for the graphs built by the RDF profiles
+
+rdflib's JSON-LD serializer is generic and slow. `graph_to_jsonld()` builds
+the equivalent compacted document straight from the graph triples, with one
+node object per subject and the graph namespaces as prefixes, so it can be
+dumped with `json.dumps()` (see `dumps()`).
+'''
+import json
+import re
+
+from rdflib import BNode, Literal
+from rdflib.namespace import RDF, XSD
+
+# Suffixes that can be part of a compact IRI (eg `dcat:Dataset`)
+_compact_suffix_re = re.compile(r'^[A-Za-z_][\w.\-]*$')
+
+
+class _Compactor(object):
+    '''
+    Turns IRIs into compact IRIs using the namespaces bound to the graph,
+    keeping track of the prefixes used
+    '''
+
+    def __init__(self, graph):
+        self.prefixes = {}
+        for prefix, namespace in graph.namespaces():
+            if prefix and str(namespace) not in self.prefixes:
+                self.prefixes[str(namespace)] = prefix
+        self.used = {}
+
+    def compact(self, iri):
+        iri = str(iri)
+        position = max(iri.rfind('#'), iri.rfind('/')) + 1
+        prefix = self.prefixes.get(iri[:position])
+        if prefix and _compact_suffix_re.match(iri[position:]):
+            self.used[prefix] = iri[:position]
+            return prefix + ':' + iri[position:]
+        return iri
+
+    def context(self):
+        return dict(self.used)
+
+
+def _node_id(node):
+    if isinstance(node, BNode):
+        return '_:' + str(node)
+    return str(node)
+
+
+def _literal_value(literal, compactor):
+    value = str(literal)
+    if literal.language:
+        return {'@value': value, '@language': literal.language}
+    datatype = literal.datatype
+    if datatype is None:
+        return value
+    # Native JSON values, only if they keep the same lexical form
+    if datatype == XSD.boolean and value in ('true', 'false'):
+        return value == 'true'
+    if datatype == XSD.integer and value == str(literal.toPython()):
+        return literal.toPython()
+    return {'@value': value, '@type': compactor.compact(datatype)}
+
+
+def _sort_key(value):
+    return json.dumps(value, sort_keys=True)
+
+
+def graph_to_jsonld(graph):
+    '''
+    Returns a dict with the JSON-LD document for the triples of the graph
+
+    The document is equivalent to the one returned by rdflib's JSON-LD
+    serializer with `auto_compact=True`, ie parsing any of them returns
+    isomorphic graphs. Node objects and the values of each property are
+    sorted, so the same graph always returns the same document.
+    '''
+    compactor = _Compactor(graph)
+
+    nodes = {}
+    for s, p, o in graph:
+        node_id = _node_id(s)
+        node = nodes.get(node_id)
+        if node is None:
+            node = nodes[node_id] = {'@id': node_id}
+
+        if p == RDF.type and not isinstance(o, Literal):
+            key = '@type'
+            value = _node_id(o) if isinstance(o, BNode) else compactor.compact(o)
+        else:
+            key = compactor.compact(p)
+            if isinstance(o, Literal):
+                value = _literal_value(o, compactor)
+            else:
+                value = {'@id': _node_id(o)}
+
+        if key not in node:
+            node[key] = value
+        elif isinstance(node[key], list):
+            node[key].append(value)
+        else:
+            node[key] = [node[key], value]
+
+    # Values of multi-valued properties are sorted, as the order of the
+    # graph triples is not deterministic
+    for node in nodes.values():
+        for key, value in node.items():
+            if isinstance(value, list):
+                value.sort(key=_sort_key)
+
+    node_objects = [nodes[node_id] for node_id in sorted(nodes)]
+
+    document = {'@context': compactor.context()}
+    if len(node_objects) == 1:
+        document.update(node_objects[0])
+    else:
+        document['@graph'] = node_objects
+    return document
+
+
+def dumps(document, **kwargs):
+    '''
+    Returns the JSON-LD document as a string, formatted like rdflib does
+    '''
+    options = dict(indent=2, separators=(',', ': '), sort_keys=True,
+                   ensure_ascii=False)
+    options.update(kwargs)
+    return json.dumps(document, **options)
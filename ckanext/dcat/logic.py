@@ -1,26 +1,49 @@
 from __future__ import division
+import base64
 import math
+import re
+from datetime import timezone
 
 from ckantoolkit import config
 from dateutil.parser import parse as dateutil_parse
 
+from ckan import model
 from ckan.plugins import toolkit
 
 import ckanext.dcat.converters as converters
 
+from ckanext.dcat.cache import get_dataset_cache, dataset_cache_version
 from ckanext.dcat.processors import RDFSerializer
 from ckanext.dcat.utils import catalog_uri
 
 DATASETS_PER_PAGE = 100
+CURSOR_PAGINATION_CONFIG = 'ckanext.dcat.cursor_pagination'
 
 wrong_page_exception = toolkit.ValidationError(
     'Page param must be a positive integer starting in 1')
+wrong_cursor_exception = toolkit.ValidationError(
+    'Cursor param must be a value returned in a previous page')
+
+# Dataset ids and names can be used as is in Solr queries
+dataset_id_re = re.compile(r'^[\w\-]+$')
 
 
 def dcat_dataset_show(context, data_dict):
 
     toolkit.check_access('dcat_dataset_show', context, data_dict)
 
+    cache = get_dataset_cache()
+    profiles = data_dict.get('profiles')
+    _format = data_dict.get('format')
+
+    # Read before the dataset is serialized, so a concurrent update can't
+    # store an outdated serialization under the new version
+    pkg = _get_cacheable_dataset(data_dict) if cache else None
+    if pkg:
+        output = _get_cached_dataset(cache, pkg, context, data_dict)
+        if output is not None:
+            return output
+
     try:
         dataset_dict = toolkit.get_action('package_show')(context, data_dict)
     except toolkit.ValidationError as error:
@@ -28,10 +51,51 @@ def dcat_dataset_show(context, data_dict):
     except (toolkit.ObjectNotFound, toolkit.NotAuthorized):
         return toolkit.abort(404, toolkit._('Package not found'))
 
-    serializer = RDFSerializer(profiles=data_dict.get('profiles'))
+    serializer = RDFSerializer(profiles=profiles)
+
+    output = serializer.serialize_dataset(dataset_dict, _format=_format)
+
+    if pkg:
+        cache.set(pkg.id, dataset_cache_version(pkg),
+                  profiles, _format, output, org_id=pkg.owner_org)
+
+    return output
+
+
+def _get_cacheable_dataset(data_dict):
+    '''
+    Returns the model object of the requested dataset if its serializations
+    can be cached, otherwise None
+    '''
+    dataset_id = data_dict.get('id')
+    if not dataset_id:
+        return None
+
+    pkg = model.Package.get(dataset_id)
+    if not pkg or pkg.state != 'active' or not pkg.metadata_modified:
+        return None
+    return pkg
+
 
-    output = serializer.serialize_dataset(dataset_dict,
-                                          _format=data_dict.get('format'))
+def _get_cached_dataset(cache, pkg, context, data_dict):
+    '''
+    Returns the cached serialization for the requested dataset, or None if
+    not found
+
+    Only the dataset `metadata_modified` is read from the database, so the
+    full `package_show` is not run on cache hits. Authorization is still
+    checked for each request.
+    '''
+    output = cache.get(pkg.id, dataset_cache_version(pkg),
+                       data_dict.get('profiles'), data_dict.get('format'),
+                       org_id=pkg.owner_org)
+    if output is None:
+        return None
+
+    try:
+        toolkit.check_access('package_show', context, {'id': pkg.id})
+    except toolkit.NotAuthorized:
+        return toolkit.abort(404, toolkit._('Package not found'))
 
     return output
 
@@ -54,6 +118,28 @@ def dcat_catalog_show(context, data_dict):
     return output
 
 
+def dcat_catalog_stream(context, data_dict):
+    '''
+    Same as `dcat_catalog_show`, but returns a generator that yields the
+    serialized catalog in chunks (see `RDFSerializer.serialize_catalog_stream`)
+
+    Access checks, the search and the pagination are done before returning,
+    so any errors are raised straight away.
+    '''
+
+    toolkit.check_access('dcat_catalog_show', context, data_dict)
+
+    query = _search_ckan_datasets(context, data_dict)
+    dataset_dicts = query['results']
+    pagination_info = _pagination_info(query, data_dict)
+
+    serializer = RDFSerializer(profiles=data_dict.get('profiles'))
+
+    return serializer.serialize_catalog_stream({}, dataset_dicts,
+                                               _format=data_dict.get('format'),
+                                               pagination_info=pagination_info)
+
+
 @toolkit.side_effect_free
 def dcat_catalog_search(context, data_dict):
 
@@ -88,6 +174,7 @@ def _search_ckan_datasets(context, data_dict):
 
     n = int(config.get('ckanext.dcat.datasets_per_page', DATASETS_PER_PAGE))
     page = data_dict.get('page', 1) or 1
+    cursor = data_dict.get('cursor')
 
     try:
         page = int(page)
@@ -96,6 +183,9 @@ def _search_ckan_datasets(context, data_dict):
     except ValueError:
         raise wrong_page_exception
 
+    if cursor:
+        cursor_modified, cursor_id = _decode_cursor(cursor)
+
     modified_since = data_dict.get('modified_since')
     if modified_since:
         try:
@@ -104,10 +194,16 @@ def _search_ckan_datasets(context, data_dict):
             raise toolkit.ValidationError(
                 'Wrong modified date format. Use ISO-8601 format')
 
+    # With cursors, one more dataset is requested to know if there is a
+    # next page
+    use_cursors = cursor or toolkit.asbool(
+        config.get(CURSOR_PAGINATION_CONFIG, False))
+
     search_data_dict = {
-        'rows': n,
-        'start': n * (page - 1),
-        'sort': 'metadata_modified desc',
+        'rows': n + 1 if use_cursors else n,
+        'start': 0 if cursor else n * (page - 1),
+        # The id makes the order stable for datasets modified at the same time
+        'sort': 'metadata_modified desc, id desc',
     }
 
     search_data_dict['q'] = data_dict.get('q', '*:*')
@@ -122,11 +218,69 @@ def _search_ckan_datasets(context, data_dict):
         search_data_dict['fq_list'].append(
             'metadata_modified:[{0} TO NOW]'.format(modified_since))
 
-    query = toolkit.get_action('package_search')(context, search_data_dict)
+    if cursor:
+        # Datasets after the cursor one in the sort order
+        cursor_data_dict = dict(search_data_dict)
+        cursor_data_dict['fq_list'] = search_data_dict['fq_list'] + [
+            'metadata_modified:[* TO {0}} OR '
+            '(metadata_modified:"{0}" AND id:{{* TO "{1}"}})'.format(
+                cursor_modified, cursor_id)
+        ]
+        # The count is only the number of datasets from the cursor on
+        query = toolkit.get_action('package_search')(context, cursor_data_dict)
+    else:
+        query = toolkit.get_action('package_search')(context, search_data_dict)
+
+    if use_cursors:
+        if len(query['results']) > n:
+            query['results'] = query['results'][:n]
+            query['next_cursor'] = _encode_cursor(query['results'][-1])
+        else:
+            query['next_cursor'] = None
 
     return query
 
 
+def _solr_date(value):
+    '''
+    Returns the date in the format used by Solr, which keeps milliseconds
+    '''
+    date = dateutil_parse(value)
+    if date.tzinfo:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return '{0}.{1:03d}Z'.format(
+        date.strftime('%Y-%m-%dT%H:%M:%S'), date.microsecond // 1000)
+
+
+def _encode_cursor(dataset_dict):
+    '''
+    Returns an opaque cursor pointing to the given dataset of the catalog
+    '''
+    value = '{0}|{1}'.format(
+        _solr_date(dataset_dict['metadata_modified']), dataset_dict['id'])
+    return base64.urlsafe_b64encode(
+        value.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    '''
+    Returns a tuple with the `metadata_modified` value (as a Solr date) and
+    the id of the dataset that the cursor points to
+    '''
+    try:
+        value = base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        metadata_modified, dataset_id = value.split('|')
+        metadata_modified = _solr_date(metadata_modified)
+    except (ValueError, TypeError, OverflowError):
+        raise wrong_cursor_exception
+
+    if not dataset_id_re.match(dataset_id):
+        raise wrong_cursor_exception
+
+    return metadata_modified, dataset_id
+
+
 def _pagination_info(query, data_dict):
     '''
     Creates a pagination_info dict to be passed to the serializers
@@ -144,15 +298,26 @@ def _pagination_info(query, data_dict):
     * `next`
     * `previous`
 
+    If cursor pagination is used (ie `query` has a `next_cursor` key, see
+    `_search_ckan_datasets()`), `next` points to the page after the last
+    dataset of the current one, and `last` is not returned. Neither are
+    `previous` and `count` for pages requested with a cursor, as the
+    search only counts the datasets after it.
+
     Returns a dict
     '''
 
-    def _page_url(page):
+    def _page_url(page=None, cursor=None):
 
         base_url = catalog_uri()
         base_url = '%s%s' % (
             base_url, toolkit.request.path)
 
+        if cursor:
+            position = 'cursor={0}'.format(cursor)
+        else:
+            position = 'page={0}'.format(page)
+
         params = [p for p in toolkit.request.params.items()
                   if p[0] != 'page' and p[0] in ('modified_since', 'profiles', 'q', 'fq')]
         if params:
@@ -163,15 +328,15 @@ def _pagination_info(query, data_dict):
                     ) for p in params
                 ]
             )
-            return '{0}?{1}&page={2}'.format(
+            return '{0}?{1}&{2}'.format(
                 base_url,
                 qs,
-                page
+                position
             )
         else:
-            return '{0}?page={1}'.format(
+            return '{0}?{1}'.format(
                 base_url,
-                page
+                position
             )
 
     try:
@@ -184,20 +349,25 @@ def _pagination_info(query, data_dict):
     if query['count'] == 0:
         return {}
 
+    cursor = data_dict.get('cursor')
+
     items_per_page = int(config.get('ckanext.dcat.datasets_per_page',
                                     DATASETS_PER_PAGE))
     pagination_info = {
-        'count': query['count'],
         'items_per_page': items_per_page,
     }
+    if not cursor:
+        pagination_info['count'] = query['count']
 
-    pagination_info['current'] = _page_url(page)
+    pagination_info['current'] = _page_url(page, cursor)
     pagination_info['first'] = _page_url(1)
 
+    # Pages after the first one can only be reached with cursors
     last_page = int(math.ceil(query['count'] / items_per_page)) or 1
-    pagination_info['last'] = _page_url(last_page)
+    if 'next_cursor' not in query:
+        pagination_info['last'] = _page_url(last_page)
 
-    if page > 1:
+    if page > 1 and not cursor:
         if ((page - 1) * items_per_page
                 + len(query['results'])) <= query['count']:
             previous_page = page - 1
@@ -206,7 +376,10 @@ def _pagination_info(query, data_dict):
 
         pagination_info['previous'] = _page_url(previous_page)
 
-    if page * items_per_page < query['count']:
+    if 'next_cursor' in query:
+        if query['next_cursor']:
+            pagination_info['next'] = _page_url(cursor=query['next_cursor'])
+    elif page * items_per_page < query['count']:
         pagination_info['next'] = _page_url(page + 1)
 
     return pagination_info
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+'''
+Parsing of N-Triples and N-Quads documents too large to be loaded in memory
+
+The triples are written to a temporary SQLite database instead of an rdflib
+graph. The graph of each dataset (the dataset node and all the nodes that can
+be reached from it) can then be rebuilt on its own, so memory use is bounded
+by the size of the largest dataset rather than by the size of the document,
+provided the document is read from a file rather than from memory.
+'''
+import os
+import shutil
+import sqlite3
+import tempfile
+import weakref
+
+from rdflib import URIRef, BNode, Literal, ConjunctiveGraph
+from rdflib.namespace import Namespace, RDF
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser, ParseError
+
+try:
+    from rdflib.plugins.parsers.ntriples import r_tail, r_wspace
+except ImportError:
+    # Internals of the rdflib parser, see `_LineParser`
+    r_tail = r_wspace = None
+
+from ckanext.dcat.sqlite_store import (
+    INSERT_BATCH_SIZE,
+    URIREF,
+    BNODE,
+    LITERAL,
+    node_key,
+    key_node,
+)
+
+DCAT = Namespace("http://www.w3.org/ns/dcat#")
+HYDRA = Namespace('http://www.w3.org/ns/hydra/core#')
+
+# Links from catalogs to their datasets or records, which are not followed
+CATALOG_LINKS = [DCAT.dataset, DCAT.record]
+
+# Node types shared by all datasets, which are added to every dataset graph
+SHARED_TYPES = [
+    DCAT.Catalog,
+    HYDRA.PartialCollectionView,
+    HYDRA.PagedCollection,
+]
+
+
+class _LineParser(W3CNTriplesParser):
+    '''
+    N-Triples parser that also accepts N-Quads lines
+
+    The graph label of quads is ignored, ie all triples are added to the
+    same graph, as they would be on a ConjunctiveGraph.
+
+    It overrides an internal method of the rdflib parser, which has been
+    stable across the rdflib versions supported (see requirements.txt).
+    `supported()` tells whether the installed version still provides what
+    it needs, otherwise `PartitionedTripleStore` parses the document in
+    batches of lines with the public rdflib API.
+    '''
+
+    @classmethod
+    def supported(cls):
+        return r_tail is not None and all(
+            hasattr(W3CNTriplesParser, name) for name in (
+                'eat', 'peek', 'subject', 'predicate', 'object', 'uriref',
+                'nodeid'))
+
+    def parseline(self, bnode_context=None):
+        self.eat(r_wspace)
+        if (not self.line) or self.line.startswith("#"):
+            return
+
+        subject = self.subject(bnode_context)
+        self.eat(r_wspace)
+
+        predicate = self.predicate()
+        self.eat(r_wspace)
+
+        _object = self.object(bnode_context)
+        self.eat(r_wspace)
+
+        if not self.peek('.'):
+            self.uriref() or self.nodeid(bnode_context)
+        self.eat(r_tail)
+
+        if self.line:
+            raise ParseError("Trailing garbage: {}".format(self.line))
+        self.sink.triple(subject, predicate, _object)
+
+
+class PartitionedTripleStore(object):
+    '''
+    Temporary on-disk store for the triples of a line-based RDF document
+
+    Call `load()` with the document, then `datasets()` and `dataset_graph()`
+    to get the graph of each dataset. The database is removed when calling
+    `close()`.
+    '''
+
+    def __init__(self, directory=None):
+        self._dir = tempfile.mkdtemp(prefix='ckanext-dcat-', dir=directory)
+        # Remove the database even if `close()` is not called
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self._dir, True)
+        self._path = os.path.join(self._dir, 'triples.db')
+        self._conn = sqlite3.connect(self._path)
+        # Connections inherited from the parent process, see `reopen()`
+        self._inherited_conns = []
+        # The database is only used for the lifetime of this object
+        self._conn.execute('PRAGMA journal_mode = OFF')
+        self._conn.execute('PRAGMA synchronous = OFF')
+        self._conn.execute(
+            'CREATE TABLE triples ('
+            's TEXT NOT NULL, p TEXT NOT NULL, o TEXT NOT NULL, '
+            'kind INTEGER NOT NULL, datatype TEXT, lang TEXT)')
+        self._rows = []
+        self._shared_triples = None
+
+    # Parser sink
+
+    def triple(self, s, p, o):
+        if isinstance(o, Literal):
+            row = (node_key(s), str(p), str(o), LITERAL,
+                   str(o.datatype) if o.datatype else None, o.language)
+        else:
+            row = (node_key(s), str(p), node_key(o),
+                   BNODE if isinstance(o, BNode) else URIREF, None, None)
+        self._rows.append(row)
+        if len(self._rows) >= INSERT_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self._conn.executemany(
+            'INSERT INTO triples VALUES (?, ?, ?, ?, ?, ?)', self._rows)
+        self._rows = []
+
+    def load(self, stream):
+        '''
+        Loads the triples of an N-Triples or N-Quads document
+
+        `stream` is a file-like object, opened in binary or text mode. It
+        is read in chunks, so the whole document is never held in memory.
+
+        Raises rdflib's ParseError if a line can not be parsed.
+        '''
+        if _LineParser.supported():
+            _LineParser(sink=self).parse(stream)
+        else:
+            self._load_in_batches(stream)
+        self._flush()
+
+        self._conn.execute('CREATE INDEX triples_s ON triples (s)')
+        self._conn.execute('CREATE INDEX triples_po ON triples (p, o)')
+        self._conn.commit()
+
+    def _load_in_batches(self, stream):
+        # Blank node labels are shared by all the batches of the document
+        bnode_context = {}
+        lines = []
+        for line in stream:
+            lines.append(line)
+            if len(lines) >= INSERT_BATCH_SIZE:
+                self._load_lines(lines, bnode_context)
+                lines = []
+        if lines:
+            self._load_lines(lines, bnode_context)
+
+    def _load_lines(self, lines, bnode_context):
+        graph = ConjunctiveGraph()
+        graph.parse(data=lines[0][:0].join(lines), format='nquads',
+                    bnode_context=bnode_context)
+        for s, p, o in graph.triples((None, None, None)):
+            self.triple(s, p, o)
+
+    def reopen(self):
+        '''
+        Opens a new connection to the database in a forked process
+
+        SQLite connections can't be used across a fork, so each process
+        needs its own one. The inherited connection is kept (not closed or
+        used) as it still belongs to the parent process.
+        '''
+        self._inherited_conns.append(self._conn)
+        self._conn = sqlite3.connect(self._path)
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM triples').fetchone()[0]
+
+    def _subjects(self, predicate, _object):
+        cursor = self._conn.execute(
+            'SELECT s FROM triples WHERE p = ? AND o = ? '
+            'GROUP BY s ORDER BY MIN(rowid)',
+            (str(predicate), node_key(_object)))
+        for (key,) in cursor:
+            yield key_node(key)
+
+    def _triples(self, node):
+        cursor = self._conn.execute(
+            'SELECT p, o, kind, datatype, lang FROM triples WHERE s = ? '
+            'ORDER BY rowid', (node_key(node),))
+        for p, o, kind, datatype, lang in cursor:
+            if kind == LITERAL:
+                o = Literal(o, lang=lang, datatype=URIRef(datatype) if datatype else None)
+            else:
+                o = key_node(o)
+            yield node, URIRef(p), o
+
+    def datasets(self):
+        '''
+        Generator that returns the references of all DCAT datasets
+        '''
+        return self._subjects(RDF.type, DCAT.Dataset)
+
+    def _is_not_dataset(self, node):
+        return self._conn.execute(
+            'SELECT 1 FROM triples WHERE s = ? AND p = ? AND o = ? LIMIT 1',
+            (node_key(node), str(RDF.type), node_key(DCAT.Dataset))
+        ).fetchone() is None
+
+    def _closure(self, nodes, follow=None):
+        '''
+        Generator that returns the triples of the nodes and of all the nodes
+        that can be reached from them (if `follow` returns True for them)
+
+        Links from catalogs to their datasets or records are not included.
+        '''
+        visited = set(nodes)
+        pending = list(nodes)
+        while pending:
+            node = pending.pop()
+            for s, p, o in self._triples(node):
+                if p in CATALOG_LINKS:
+                    continue
+                yield s, p, o
+                if p == RDF.type or isinstance(o, Literal) or o in visited:
+                    continue
+                visited.add(o)
+                if follow is None or follow(o):
+                    pending.append(o)
+
+    def shared_graph(self, graph):
+        '''
+        Adds to the graph the triples shared by all datasets, ie catalogs
+        and pagination details, and returns it
+        '''
+        if self._shared_triples is None:
+            shared = []
+            for _type in SHARED_TYPES:
+                shared.extend(self._subjects(RDF.type, _type))
+            self._shared_triples = list(
+                self._closure(shared, follow=self._is_not_dataset))
+
+        for triple in self._shared_triples:
+            graph.add(triple)
+        return graph
+
+    def dataset_graph(self, dataset_ref, graph):
+        '''
+        Adds to the graph the triples of the dataset, the links to it from
+        catalogs and the shared triples (see `shared_graph()`), and returns it
+
+        Links to other datasets are kept, but their triples are not added.
+        '''
+        self.shared_graph(graph)
+
+        for triple in self._closure([dataset_ref], follow=self._is_not_dataset):
+            graph.add(triple)
+
+        for catalog in self._subjects(DCAT.dataset, dataset_ref):
+            graph.add((catalog, DCAT.dataset, dataset_ref))
+
+        return graph
+
+    def close(self):
+        self._conn.close()
+        self._finalizer()
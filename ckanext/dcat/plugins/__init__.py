@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from builtins import object
+import logging
 import os
 import json
 
@@ -20,9 +21,18 @@ from ckanext.dcat.logic import (dcat_dataset_show,
                                 dcat_auth,
                                 )
 from ckanext.dcat import utils
+from ckanext.dcat.cache import get_dataset_cache, invalidate_organization_datasets
+from ckanext.dcat.profiles.base import (
+    get_dataset_schema,
+    get_schema_index,
+    clear_dataset_schema_cache,
+    invalidate_organization,
+)
 from ckanext.dcat.validators import dcat_validators
 
 
+log = logging.getLogger(__name__)
+
 CUSTOM_ENDPOINT_CONFIG = 'ckanext.dcat.catalog_endpoint'
 TRANSLATE_KEYS_CONFIG = 'ckanext.dcat.translate_keys'
 
@@ -38,16 +48,10 @@ def config_declaration(func):
 
 
 def _get_dataset_schema(dataset_type="dataset"):
-    schema = None
     try:
-        schema_show = p.toolkit.get_action("scheming_dataset_schema_show")
-        try:
-            schema = schema_show({}, {"type": dataset_type})
-        except p.toolkit.ObjectNotFound:
-            pass
-    except KeyError:
-        pass
-    return schema
+        return get_dataset_schema(dataset_type)
+    except p.toolkit.ObjectNotFound:
+        return None
 
 
 @config_declaration
@@ -58,6 +62,7 @@ class DCATPlugin(p.SingletonPlugin, DefaultTranslation):
     p.implements(p.IActions, inherit=True)
     p.implements(p.IAuthFunctions, inherit=True)
     p.implements(p.IPackageController, inherit=True)
+    p.implements(p.IOrganizationController, inherit=True)
     p.implements(p.ITranslation, inherit=True)
     p.implements(p.IClick)
     p.implements(p.IBlueprint)
@@ -83,6 +88,9 @@ class DCATPlugin(p.SingletonPlugin, DefaultTranslation):
     def update_config(self, config):
         p.toolkit.add_template_directory(config, '../templates')
 
+        # Schemas may have changed if the plugins were reloaded
+        clear_dataset_schema_cache()
+
         # Check catalog URI on startup to emit a warning if necessary
         utils.catalog_uri()
 
@@ -138,7 +146,37 @@ class DCATPlugin(p.SingletonPlugin, DefaultTranslation):
     def before_index(self, dataset_dict):
         return self.before_dataset_index(dataset_dict)
 
+    def after_update(self, context, data_dict):
+        return self.after_dataset_update(context, data_dict)
+
+    def after_delete(self, context, data_dict):
+        return self.after_dataset_delete(context, data_dict)
+
     # CKAN >= 2.10 hooks
+    def after_dataset_update(self, context, data_dict):
+        self._invalidate_dataset_cache(data_dict)
+
+    def after_dataset_delete(self, context, data_dict):
+        self._invalidate_dataset_cache(data_dict)
+
+    def _invalidate_dataset_cache(self, data_dict):
+        cache = get_dataset_cache()
+        if cache and data_dict.get('id'):
+            cache.invalidate(data_dict['id'])
+
+    # IOrganizationController
+
+    def edit(self, entity):
+        # Also called for datasets on CKAN < 2.10 (IPackageController)
+        if getattr(entity, 'is_organization', False):
+            invalidate_organization(entity.id)
+            invalidate_organization_datasets(entity.id)
+
+    def delete(self, entity):
+        if getattr(entity, 'is_organization', False):
+            invalidate_organization(entity.id)
+            invalidate_organization_datasets(entity.id)
+
     def after_dataset_show(self, context, data_dict):
 
         schema = _get_dataset_schema(data_dict["type"])
@@ -177,8 +215,8 @@ class DCATPlugin(p.SingletonPlugin, DefaultTranslation):
         schema = _get_dataset_schema(dataset_dict["type"])
         spatial = None
         if schema:
-            for field in schema['dataset_fields']:
-                if field['field_name'] in dataset_dict and 'repeating_subfields' in field:
+            for field in get_schema_index(schema).repeating_dataset_fields:
+                if field['field_name'] in dataset_dict:
                     for item in dataset_dict[field['field_name']]:
                         for key in item:
                             value = item[key]
@@ -260,6 +298,7 @@ class DCATJSONInterface(p.SingletonPlugin):
 
 class StructuredDataPlugin(p.SingletonPlugin):
     p.implements(p.ITemplateHelpers, inherit=True)
+    p.implements(p.IPackageController, inherit=True)
 
     # ITemplateHelpers
 
@@ -267,3 +306,23 @@ class StructuredDataPlugin(p.SingletonPlugin):
         return {
             'structured_data': utils.structured_data,
         }
+
+    # IPackageController
+
+    # CKAN < 2.10 hooks
+    def before_index(self, dataset_dict):
+        return self.before_dataset_index(dataset_dict)
+
+    # CKAN >= 2.10 hooks
+    def before_dataset_index(self, dataset_dict):
+        if (p.toolkit.asbool(config.get(utils.STRUCTURED_DATA_PRECOMPUTE))
+                and dataset_dict.get('id')):
+            try:
+                utils.precompute_structured_data(dataset_dict['id'])
+            except Exception as e:
+                # Never prevent the dataset from being indexed, the
+                # structured data will be generated when the page is rendered
+                log.warning('Could not precompute the structured data of dataset %s: %s',
+                            dataset_dict.get('id'), e)
+
+        return dataset_dict
@@ -4,22 +4,33 @@ from builtins import str
 from builtins import object
 import sys
 import argparse
+import logging
+import multiprocessing
 import xml
 import json
-from pkg_resources import iter_entry_points
+from importlib import metadata as importlib_metadata
 
 from ckantoolkit import config
 
 import rdflib
+import rdflib.exceptions
 import rdflib.parser
+import rdflib.store
 from rdflib import URIRef, BNode, Literal
+from rdflib.plugins.stores.memory import Memory, SimpleMemory
 from rdflib.namespace import Namespace, RDF
 
 import ckan.plugins as p
 
+from ckanext.dcat import jsonld
 from ckanext.dcat.utils import catalog_uri, dataset_uri, url_to_rdflib_format, DCAT_EXPOSE_SUBCATALOGS
+from ckanext.dcat.extras import get_extra_value
 from ckanext.dcat.profiles import DCAT, DCT, FOAF
+from ckanext.dcat.profiles.base import SubjectIndex, prefetch_organizations
 from ckanext.dcat.exceptions import RDFProfileException, RDFParserException
+from ckanext.dcat.partitioning import PartitionedTripleStore
+
+log = logging.getLogger(__name__)
 
 HYDRA = Namespace('http://www.w3.org/ns/hydra/core#')
 DCAT = Namespace("http://www.w3.org/ns/dcat#")
@@ -27,25 +38,163 @@ DCAT = Namespace("http://www.w3.org/ns/dcat#")
 RDF_PROFILES_ENTRY_POINT_GROUP = 'ckan.rdf.profiles'
 RDF_PROFILES_CONFIG_OPTION = 'ckanext.dcat.rdf.profiles'
 COMPAT_MODE_CONFIG_OPTION = 'ckanext.dcat.compatibility_mode'
+GRAPH_STORE_CONFIG_OPTION = 'ckanext.dcat.graph_store'
+
+DEFAULT_GRAPH_STORE = 'SimpleMemory'
+
+rdflib.plugin.register(
+    'SQLite', rdflib.store.Store, 'ckanext.dcat.sqlite_store', 'SQLiteStore')
+
+# rdflib formats with one triple (or quad) per line, see `parse_stream()`
+LINE_BASED_FORMATS = [
+    'nt', 'nt11', 'ntriples', 'application/n-triples',
+    'nquads', 'application/n-quads',
+]
+
+# rdflib formats that can contain named graphs. Aliases of these (eg MIME
+# types like `application/ld+json`) are resolved with `is_quad_format()`
+QUAD_FORMATS = ['json-ld', 'nquads', 'trig', 'trix', 'hext']
 
 DEFAULT_RDF_PROFILES = ['euro_dcat_ap_3']
 
 
+def is_quad_format(_format):
+    '''
+    Returns True if the rdflib parser for the provided format, which can be
+    any of its names or MIME types, can return triples in named graphs
+    '''
+    try:
+        parser = rdflib.plugin.get(_format, rdflib.parser.Parser)
+    except rdflib.plugin.PluginException:
+        return False
+    return parser in _quad_format_parsers()
+
+
+def _quad_format_parsers():
+    parsers = set()
+    for _format in QUAD_FORMATS:
+        try:
+            parsers.add(rdflib.plugin.get(_format, rdflib.parser.Parser))
+        except rdflib.plugin.PluginException:
+            # Not available in this rdflib version
+            pass
+    return parsers
+
+
 def _get_default_rdf_profiles():
     """Helper function used fo documenting the rdf profiles config option"""
     return " ".join(DEFAULT_RDF_PROFILES)
 
+# Process-wide registry of the RDF profiles available, populated on first use
+_profile_entry_points = None
+_profile_classes = {}
+
+
+def _get_profile_entry_points():
+    '''
+    Returns a dict with the entry points registered under the
+    ``[ckan.rdf.profiles]`` group, keyed by name
+
+    The entry points are only resolved once per process.
+    '''
+    global _profile_entry_points
+
+    if _profile_entry_points is None:
+        entry_points = importlib_metadata.entry_points()
+        if hasattr(entry_points, 'select'):
+            group = entry_points.select(group=RDF_PROFILES_ENTRY_POINT_GROUP)
+        else:
+            # Python < 3.10
+            group = entry_points.get(RDF_PROFILES_ENTRY_POINT_GROUP, [])
+
+        _profile_entry_points = {}
+        for entry_point in group:
+            _profile_entry_points.setdefault(entry_point.name, entry_point)
+
+    return _profile_entry_points
+
+
+def get_profile_class(profile_name):
+    '''
+    Returns the RDF profile class registered with the provided name, or None
+    if there is no such profile
+
+    Classes are only loaded once and then kept in the profiles registry.
+    '''
+    if profile_name not in _profile_classes:
+        entry_point = _get_profile_entry_points().get(profile_name)
+        if not entry_point:
+            return None
+        profile_class = entry_point.load()
+        # Set a reference to the profile name
+        profile_class.name = entry_point.name
+        _profile_classes[profile_name] = profile_class
+
+    return _profile_classes[profile_name]
+
+
+# Parser used by the workers of `RDFParser.datasets()` when parsing in
+# parallel. Forked workers inherit it (and its graph) from the parent process.
+_worker_parser = None
+
+# rdflib stores that can be shared with forked workers, ie that don't hold
+# connections or open files
+FORK_SAFE_STORES = (Memory, SimpleMemory)
+
+
+def _dispose_db_engine(close=True):
+    '''
+    Removes the connections of the CKAN database engine pool, so forked
+    processes don't share them with their parent
+    '''
+    try:
+        from ckan import model
+        engine = model.meta.engine
+    except (ImportError, AttributeError):
+        return
+    if engine is None:
+        return
+    if close:
+        engine.dispose()
+    else:
+        try:
+            # Drop the inherited connections without closing them, as
+            # they still belong to the parent process (SQLAlchemy >= 1.4.33)
+            engine.dispose(close=False)
+        except TypeError:
+            engine.pool = engine.pool.recreate()
+
+
+def _init_worker():
+    _dispose_db_engine(close=False)
+    if _worker_parser._partitioned_store is not None:
+        _worker_parser._partitioned_store.reopen()
+
+
+def _parse_dataset_in_worker(dataset_ref):
+    return _worker_parser._parse_dataset(dataset_ref)
+
+
 SUPPORTED_PAGINATION_COLLECTION_DESIGNS = [HYDRA.PartialCollectionView, HYDRA.PagedCollection]
 
+# rdflib formats whose documents can be built by concatenating the
+# serializations of independent subgraphs
+STREAMING_FORMATS = ['nt', 'ntriples', 'turtle', 'json-ld']
+
 
 class RDFProcessor(object):
 
-    def __init__(self, profiles=None, dataset_type='dataset', compatibility_mode=False):
+    def __init__(self, profiles=None, dataset_type='dataset', compatibility_mode=False,
+                 graph_store=None):
         '''
         Creates a parser or serializer instance
 
         You can optionally pass a list of profiles to be used.
 
+        The rdflib store plugin used for the graphs can be provided in
+        `graph_store` (eg `SQLite` to keep the graph on disk), otherwise
+        the one defined in `ckanext.dcat.graph_store` is used.
+
         A scheming dataset type can be provided, in which case the scheming schema
         will be loaded by the base profile so it can be used by other profiles.
 
@@ -73,7 +222,41 @@ class RDFProcessor(object):
                 config.get(COMPAT_MODE_CONFIG_OPTION, False))
         self.compatibility_mode = compatibility_mode
 
-        self.g = rdflib.ConjunctiveGraph()
+        self.graph_store = graph_store
+
+        self.g = self._new_graph()
+
+    def _new_graph(self, context_aware=False):
+        '''
+        Returns a new empty rdflib graph to be used by the processor
+
+        The rdflib store plugin is defined by `graph_store` or by
+        `ckanext.dcat.graph_store`. If the store is context aware (eg `Memory`)
+        a ConjunctiveGraph is returned, otherwise a plain Graph.
+
+        If `context_aware` is True and the configured store is not, a
+        ConjunctiveGraph on a `Memory` store is returned instead, so triples
+        in named graphs are kept.
+        '''
+        store_name = (
+            self.graph_store
+            or config.get(GRAPH_STORE_CONFIG_OPTION)
+            or DEFAULT_GRAPH_STORE
+        )
+        try:
+            store = rdflib.plugin.get(store_name, rdflib.store.Store)()
+        except rdflib.plugin.PluginException:
+            raise ValueError(
+                'Unknown rdflib store for "{0}": {1}'.format(
+                    GRAPH_STORE_CONFIG_OPTION, store_name))
+
+        if context_aware and not store.context_aware:
+            store.close()
+            store = Memory()
+
+        if store.context_aware:
+            return rdflib.ConjunctiveGraph(store=store)
+        return rdflib.Graph(store=store)
 
     def _load_profiles(self, profile_names):
         '''
@@ -86,15 +269,10 @@ class RDFProcessor(object):
         loaded_profiles_names = []
 
         for profile_name in profile_names:
-            for profile in iter_entry_points(
-                    group=RDF_PROFILES_ENTRY_POINT_GROUP,
-                    name=profile_name):
-                profile_class = profile.load()
-                # Set a reference to the profile name
-                profile_class.name = profile.name
+            profile_class = get_profile_class(profile_name)
+            if profile_class:
                 profiles.append(profile_class)
-                loaded_profiles_names.append(profile.name)
-                break
+                loaded_profiles_names.append(profile_name)
 
         unknown_profiles = set(profile_names) - set(loaded_profiles_names)
         if unknown_profiles:
@@ -113,6 +291,9 @@ class RDFParser(RDFProcessor):
     CKAN dicts from the RDF graph.
     '''
 
+    # Store with the triples loaded by `parse_stream()`
+    _partitioned_store = None
+
     def _datasets(self):
         '''
         Generator that returns all DCAT datasets on the graph
@@ -120,7 +301,11 @@ class RDFParser(RDFProcessor):
         Yields rdflib.term.URIRef objects that can be used on graph lookups
         and queries
         '''
-        for dataset in self.g.subjects(RDF.type, DCAT.Dataset):
+        if self._partitioned_store is not None:
+            datasets = self._partitioned_store.datasets()
+        else:
+            datasets = self.g.subjects(RDF.type, DCAT.Dataset)
+        for dataset in datasets:
             yield dataset
 
     def next_page(self):
@@ -145,8 +330,9 @@ class RDFParser(RDFProcessor):
         It calls the rdflib parse function with the provided data and format.
 
         Data is a string with the serialized RDF graph (eg RDF/XML, N3
-        ... ). By default RF/XML is expected. The optional parameter _format
-        can be used to tell rdflib otherwise.
+        ... ), or a binary file-like object to read it from, which is closed
+        once parsed. By default RF/XML is expected. The optional parameter
+        _format can be used to tell rdflib otherwise.
 
         It raises a ``RDFParserException`` if there was some error during
         the parsing.
@@ -158,8 +344,21 @@ class RDFParser(RDFProcessor):
         if not _format or _format == 'pretty-xml':
             _format = 'xml'
 
+        # Let rdflib read file objects itself instead of loading them first
+        source = {'source': data} if hasattr(data, 'read') else {'data': data}
+
+        if not self.g.context_aware and is_quad_format(_format):
+            # Stores that are not context aware would drop the triples of
+            # named graphs, so switch to one that is, keeping the triples
+            # parsed so far
+            graph = self._new_graph(context_aware=True)
+            if len(self.g):
+                graph += self.g
+            self.g.close()
+            self.g = graph
+
         try:
-            self.g.parse(data=data, format=_format)
+            self.g.parse(format=_format, **source)
         # Apparently there is no single way of catching exceptions from all
         # rdflib parsers at once, so if you use a new one and the parsing
         # exceptions are not cached, add them here.
@@ -169,6 +368,54 @@ class RDFParser(RDFProcessor):
 
             raise RDFParserException(e)
 
+    def parse_stream(self, stream, _format='nt', directory=None):
+        '''
+        Parses a large N-Triples or N-Quads document without loading it in
+        memory
+
+        `stream` is a file-like object, which is read in chunks. Instead of
+        being added to the class graph, triples are stored in a temporary
+        SQLite database (created in `directory`, or the default temp
+        directory), and `datasets()` builds the graph of each dataset on its
+        own, so memory use is bounded by the size of the largest dataset (as
+        long as `stream` is not itself an in-memory buffer).
+
+        The class graph only contains the triples shared by all datasets, ie
+        catalogs and pagination details. Call `close()` to remove the
+        temporary database once done.
+
+        It raises a ``RDFParserException`` if the format is not supported or
+        if there was some error during the parsing.
+        '''
+        _format = url_to_rdflib_format(_format)
+        if _format not in LINE_BASED_FORMATS:
+            raise RDFParserException(
+                'Format not supported for streaming: {0}'.format(_format))
+
+        self.close()
+
+        store = PartitionedTripleStore(directory)
+        try:
+            store.load(stream)
+        except (rdflib.exceptions.ParserError, UnicodeDecodeError) as e:
+            store.close()
+            raise RDFParserException(e)
+
+        self._partitioned_store = store
+        self.g = store.shared_graph(self._new_graph())
+
+    def close(self):
+        '''
+        Releases the resources used by the parser, like the temporary
+        databases created by `parse_stream()` or by the `SQLite` store
+
+        The parser can not be used after calling this method.
+        '''
+        if self._partitioned_store is not None:
+            self._partitioned_store.close()
+            self._partitioned_store = None
+        self.g.close()
+
     def supported_formats(self):
         '''
         Returns a list of all formats supported by this processor.
@@ -177,27 +424,93 @@ class RDFParser(RDFProcessor):
                        for plugin
                        in rdflib.plugin.plugins(kind=rdflib.parser.Parser)])
 
-    def datasets(self):
+    def datasets(self, workers=None):
         '''
         Generator that returns CKAN datasets parsed from the RDF graph
 
         Each dataset is passed to all the loaded profiles before being
         yielded, so it can be further modified by each one of them.
 
+        If `workers` is greater than 1, the datasets are parsed in parallel
+        by a pool of forked processes, each one with a read-only copy of the
+        graph. Datasets are still yielded in the same order as when parsing
+        them sequentially. Parsing falls back to sequential on platforms
+        that don't support forking processes, and for graphs in stores other
+        than `Memory` or `SimpleMemory` (eg `SQLite`), which can't be shared
+        with forked processes.
+
         Returns a dataset dict that can be passed to eg `package_create`
         or `package_update`
         '''
+        if workers and workers > 1 and not isinstance(self.g.store, FORK_SAFE_STORES):
+            log.warning('Parallel parsing is not supported with the %s store, '
+                        'parsing datasets sequentially',
+                        type(self.g.store).__name__)
+        elif workers and workers > 1:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                for dataset_dict in self._datasets_in_parallel(workers):
+                    yield dataset_dict
+                return
+            log.warning('Parallel parsing is not supported on this platform, '
+                        'parsing datasets sequentially')
+
         for dataset_ref in self._datasets():
-            dataset_dict = {}
-            for profile_class in self._profiles:
-                profile = profile_class(
-                    self.g,
-                    dataset_type=self.dataset_type,
-                    compatibility_mode=self.compatibility_mode
-                )
-                profile.parse_dataset(dataset_dict, dataset_ref)
+            yield self._parse_dataset(dataset_ref)
+
+    def _parse_dataset(self, dataset_ref):
+        '''
+        Returns the CKAN dataset dict for the provided dataset reference,
+        once all the loaded profiles have been applied
+        '''
+        graph = self.g
+        if self._partitioned_store is not None:
+            graph = self._partitioned_store.dataset_graph(
+                dataset_ref, self._new_graph())
+
+        dataset_dict = {}
+        # Shared by all profiles, so the triples of each node are only
+        # looked up once per dataset
+        subject_index = SubjectIndex(graph)
+        for profile_class in self._profiles:
+            profile = profile_class(
+                graph,
+                dataset_type=self.dataset_type,
+                compatibility_mode=self.compatibility_mode
+            )
+            profile._subject_index = subject_index
+            profile.parse_dataset(dataset_dict, dataset_ref)
+
+        return dataset_dict
 
-            yield dataset_dict
+    def _datasets_in_parallel(self, workers):
+        '''
+        Generator that returns the CKAN datasets parsed by a pool of `workers`
+        processes, in the order they were found on the graph
+        '''
+        global _worker_parser
+
+        dataset_refs = list(self._datasets())
+        if not dataset_refs:
+            return
+
+        # Send the references in batches to reduce the IPC overhead, while
+        # keeping enough batches to balance the load between workers
+        chunksize = max(1, len(dataset_refs) // (workers * 4))
+
+        # Don't pass the pooled database connections to the workers
+        _dispose_db_engine()
+
+        _worker_parser = self
+        try:
+            context = multiprocessing.get_context('fork')
+            # Workers open their own connections (see `_init_worker()`)
+            with context.Pool(processes=workers, initializer=_init_worker) as pool:
+                for dataset_dict in pool.imap(_parse_dataset_in_worker,
+                                              dataset_refs,
+                                              chunksize=chunksize):
+                    yield dataset_dict
+        finally:
+            _worker_parser = None
 
 
 class RDFSerializer(RDFProcessor):
@@ -207,6 +520,13 @@ class RDFSerializer(RDFProcessor):
     Supports different profiles which are the ones that will generate
     the RDF graph.
     '''
+
+    def __init__(self, *args, **kwargs):
+        super(RDFSerializer, self).__init__(*args, **kwargs)
+
+        # Source catalogs already added to the output
+        self._source_catalog_refs = set()
+
     def _add_pagination_triples(self, paging_info):
         '''
         Adds pagination triples to the graph using the paging info provided
@@ -303,7 +623,8 @@ class RDFSerializer(RDFProcessor):
         _format = url_to_rdflib_format(_format)
 
         if _format == 'json-ld':
-            output = self.g.serialize(format=_format, auto_compact=True)
+            # Faster than rdflib's JSON-LD serializer, with equivalent output
+            output = jsonld.dumps(jsonld.graph_to_jsonld(self.g))
         else:
             output = self.g.serialize(format=_format)
 
@@ -350,6 +671,7 @@ class RDFSerializer(RDFProcessor):
 
         catalog_ref = self.graph_from_catalog(catalog_dict)
         if dataset_dicts:
+            self._prefetch_organizations(dataset_dicts)
             for dataset_dict in dataset_dicts:
                 dataset_ref = self.graph_from_dataset(dataset_dict)
 
@@ -367,14 +689,97 @@ class RDFSerializer(RDFProcessor):
 
         return output
 
+    def serialize_catalog_stream(self, catalog_dict=None, dataset_dicts=None,
+                                 _format='xml', pagination_info=None):
+        '''
+        Generator version of `serialize_catalog()`
+
+        Instead of adding all datasets to the class graph and serializing it
+        at the end, the catalog (and pagination) triples are serialized first
+        and then each dataset is serialized on its own graph as soon as the
+        profiles are done with it, so only one dataset graph is kept in memory
+        at any given time.
+
+        This is only possible for formats where the serializations of separate
+        subgraphs can be concatenated (see `STREAMING_FORMATS`), ie N-Triples,
+        Turtle and JSON-LD (which is output as a top-level array of node
+        objects). For any other format the whole catalog is serialized as
+        usual and yielded at once.
+
+        Yields strings with chunks of the serialized catalog
+        '''
+        if not _format:
+            _format = 'xml'
+        _format = url_to_rdflib_format(_format)
+
+        if _format not in STREAMING_FORMATS:
+            yield self.serialize_catalog(catalog_dict, dataset_dicts,
+                                         _format=_format,
+                                         pagination_info=pagination_info)
+            return
+
+        catalog_ref = self.graph_from_catalog(catalog_dict)
+
+        if pagination_info:
+            self._add_pagination_triples(pagination_info)
+
+        is_json = _format == 'json-ld'
+        if is_json:
+            yield '['
+
+        if isinstance(dataset_dicts, (list, tuple)):
+            self._prefetch_organizations(dataset_dicts)
+
+        chunk = self._serialize_chunk(_format)
+        first_chunk = not chunk
+        yield chunk
+
+        for dataset_dict in dataset_dicts or []:
+            self.g = self._new_graph()
+
+            dataset_ref = self.graph_from_dataset(dataset_dict)
+
+            cat_ref = self._add_source_catalog(catalog_ref, dataset_dict, dataset_ref)
+            if not cat_ref:
+                self.g.add((catalog_ref, DCAT.dataset, dataset_ref))
+
+            chunk = self._serialize_chunk(_format)
+            if not chunk:
+                continue
+            if is_json and not first_chunk:
+                chunk = ',' + chunk
+            first_chunk = False
+            yield chunk
+
+        if is_json:
+            yield ']'
+
+    def _prefetch_organizations(self, dataset_dicts):
+        '''
+        Loads the details of the organizations of all datasets at once, so
+        profiles don't need to request them one by one
+        '''
+        prefetch_organizations(
+            dataset_dict.get('organization') for dataset_dict in dataset_dicts)
+
+    def _serialize_chunk(self, _format):
+        '''
+        Serializes the class graph as a fragment of a streamed document
+
+        For JSON-LD, the enclosing brackets of the array of node objects are
+        removed so fragments can be joined with commas.
+        '''
+        output = self.g.serialize(format=_format)
+        if _format == 'json-ld':
+            output = output.strip()[1:-1].strip()
+        return output
+
     def _add_source_catalog(self, root_catalog_ref, dataset_dict, dataset_ref):
         if not p.toolkit.asbool(config.get(DCAT_EXPOSE_SUBCATALOGS, False)):
             return
 
         def _get_from_extra(key):
-            for ex in dataset_dict.get('extras', []):
-                if ex['key'] == key:
-                    return ex['value']
+            return get_extra_value(dataset_dict, key)
 
         source_uri = _get_from_extra('source_catalog_homepage')
         if not source_uri:
@@ -383,9 +788,12 @@ class RDFSerializer(RDFProcessor):
         g = self.g
         catalog_ref = URIRef(source_uri)
 
-        # we may have multiple subcatalogs, let's check if this one has been already added
-        if (root_catalog_ref, DCT.hasPart, catalog_ref) not in g:
+        # we may have multiple subcatalogs, let's check if this one has been
+        # already added (when streaming, possibly to a previous dataset graph)
+        if ((root_catalog_ref, DCT.hasPart, catalog_ref) not in g
+                and catalog_ref not in self._source_catalog_refs):
 
+            self._source_catalog_refs.add(catalog_ref)
             g.add((root_catalog_ref, DCT.hasPart, catalog_ref))
             g.add((catalog_ref, RDF.type, DCAT.Catalog))
             g.add((catalog_ref, DCAT.dataset, dataset_ref))
@@ -10,7 +10,9 @@ from geomet import wkt, InvalidGeoJSONException
 from ckantoolkit import config, url_for, asbool, aslist, get_action, ObjectNotFound
 from ckan.model.license import LicenseRegister
 from ckan.lib.helpers import resource_formats
+from ckanext.dcat.cache import TTLCache
 from ckanext.dcat.utils import DCAT_EXPOSE_SUBCATALOGS
+from ckanext.dcat.extras import get_extras_index
 from ckanext.dcat.validators import is_year, is_year_month, is_date
 
 CNT = Namespace("http://www.w3.org/2011/content#")
@@ -67,6 +69,268 @@ ROOT_DATASET_FIELDS = [
 ]
 
 
+# Scheming schemas shared by all profile instances, keyed by dataset type and
+# the config options that affect them. Use `clear_dataset_schema_cache()` to reset.
+_dataset_schema_cache = {}
+
+DATASET_SCHEMA_CACHE_CONFIG_OPTIONS = [
+    "ckan.plugins",
+    "scheming.dataset_schemas",
+    "scheming.presets",
+    "scheming.dataset_fallback",
+]
+
+
+def get_dataset_schema(dataset_type="dataset"):
+    """
+    Returns the ckanext-scheming schema for the provided dataset type, or
+    None if ckanext-scheming is not enabled
+
+    Raises ObjectNotFound if the dataset type is not defined in any schema.
+
+    Schemas are memoized for the whole process, so `scheming_dataset_schema_show`
+    is only called once per dataset type.
+    """
+    key = (dataset_type,) + tuple(
+        str(config.get(option)) for option in DATASET_SCHEMA_CACHE_CONFIG_OPTIONS
+    )
+    if key in _dataset_schema_cache:
+        return _dataset_schema_cache[key]
+
+    try:
+        schema_show = get_action("scheming_dataset_schema_show")
+    except KeyError:
+        schema = None
+    else:
+        try:
+            schema = schema_show({}, {"type": dataset_type})
+        except ObjectNotFound:
+            raise ObjectNotFound(f"Unknown dataset schema: {dataset_type}")
+
+    _dataset_schema_cache[key] = schema
+
+    return schema
+
+
+def clear_dataset_schema_cache():
+    """
+    Removes all memoized scheming schemas, eg after the plugins or the
+    schemas have been reloaded
+    """
+    _dataset_schema_cache.clear()
+    _schema_index_cache.clear()
+
+
+class SchemaIndex(object):
+    """
+    Lookups on the fields of a scheming dataset schema, computed once per
+    schema. Use `get_schema_index()` to get the index of a schema.
+
+    For both datasets and resources it provides:
+
+    * `<entity>_fields`: dict of fields keyed by field name
+    * `multilingual_<entity>_fields`: list with the names of the fields
+      that use one of the fluent presets
+    * `multiple_text_<entity>_fields`: set with the names of the fields
+      that use the `scheming_multiple_text` validator
+    * `repeating_<entity>_fields`: list of the fields with
+      `repeating_subfields`, in the schema order
+    * `repeating_<entity>_subfields`: dict with the set of subfield names
+      of each of these fields
+    """
+
+    def __init__(self, schema):
+        for entity in ("dataset", "resource"):
+            fields = schema.get(f"{entity}_fields") or []
+
+            by_name = {}
+            multilingual = []
+            multiple_text = set()
+            repeating = []
+            repeating_subfields = {}
+            for field in fields:
+                field_name = field["field_name"]
+                # Like looping over the fields, the first one with a name wins
+                by_name.setdefault(field_name, field)
+
+                validators = field.get("validators") or ""
+                if any(v.startswith("fluent") for v in validators.split()):
+                    multilingual.append(field_name)
+                if "scheming_multiple_text" in validators:
+                    multiple_text.add(field_name)
+                if "repeating_subfields" in field:
+                    repeating.append(field)
+                    repeating_subfields[field_name] = set(
+                        f["field_name"] for f in field["repeating_subfields"]
+                    )
+
+            setattr(self, f"{entity}_fields", by_name)
+            setattr(self, f"multilingual_{entity}_fields", multilingual)
+            setattr(self, f"multiple_text_{entity}_fields", multiple_text)
+            setattr(self, f"repeating_{entity}_fields", repeating)
+            setattr(self, f"repeating_{entity}_subfields", repeating_subfields)
+
+
+# Indexes of the schemas used, keyed by the schema id. A reference to the
+# schema is kept along with the index so ids are not reused.
+_schema_index_cache = {}
+
+SCHEMA_INDEX_CACHE_SIZE = 100
+
+
+def get_schema_index(schema):
+    """
+    Returns the `SchemaIndex` for the provided scheming schema, or None if
+    no schema is provided
+    """
+    if not schema:
+        return None
+
+    entry = _schema_index_cache.get(id(schema))
+    if entry is not None and entry[0] is schema:
+        return entry[1]
+
+    if len(_schema_index_cache) >= SCHEMA_INDEX_CACHE_SIZE:
+        _schema_index_cache.clear()
+
+    index = SchemaIndex(schema)
+    _schema_index_cache[id(schema)] = (schema, index)
+
+    return index
+
+
+ORGANIZATION_CACHE_SIZE = 1000
+ORGANIZATION_CACHE_TTL = 5 * 60
+LICENSE_CACHE_TTL = 60 * 60
+
+# Results of `organization_show` used for the publisher fallback, keyed by
+# id, loaded in batches with `prefetch_organizations`. Entries are removed when the organization is updated (see
+# `invalidate_organization`), but only in the process that handled the
+# update, so other processes can use outdated details for up to
+# ORGANIZATION_CACHE_TTL seconds
+_organization_cache = TTLCache(size=ORGANIZATION_CACHE_SIZE, ttl=ORGANIZATION_CACHE_TTL)
+
+# Mappings of licenses URL/title to id, built from the license register
+_license_cache = TTLCache(size=1, ttl=LICENSE_CACHE_TTL)
+
+
+def get_organization(org_id):
+    """
+    Returns the result of `organization_show` for an organization, or None
+    if not found
+
+    Results are cached, so each organization is only requested once for all
+    the datasets that fall back to it.
+    """
+    if org_id in _organization_cache:
+        return _organization_cache.get(org_id)
+
+    try:
+        org_dict = get_action("organization_show")({"ignore_auth": True}, {"id": org_id})
+    except ObjectNotFound:
+        org_dict = None
+
+    # Also cache organizations not found, to not request them again
+    _organization_cache.set(org_id, org_dict)
+    return org_dict
+
+
+def prefetch_organizations(org_dicts):
+    """
+    Loads the details of the provided organizations (eg the `organization`
+    of the datasets in a catalog page) that are not cached yet, with one
+    `organization_list` call per batch instead of one `organization_show`
+    call per organization
+
+    `organization_list` only accepts a limited number of organizations when
+    returning all their fields (`ckan.group_and_organization_list_all_fields_max`),
+    so bigger sets are requested in batches of that size.
+    """
+    names = {}
+    for org_dict in org_dicts:
+        if org_dict and org_dict.get("id") and org_dict.get("name"):
+            if org_dict["id"] not in _organization_cache:
+                names[org_dict["name"]] = org_dict["id"]
+    if not names:
+        return
+
+    batch_size = int(
+        config.get("ckan.group_and_organization_list_all_fields_max") or 25)
+    names = sorted(names)
+    for start in range(0, len(names), batch_size):
+        batch = names[start:start + batch_size]
+        result = get_action("organization_list")(
+            {"ignore_auth": True},
+            {
+                "organizations": batch,
+                "all_fields": True,
+                "include_extras": True,
+                "limit": len(batch),
+            },
+        )
+        # Organizations missing from the result are left to `get_organization`
+        for org_dict in result:
+            _organization_cache.set(org_dict["id"], org_dict)
+
+
+def invalidate_organization(org_id):
+    """
+    Removes the cached details of an organization, eg after it was updated
+    """
+    _organization_cache.invalidate(org_id)
+
+
+def get_license_mappings():
+    """
+    Returns a tuple with two dicts mapping license URLs and license titles
+    to the license ids in the CKAN license register
+    """
+    mappings = _license_cache.get("licenses")
+    if mappings is None:
+        license_uri2id = {}
+        license_title2id = {}
+        for license_id, license in list(LicenseRegister().items()):
+            license_uri2id[license.url] = license_id
+            license_title2id[license.title] = license_id
+        mappings = license_uri2id, license_title2id
+        _license_cache.set("licenses", mappings)
+
+    return mappings
+
+
+class SubjectIndex(object):
+    """
+    Read-only view of a graph with the objects of each subject grouped by
+    predicate
+
+    All the triples of a subject are fetched with a single lookup the first
+    time the subject is accessed, and then kept for the lifetime of the
+    index, so the graph must not be modified while the index is in use.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self._subjects = {}
+
+    def predicates(self, subject):
+        """
+        Returns a dict with the objects of the subject, keyed by predicate
+        """
+        predicates = self._subjects.get(subject)
+        if predicates is None:
+            predicates = {}
+            for predicate, _object in self.graph.predicate_objects(subject):
+                predicates.setdefault(predicate, []).append(_object)
+            self._subjects[subject] = predicates
+        return predicates
+
+    def objects(self, subject, predicate):
+        """
+        Returns a list with the objects of the subject and predicate
+        """
+        return self.predicates(subject).get(predicate, [])
+
+
 class URIRefOrLiteral(object):
     """Helper which creates an URIRef if the value appears to be an http URL,
     or a Literal otherwise. URIRefs are also cleaned using CleanedURIRef.
@@ -130,12 +394,9 @@ class RDFProfile(object):
 
     _form_languages = None
 
-    # Cache for mappings of licenses URL/title to ID built when needed in
-    # _license().
-    _licenceregister_cache = None
-
-    # Cache for organization_show details (used for publisher fallback)
-    _org_cache: dict = {}
+    # SubjectIndex of the graph, set by the parser while parsing a dataset.
+    # If not set (eg when serializing) the graph is queried directly.
+    _subject_index = None
 
     def __init__(self, graph, dataset_type="dataset", compatibility_mode=False):
         """Class constructor
@@ -154,19 +415,10 @@ class RDFProfile(object):
 
         self._default_lang = config.get("ckan.locale_default", "en")
 
-
-        try:
-            schema_show = get_action("scheming_dataset_schema_show")
-            try:
-                schema = schema_show({}, {"type": dataset_type})
-            except ObjectNotFound:
-                raise ObjectNotFound(f"Unknown dataset schema: {dataset_type}")
-
+        schema = get_dataset_schema(dataset_type)
+        if schema:
             self._dataset_schema = schema
 
-        except KeyError:
-            pass
-
         if self._dataset_schema:
             self._form_languages = self._dataset_schema.get("form_languages")
 
@@ -187,9 +439,23 @@ class RDFProfile(object):
         Yields term.URIRef objects that can be used on graph lookups
         and queries
         """
-        for distribution in self.g.objects(dataset, DCAT.distribution):
+        for distribution in self._objects(dataset, DCAT.distribution):
             yield distribution
 
+    def _objects(self, subject, predicate):
+        """
+        Returns an iterable with all the objects for this subject and predicate
+
+        Both subject and predicate must be rdflib URIRef or BNode objects
+        """
+        if (
+            self._subject_index is not None
+            and subject is not None
+            and predicate is not None
+        ):
+            return self._subject_index.objects(subject, predicate)
+        return self.g.objects(subject, predicate)
+
     def _keywords(self, dataset_ref):
         """
         Returns all DCAT keywords on a particular dataset
@@ -210,7 +476,7 @@ class RDFProfile(object):
 
         Returns an rdflib reference (URIRef or BNode) or None if not found
         """
-        for _object in self.g.objects(subject, predicate):
+        for _object in self._objects(subject, predicate):
             return _object
         return None
 
@@ -242,7 +508,7 @@ class RDFProfile(object):
         if multilingual:
             return self._object_value_multilingual(subject, predicate)
         fallback = ""
-        for o in self.g.objects(subject, predicate):
+        for o in self._objects(subject, predicate):
             if isinstance(o, Literal):
                 if o.language and o.language == self._default_lang:
                     return str(o)
@@ -250,23 +516,25 @@ class RDFProfile(object):
                 # language is available
                 elif fallback == "":
                     fallback = str(o)
-            elif len(list(self.g.objects(o, RDFS.label))):
-                return str(next(self.g.objects(o, RDFS.label)))
             else:
-                return str(o)
+                label = self._object(o, RDFS.label)
+                return str(label if label is not None else o)
         return fallback
 
     def _object_value_multilingual(self, subject, predicate):
         out = {}
-        for o in self.g.objects(subject, predicate):
+        for o in self._objects(subject, predicate):
 
             if isinstance(o, Literal):
                 if o.language:
                     out[o.language] = str(o)
                 else:
                     out[self._default_lang] = str(o)
-            elif len(list(self.g.objects(o, RDFS.label))):
-                for label in self.g.objects(o, RDFS.label):
+                continue
+
+            labels = list(self._objects(o, RDFS.label))
+            if labels:
+                for label in labels:
                     if label.language:
                         out[label.language] = str(label)
                     else:
@@ -325,7 +593,7 @@ class RDFProfile(object):
         If the value can not be parsed as integer, returns an empty list
         """
         object_values = []
-        for object in self.g.objects(subject, predicate):
+        for object in self._objects(subject, predicate):
             if object:
                 try:
                     object_values.append(int(float(object)))
@@ -343,7 +611,7 @@ class RDFProfile(object):
         If the value can not be parsed as a float, returns an empty list
         """
         object_values = []
-        for object in self.g.objects(subject, predicate):
+        for object in self._objects(subject, predicate):
             if object:
                 try:
                     object_values.append(float(object))
@@ -360,7 +628,7 @@ class RDFProfile(object):
 
         If no values found, returns an empty list
         """
-        return [str(o) for o in self.g.objects(subject, predicate)]
+        return [str(o) for o in self._objects(subject, predicate)]
 
     def _object_value_list_multilingual(self, subject, predicate):
         """
@@ -385,7 +653,7 @@ class RDFProfile(object):
         If no values found, returns an empty list
         """
         out = {}
-        for o in self.g.objects(subject, predicate):
+        for o in self._objects(subject, predicate):
             lang = o.language or self._default_lang
             if lang not in out:
                 out[lang] = []
@@ -458,7 +726,7 @@ class RDFProfile(object):
     def _read_time_interval_schema_org(self, subject, predicate):
         start_date = end_date = None
 
-        for interval in self.g.objects(subject, predicate):
+        for interval in self._objects(subject, predicate):
             start_date = self._object_value(interval, SCHEMA.startDate)
             end_date = self._object_value(interval, SCHEMA.endDate)
 
@@ -470,7 +738,7 @@ class RDFProfile(object):
     def _read_time_interval_dcat(self, subject, predicate):
         start_date = end_date = None
 
-        for interval in self.g.objects(subject, predicate):
+        for interval in self._objects(subject, predicate):
             start_date = self._object_value(interval, DCAT.startDate)
             end_date = self._object_value(interval, DCAT.endDate)
 
@@ -482,17 +750,17 @@ class RDFProfile(object):
     def _read_time_interval_time(self, subject, predicate):
         start_date = end_date = None
 
-        for interval in self.g.objects(subject, predicate):
-            start_nodes = [t for t in self.g.objects(interval, TIME.hasBeginning)]
-            end_nodes = [t for t in self.g.objects(interval, TIME.hasEnd)]
-            if start_nodes:
+        for interval in self._objects(subject, predicate):
+            start_node = self._object(interval, TIME.hasBeginning)
+            end_node = self._object(interval, TIME.hasEnd)
+            if start_node is not None:
                 start_date = self._object_value_multiple_predicate(
-                    start_nodes[0],
+                    start_node,
                     [TIME.inXSDDateTimeStamp, TIME.inXSDDateTime, TIME.inXSDDate],
                 )
-            if end_nodes:
+            if end_node is not None:
                 end_date = self._object_value_multiple_predicate(
-                    end_nodes[0],
+                    end_node,
                     [TIME.inXSDDateTimeStamp, TIME.inXSDDateTime, TIME.inXSDDate],
                 )
 
@@ -502,9 +770,7 @@ class RDFProfile(object):
         return start_date, end_date
 
     def _insert_or_update_temporal(self, dataset_dict, key, value):
-        temporal = next(
-            (item for item in dataset_dict["extras"] if (item["key"] == key)), None
-        )
+        temporal = get_extras_index(dataset_dict).get_extra(key)
         if temporal:
             temporal["value"] = value
         else:
@@ -532,7 +798,7 @@ class RDFProfile(object):
         """
 
         agents = []
-        for agent in self.g.objects(subject, predicate):
+        for agent in self._objects(subject, predicate):
             agent_details = {}
             agent_details["uri"] = str(agent) if isinstance(agent, term.URIRef) else ""
             agent_details["name"] = self._object_value(agent, FOAF.name)
@@ -561,7 +827,7 @@ class RDFProfile(object):
         """
 
         contacts = []
-        for agent in self.g.objects(subject, predicate):
+        for agent in self._objects(subject, predicate):
 
             contact = {}
             contact["uri"] = str(agent) if isinstance(agent, URIRef) else ""
@@ -589,7 +855,7 @@ class RDFProfile(object):
 
         Returns the String or None if the value is no valid GeoJSON or WKT geometry.
         """
-        for geometry in self.g.objects(spatial, datatype):
+        for geometry in self._objects(spatial, datatype):
             if geometry.datatype == URIRef(GEOJSON_IMT) or not geometry.datatype:
                 try:
                     json.loads(str(geometry))
@@ -626,21 +892,22 @@ class RDFProfile(object):
         bbox = None
         cent = None
 
-        for spatial in self.g.objects(subject, predicate):
+        for spatial in self._objects(subject, predicate):
 
             if isinstance(spatial, URIRef):
                 uri = str(spatial)
 
             if isinstance(spatial, Literal):
                 text = str(spatial)
+                continue
 
-            if (spatial, RDF.type, DCT.Location) in self.g:
+            if DCT.Location in self._objects(spatial, RDF.type):
                 geom = self._parse_geodata(spatial, LOCN.geometry, geom)
                 bbox = self._parse_geodata(spatial, DCAT.bbox, bbox)
                 cent = self._parse_geodata(spatial, DCAT.centroid, cent)
-                for label in self.g.objects(spatial, SKOS.prefLabel):
+                for label in self._objects(spatial, SKOS.prefLabel):
                     text = str(label)
-                for label in self.g.objects(spatial, RDFS.label):
+                for label in self._objects(spatial, RDFS.label):
                     text = str(label)
 
         return {
@@ -661,15 +928,7 @@ class RDFProfile(object):
         that if distributions have different licenses we'll only get the first
         one.
         """
-        if self._licenceregister_cache is not None:
-            license_uri2id, license_title2id = self._licenceregister_cache
-        else:
-            license_uri2id = {}
-            license_title2id = {}
-            for license_id, license in list(LicenseRegister().items()):
-                license_uri2id[license.url] = license_id
-                license_title2id[license.title] = license_id
-            self._licenceregister_cache = license_uri2id, license_title2id
+        license_uri2id, license_title2id = get_license_mappings()
 
         for distribution in self._distributions(dataset_ref):
             # If distribution has a license, attach it to the dataset
@@ -754,7 +1013,7 @@ class RDFProfile(object):
         elif isinstance(_format, (BNode, URIRef)):
             if self._object(_format, RDF.type) == DCT.IMT:
                 if not imt:
-                    imt = str(self.g.value(_format, default=None))
+                    imt = str(self._object(_format, RDF.value))
                 label = self._object_value(_format, RDFS.label)
             elif isinstance(_format, URIRef):
                 # If the URIRef does not reference a BNode, it could reference an IANA type.
@@ -790,9 +1049,9 @@ class RDFProfile(object):
         if key in _dict:
             return _dict[key]
 
-        for extra in _dict.get("extras", []):
-            if extra["key"] == key or extra["key"] == "dcat_" + key:
-                return extra["value"]
+        extra = get_extras_index(_dict).get_extra(key, "dcat_" + key)
+        if extra:
+            return extra["value"]
 
         return default
 
@@ -906,24 +1165,22 @@ class RDFProfile(object):
         Returns the schema field information if the provided key exists as a field in
         the dataset schema (if one was provided)
         """
-        if not self._dataset_schema:
+        schema_index = get_schema_index(self._dataset_schema)
+        if not schema_index:
             return None
 
-        for field in self._dataset_schema["dataset_fields"]:
-            if field["field_name"] == key:
-                return field
+        return schema_index.dataset_fields.get(key)
 
     def _schema_resource_field(self, key):
         """
         Returns the schema field information if the provided key exists as a field in
         the resources fields of the dataset schema (if one was provided)
         """
-        if not self._dataset_schema:
+        schema_index = get_schema_index(self._dataset_schema)
+        if not schema_index:
             return None
 
-        for field in self._dataset_schema["resource_fields"]:
-            if field["field_name"] == key:
-                return field
+        return schema_index.resource_fields.get(key)
 
     def _multilingual_dataset_fields(self):
         """
@@ -940,16 +1197,11 @@ class RDFProfile(object):
         return self._multilingual_fields(entity="resource")
 
     def _multilingual_fields(self, entity="dataset"):
-        if not self._dataset_schema:
+        schema_index = get_schema_index(self._dataset_schema)
+        if not schema_index:
             return []
 
-        out = []
-        for field in self._dataset_schema[f"{entity}_fields"]:
-            if field.get("validators") and any(
-                v for v in field["validators"].split() if v.startswith("fluent")
-            ):
-                out.append(field["field_name"])
-        return out
+        return list(getattr(schema_index, f"multilingual_{entity}_fields"))
 
     def _set_dataset_value(self, dataset_dict, key, value):
         """
@@ -970,15 +1222,15 @@ class RDFProfile(object):
         return dataset_dict
 
     def _set_list_dataset_value(self, dataset_dict, key, value):
-        schema_field = self._schema_field(key)
-        if schema_field and "scheming_multiple_text" in schema_field["validators"]:
+        schema_index = get_schema_index(self._dataset_schema)
+        if schema_index and key in schema_index.multiple_text_dataset_fields:
             return self._set_dataset_value(dataset_dict, key, value)
         else:
             return self._set_dataset_value(dataset_dict, key, json.dumps(value))
 
     def _set_list_resource_value(self, resource_dict, key, value):
-        schema_field = self._schema_resource_field(key)
-        if schema_field and "scheming_multiple_text" in schema_field["validators"]:
+        schema_index = get_schema_index(self._dataset_schema)
+        if schema_index and key in schema_index.multiple_text_resource_fields:
             resource_dict[key] = value
         else:
             resource_dict[key] = json.dumps(value)
@@ -145,7 +145,7 @@ class DCATUS3Profile(EuropeanDCATAP3Profile):
         g = self.g
 
         # Bounding box
-        for bbox_ref in g.objects(dataset_ref, DCATUS.geographicBoundingBox):
+        for bbox_ref in self._objects(dataset_ref, DCATUS.geographicBoundingBox):
             if not dataset_dict.get("bbox"):
                 dataset_dict["bbox"] = []
             dataset_dict["bbox"].append(
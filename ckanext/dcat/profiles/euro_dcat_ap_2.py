@@ -154,7 +154,7 @@ class EuropeanDCATAP2Profile(BaseEuropeanDCATAPProfile):
                     # Access services
                     access_service_list = []
 
-                    for access_service in self.g.objects(
+                    for access_service in self._objects(
                         distribution, DCAT.accessService
                     ):
                         access_service_dict = {}
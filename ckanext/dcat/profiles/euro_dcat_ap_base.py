@@ -12,7 +12,7 @@ from ckanext.dcat.utils import (
     DCAT_CLEAN_TAGS,
     publisher_uri_organization_fallback,
 )
-from .base import RDFProfile, URIRefOrLiteral, CleanedURIRef
+from .base import RDFProfile, URIRefOrLiteral, CleanedURIRef, get_organization
 from .base import (
     RDF,
     XSD,
@@ -282,7 +282,7 @@ class BaseEuropeanDCATAPProfile(RDFProfile):
                 resource_dict["size"] = size
 
             # Checksum
-            for checksum in self.g.objects(distribution, SPDX.checksum):
+            for checksum in self._objects(distribution, SPDX.checksum):
                 algorithm = self._object_value(checksum, SPDX.algorithm)
                 checksum_value = self._object_value(checksum, SPDX.checksumValue)
                 if algorithm:
@@ -449,18 +449,7 @@ class BaseEuropeanDCATAPProfile(RDFProfile):
             }
         elif dataset_dict.get("organization"):
             # Fall back to dataset org
-            org_id = dataset_dict["organization"]["id"]
-            org_dict = None
-            if org_id in self._org_cache:
-                org_dict = self._org_cache[org_id]
-            else:
-                try:
-                    org_dict = toolkit.get_action("organization_show")(
-                        {"ignore_auth": True}, {"id": org_id}
-                    )
-                    self._org_cache[org_id] = org_dict
-                except toolkit.ObjectNotFound:
-                    pass
+            org_dict = get_organization(dataset_dict["organization"]["id"])
             if org_dict:
                 publisher_ref = CleanedURIRef(
                     publisher_uri_organization_fallback(dataset_dict)
@@ -1,7 +1,7 @@
 import json
 
 from rdflib import URIRef, BNode, Literal
-from .base import RDFProfile, CleanedURIRef, URIRefOrLiteral
+from .base import RDFProfile, CleanedURIRef, URIRefOrLiteral, get_schema_index
 from .base import (
     RDF,
     DCAT,
@@ -42,12 +42,14 @@ class EuropeanDCATAPSchemingProfile(RDFProfile):
             # Not using scheming
             return dataset_dict
 
+        schema_index = get_schema_index(self._dataset_schema)
+
         # Move extras to root
 
         extras_to_remove = []
         extras = dataset_dict.get("extras", [])
         for extra in extras:
-            if self._schema_field(extra["key"]):
+            if extra["key"] in schema_index.dataset_fields:
                 # This is a field defined in the dataset schema
                 dataset_dict[extra["key"]] = extra["value"]
                 extras_to_remove.append(extra["key"])
@@ -56,13 +58,12 @@ class EuropeanDCATAPSchemingProfile(RDFProfile):
 
         # Parse lists
         def _parse_list_value(data_dict, field_name):
-            schema_field = self._schema_field(
-                field_name
-            ) or self._schema_resource_field(field_name)
+            if field_name in schema_index.dataset_fields:
+                multiple_text = field_name in schema_index.multiple_text_dataset_fields
+            else:
+                multiple_text = field_name in schema_index.multiple_text_resource_fields
 
-            if schema_field and "scheming_multiple_text" in schema_field.get(
-                "validators", []
-            ):
+            if multiple_text:
                 if isinstance(data_dict[field_name], str):
                     try:
                         data_dict[field_name] = json.loads(data_dict[field_name])
@@ -81,30 +82,28 @@ class EuropeanDCATAPSchemingProfile(RDFProfile):
             "spatial_coverage": "spatial",
             "temporal_coverage": "temporal",
         }
-        for schema_field in self._dataset_schema["dataset_fields"]:
-            if "repeating_subfields" in schema_field:
-                # Check if existing extras need to be migrated
-                field_name = schema_field["field_name"]
-                new_extras = []
-                new_dict = {}
-                check_name = new_fields_mapping.get(field_name, field_name)
-                for extra in dataset_dict.get("extras", []):
-                    if extra["key"].startswith(f"{check_name}_"):
-                        subfield = extra["key"][extra["key"].index("_") + 1 :]
-                        if subfield in [
-                            f["field_name"] for f in schema_field["repeating_subfields"]
-                        ]:
-                            new_dict[subfield] = extra["value"]
-                        else:
-                            new_extras.append(extra)
-                    elif extra["key"] == "spatial" and field_name == "spatial_coverage":
-                        # Special case, spatial geom
-                        new_dict["geom"] = extra["value"]
+        for schema_field in schema_index.repeating_dataset_fields:
+            # Check if existing extras need to be migrated
+            field_name = schema_field["field_name"]
+            subfields = schema_index.repeating_dataset_subfields[field_name]
+            new_extras = []
+            new_dict = {}
+            check_name = new_fields_mapping.get(field_name, field_name)
+            for extra in dataset_dict.get("extras", []):
+                if extra["key"].startswith(f"{check_name}_"):
+                    subfield = extra["key"][extra["key"].index("_") + 1 :]
+                    if subfield in subfields:
+                        new_dict[subfield] = extra["value"]
                     else:
                         new_extras.append(extra)
-                if new_dict:
-                    dataset_dict[field_name] = [new_dict]
-                    dataset_dict["extras"] = new_extras
+                elif extra["key"] == "spatial" and field_name == "spatial_coverage":
+                    # Special case, spatial geom
+                    new_dict["geom"] = extra["value"]
+                else:
+                    new_extras.append(extra)
+            if new_dict:
+                dataset_dict[field_name] = [new_dict]
+                dataset_dict["extras"] = new_extras
 
         # Contact details
         contacts = self._contact_details(dataset_ref, DCAT.contactPoint)
@@ -119,21 +118,20 @@ class EuropeanDCATAPSchemingProfile(RDFProfile):
                 dataset_dict[key] = agents
 
         # Repeating subfields: resources
-        for schema_field in self._dataset_schema["resource_fields"]:
-            if "repeating_subfields" in schema_field:
-                # Check if value needs to be load from JSON
-                field_name = schema_field["field_name"]
-                for resource_dict in dataset_dict.get("resources", []):
-                    if resource_dict.get(field_name) and isinstance(
-                        resource_dict[field_name], str
-                    ):
-                        try:
-                            # TODO: load only subfields in schema?
-                            resource_dict[field_name] = json.loads(
-                                resource_dict[field_name]
-                            )
-                        except ValueError:
-                            pass
+        for schema_field in schema_index.repeating_resource_fields:
+            # Check if value needs to be load from JSON
+            field_name = schema_field["field_name"]
+            for resource_dict in dataset_dict.get("resources", []):
+                if resource_dict.get(field_name) and isinstance(
+                    resource_dict[field_name], str
+                ):
+                    try:
+                        # TODO: load only subfields in schema?
+                        resource_dict[field_name] = json.loads(
+                            resource_dict[field_name]
+                        )
+                    except ValueError:
+                        pass
 
         return dataset_dict
 
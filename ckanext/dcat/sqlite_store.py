@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+'''
+rdflib store that keeps the triples in a temporary SQLite database
+
+Used to parse RDF documents that don't fit in memory. It is registered as
+the `SQLite` rdflib store plugin, so it can be selected with the
+`ckanext.dcat.graph_store` config option or the `graph_store` option of the
+RDF harvester. The database is removed when the store is closed.
+'''
+import os
+import shutil
+import sqlite3
+import tempfile
+import weakref
+
+from rdflib import URIRef, BNode, Literal
+from rdflib.plugins.stores.memory import SimpleMemory
+from rdflib.store import Store
+
+# Triples are inserted in batches of this size
+INSERT_BATCH_SIZE = 10000
+
+URIREF, BNODE, LITERAL = 0, 1, 2
+
+
+def node_key(node):
+    '''
+    Returns the string used to store a URIRef or BNode
+    '''
+    if isinstance(node, BNode):
+        return '_:' + str(node)
+    return '<' + str(node)
+
+
+def key_node(key):
+    '''
+    Returns the URIRef or BNode stored with `node_key()`
+    '''
+    if key.startswith('_:'):
+        return BNode(key[2:])
+    return URIRef(key[1:])
+
+
+def _object_columns(_object):
+    if isinstance(_object, Literal):
+        return (str(_object), LITERAL,
+                str(_object.datatype) if _object.datatype else '',
+                _object.language or '')
+    return (node_key(_object),
+            BNODE if isinstance(_object, BNode) else URIREF, '', '')
+
+
+def _column_object(value, kind, datatype, lang):
+    if kind == LITERAL:
+        return Literal(value, lang=lang or None,
+                       datatype=URIRef(datatype) if datatype else None)
+    return key_node(value)
+
+
+class SQLiteStore(Store):
+    '''
+    Triple store (not context aware) backed by a temporary SQLite database
+
+    `configuration` can be the directory where the database is created,
+    otherwise the default temp directory is used.
+    '''
+
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, configuration=None, identifier=None):
+        super(SQLiteStore, self).__init__(identifier=identifier)
+
+        self._dir = tempfile.mkdtemp(prefix='ckanext-dcat-', dir=configuration)
+        # Remove the database even if `close()` is not called
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self._dir, True)
+
+        self._conn = sqlite3.connect(os.path.join(self._dir, 'graph.db'))
+        # The database is only used for the lifetime of this object
+        self._conn.execute('PRAGMA journal_mode = OFF')
+        self._conn.execute('PRAGMA synchronous = OFF')
+        self._conn.execute(
+            'CREATE TABLE triples ('
+            's TEXT NOT NULL, p TEXT NOT NULL, o TEXT NOT NULL, '
+            'kind INTEGER NOT NULL, datatype TEXT NOT NULL, lang TEXT NOT NULL, '
+            'UNIQUE (s, p, o, kind, datatype, lang))')
+        self._conn.execute('CREATE INDEX triples_po ON triples (p, o)')
+
+        self._pending = []
+        # Namespace bindings are kept in memory
+        self._namespaces = SimpleMemory()
+
+    def _flush(self):
+        if self._pending:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO triples VALUES (?, ?, ?, ?, ?, ?)',
+                self._pending)
+            self._pending = []
+
+    def add(self, triple, context=None, quoted=False):
+        s, p, o = triple
+        self._pending.append((node_key(s), str(p)) + _object_columns(o))
+        if len(self._pending) >= INSERT_BATCH_SIZE:
+            self._flush()
+
+    def addN(self, quads):
+        for s, p, o, c in quads:
+            self.add((s, p, o), c)
+
+    def _where(self, triple_pattern):
+        s, p, o = triple_pattern
+        clauses = []
+        params = []
+        if s is not None:
+            clauses.append('s = ?')
+            params.append(node_key(s))
+        if p is not None:
+            clauses.append('p = ?')
+            params.append(str(p))
+        if o is not None:
+            clauses.extend(['o = ?', 'kind = ?', 'datatype = ?', 'lang = ?'])
+            params.extend(_object_columns(o))
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        return where, params
+
+    def remove(self, triple_pattern, context=None):
+        self._flush()
+        where, params = self._where(triple_pattern)
+        self._conn.execute('DELETE FROM triples' + where, params)
+
+    def triples(self, triple_pattern, context=None):
+        self._flush()
+        s, p, o = triple_pattern
+        # Only literals can't be stored, eg in patterns with a Literal subject
+        if isinstance(s, Literal) or isinstance(p, Literal):
+            return
+
+        where, params = self._where(triple_pattern)
+        cursor = self._conn.execute(
+            'SELECT s, p, o, kind, datatype, lang FROM triples'
+            + where + ' ORDER BY rowid', params)
+        for row in cursor:
+            triple = (
+                s if s is not None else key_node(row[0]),
+                p if p is not None else URIRef(row[1]),
+                o if o is not None else _column_object(*row[2:]),
+            )
+            yield triple, iter(())
+
+    def __len__(self, context=None):
+        self._flush()
+        return self._conn.execute('SELECT COUNT(*) FROM triples').fetchone()[0]
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def bind(self, prefix, namespace, override=True):
+        self._namespaces.bind(prefix, namespace, override=override)
+
+    def namespace(self, prefix):
+        return self._namespaces.namespace(prefix)
+
+    def prefix(self, namespace):
+        return self._namespaces.prefix(namespace)
+
+    def namespaces(self):
+        return self._namespaces.namespaces()
+
+    def close(self, commit_pending_transaction=False):
+        self._conn.close()
+        self._finalizer()
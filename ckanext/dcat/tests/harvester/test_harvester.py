@@ -12,6 +12,7 @@ try:
     from unittest.mock import patch
 except ImportError:
     from mock import patch
+from rdflib import Graph
 
 import ckan.plugins as p
 from ckantoolkit import config
@@ -644,6 +645,23 @@ class TestDCATHarvestFunctional(FunctionalHarvestTest):
                                   'text/plain',
                                   config='{"rdf_format":"text/turtle"}')
 
+    def test_harvest_create_nt_stream_parsing(self):
+
+        nt_content = Graph().parse(
+            data=self.ttl_content, format='turtle').serialize(format='nt')
+
+        self._test_harvest_create(self.ttl_mock_url,
+                                  nt_content,
+                                  'text/plain',
+                                  config='{"rdf_format":"nt", "stream_parsing":true}')
+
+    def test_harvest_create_sqlite_graph_store(self):
+
+        self._test_harvest_create(self.ttl_mock_url,
+                                  self.ttl_content,
+                                  self.ttl_content_type,
+                                  config='{"graph_store":"SQLite"}')
+
     def test_harvest_create_unicode_keywords(self):
 
         self._test_harvest_create(self.ttl_mock_url,
@@ -656,6 +674,30 @@ class TestDCATHarvestFunctional(FunctionalHarvestTest):
                                   self.ttl_commas_in_keywords,
                                   self.ttl_content_type)
 
+    @responses.activate
+    def test_harvest_create_tag_filter(self):
+
+        self._add_responses_solr_passthru()
+
+        responses.add(responses.GET, self.ttl_mock_url,
+                      body=self.ttl_unicode_in_keywords,
+                      content_type=self.ttl_content_type)
+        responses.add(responses.HEAD, self.ttl_mock_url,
+                      status=405, content_type=self.ttl_content_type)
+
+        harvest_source = self._create_harvest_source(
+            self.ttl_mock_url,
+            config='{"tag_filter_include": ["San Sebastián"]}')
+
+        self._run_full_job(harvest_source['id'], num_objects=1)
+
+        # Only the dataset with the tag was created
+        fq = "+type:dataset harvest_source_id:{0}".format(harvest_source['id'])
+        results = helpers.call_action('package_search', {}, fq=fq)
+
+        assert results['count'] == 1
+        assert results['results'][0]['title'] == 'Example dataset 2'
+
     @responses.activate
     def _test_harvest_create(self, url, content, content_type, **kwargs):
 
@@ -740,6 +782,73 @@ class TestDCATHarvestFunctional(FunctionalHarvestTest):
                         allowed=allowed_file_size, actual=actual_file_size)
         mock_save_gather_error.assert_called_once_with(msg, harvest_job)
 
+    @patch('ckanext.dcat.harvesters.DCATRDFHarvester._save_gather_error')
+    @responses.activate
+    @pytest.mark.ckan_config('ckanext.dcat.max_file_size', 1)
+    def test_harvest_file_size_while_streaming(self, mock_save_gather_error):
+        harvester = DCATRDFHarvester()
+        self._add_responses_solr_passthru()
+
+        # No Content-Length available, the size is checked while downloading
+        responses.add(responses.HEAD, self.ttl_mock_url,
+                               status=405, content_type=self.ttl_content_type)
+        responses.add(responses.GET, self.ttl_mock_url,
+                               body=b'#' * (1024 * 1024 + 1),
+                               content_type=self.ttl_content_type)
+
+        harvest_source = self._create_harvest_source(self.ttl_mock_url)
+        harvest_job = self._create_harvest_job(harvest_source['id'])
+
+        content, content_type = harvester._get_content_and_type(
+            self.ttl_mock_url, harvest_job, 1, self.ttl_content_type)
+
+        assert content is None
+        mock_save_gather_error.assert_called_once_with(
+            'Remote file is too big.', harvest_job)
+
+    @responses.activate
+    def test_get_content_and_type_bytes(self):
+        harvester = DCATRDFHarvester()
+        self._add_responses_solr_passthru()
+
+        responses.add(responses.HEAD, self.ttl_mock_url,
+                               status=405, content_type=self.ttl_content_type)
+        responses.add(responses.GET, self.ttl_mock_url,
+                               body=self.ttl_content,
+                               content_type=self.ttl_content_type)
+
+        harvest_source = self._create_harvest_source(self.ttl_mock_url)
+        harvest_job = self._create_harvest_job(harvest_source['id'])
+
+        content, content_type = harvester._get_content_and_type(
+            self.ttl_mock_url, harvest_job, 1, decode=False)
+
+        assert isinstance(content, bytearray)
+        assert content.decode('utf-8') == self.ttl_content
+        assert content_type == self.ttl_content_type
+
+    @responses.activate
+    def test_get_content_and_type_stream(self):
+        harvester = DCATRDFHarvester()
+        harvester.SPOOL_MAX_SIZE = 10
+        self._add_responses_solr_passthru()
+
+        responses.add(responses.HEAD, self.ttl_mock_url,
+                      status=405, content_type=self.ttl_content_type)
+        responses.add(responses.GET, self.ttl_mock_url,
+                      body=self.ttl_content,
+                      content_type=self.ttl_content_type)
+
+        harvest_source = self._create_harvest_source(self.ttl_mock_url)
+        harvest_job = self._create_harvest_job(harvest_source['id'])
+
+        content, content_type = harvester._get_content_and_type(
+            self.ttl_mock_url, harvest_job, 1, stream=True)
+
+        with content:
+            assert content.read().decode('utf-8') == self.ttl_content
+        assert content_type == self.ttl_content_type
+
     @responses.activate
     def test_harvest_create_rdf_pagination(self):
 
@@ -778,6 +887,41 @@ class TestDCATHarvestFunctional(FunctionalHarvestTest):
             ['Example dataset 1', 'Example dataset 2',
              'Example dataset 3', 'Example dataset 4'])
 
+    @responses.activate
+    @patch.object(DCATRDFHarvester, 'HARVEST_OBJECTS_BATCH_SIZE', 3)
+    def test_harvest_create_rdf_pagination_batched_objects(self):
+
+        self._add_responses_solr_passthru()
+
+        responses.add(responses.GET, self.rdf_mock_url_pagination_1,
+                               body=self.rdf_content_pagination_1,
+                               content_type=self.rdf_content_type)
+
+        responses.add(responses.GET, self.rdf_mock_url_pagination_2,
+                               body=self.rdf_content_pagination_2,
+                               content_type=self.rdf_content_type)
+
+        responses.add(responses.HEAD, self.rdf_mock_url_pagination_1,
+                               status=405,
+                               content_type=self.rdf_content_type)
+
+        responses.add(responses.HEAD, self.rdf_mock_url_pagination_2,
+                               status=405,
+                               content_type=self.rdf_content_type)
+
+        harvest_source = self._create_harvest_source(
+            self.rdf_mock_url_pagination_1)
+        harvest_job = self._create_harvest_job(harvest_source['id'])
+
+        harvester = DCATRDFHarvester()
+        job = harvest_model.HarvestJob.get(harvest_job['id'])
+        object_ids = harvester.gather_stage(job)
+
+        assert len(object_ids) == 4
+        objects = harvest_model.HarvestObject.filter(
+            harvest_job_id=job.id).all()
+        assert sorted(object_ids) == sorted([obj.id for obj in objects])
+
     @responses.activate
     def test_harvest_create_rdf_pagination_same_content(self):
 
@@ -883,6 +1027,136 @@ class TestDCATHarvestFunctional(FunctionalHarvestTest):
             assert result['title'] in ('Example dataset 1 (updated)',
                                        'Example dataset 2')
 
+    @responses.activate
+    @pytest.mark.ckan_config('ckanext.dcat.skip_unchanged_datasets', True)
+    def test_harvest_update_unchanged_datasets_skipped(self):
+
+        self._add_responses_solr_passthru()
+
+        url = self.rdf_mock_url
+        content = self.rdf_content
+        content_type = self.rdf_content_type
+
+        responses.add(responses.GET, url,
+                      body=content, content_type=content_type)
+        responses.add(responses.GET, url,
+                      body=content.replace('Example dataset 1',
+                                           'Example dataset 1 (updated)'),
+                      content_type=content_type)
+        responses.add(responses.HEAD, url,
+                      status=405, content_type=content_type)
+
+        harvest_source = self._create_harvest_source(url)
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        fq = "+type:dataset harvest_source_id:{0}".format(harvest_source['id'])
+        results = helpers.call_action('package_search', {}, fq=fq)
+        modified = dict((d['id'], d['metadata_modified']) for d in results['results'])
+
+        self._run_jobs()
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        results = helpers.call_action('package_search', {}, fq=fq)
+        assert results['count'] == 2
+        for dataset in results['results']:
+            if dataset['title'] == 'Example dataset 2':
+                assert dataset['metadata_modified'] == modified[dataset['id']]
+            else:
+                assert dataset['title'] == 'Example dataset 1 (updated)'
+                assert dataset['metadata_modified'] != modified[dataset['id']]
+
+        # The new objects are the current ones, both for the updated and the
+        # unchanged dataset
+        job = harvest_model.HarvestJob.filter(source_id=harvest_source['id']) \
+            .order_by(harvest_model.HarvestJob.created.desc()).first()
+        current = harvest_model.HarvestObject.filter(
+            harvest_source_id=harvest_source['id'], current=True).all()
+        assert len(current) == 2
+        assert all(obj.harvest_job_id == job.id for obj in current)
+        assert all(obj.package_id for obj in current)
+
+    @responses.activate
+    @pytest.mark.ckan_config('ckanext.dcat.skip_unchanged_datasets', True)
+    def test_harvest_update_unchanged_after_failed_update(self):
+
+        self._add_responses_solr_passthru()
+
+        url = self.rdf_mock_url
+        content = self.rdf_content
+        content_type = self.rdf_content_type
+
+        responses.add(responses.GET, url,
+                      body=content, content_type=content_type)
+        responses.add(responses.GET, url,
+                      body=content.replace('Example dataset 1',
+                                           'Example dataset 1 (updated)'),
+                      content_type=content_type)
+        responses.add(responses.HEAD, url,
+                      status=405, content_type=content_type)
+
+        harvest_source = self._create_harvest_source(url)
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        self._run_jobs()
+
+        # The update of the changed dataset fails validation
+        def invalid_package_dict(self, package_dict, dcat_dict, harvest_object):
+            package_dict['tags'] = [{'name': '!invalid!'}]
+            return package_dict
+
+        with patch.object(DCATRDFHarvester, 'modify_package_dict', invalid_package_dict):
+            self._run_full_job(harvest_source['id'], num_objects=2)
+
+        fq = "+type:dataset harvest_source_id:{0}".format(harvest_source['id'])
+        results = helpers.call_action('package_search', {}, fq=fq)
+        assert 'Example dataset 1' in [d['title'] for d in results['results']]
+
+        self._run_jobs()
+
+        # Same content as the failed job, the dataset is updated anyway
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        results = helpers.call_action('package_search', {}, fq=fq)
+        assert sorted(d['title'] for d in results['results']) == [
+            'Example dataset 1 (updated)', 'Example dataset 2']
+
+    @responses.activate
+    def test_harvest_update_unchanged_datasets_not_skipped_by_default(self):
+
+        self._add_responses_solr_passthru()
+
+        url = self.rdf_mock_url
+        content = self.rdf_content
+        content_type = self.rdf_content_type
+
+        responses.add(responses.GET, url,
+                      body=content, content_type=content_type)
+        responses.add(responses.GET, url,
+                      body=content, content_type=content_type)
+        responses.add(responses.HEAD, url,
+                      status=405, content_type=content_type)
+
+        harvest_source = self._create_harvest_source(url)
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        fq = "+type:dataset harvest_source_id:{0}".format(harvest_source['id'])
+        results = helpers.call_action('package_search', {}, fq=fq)
+        modified = dict((d['id'], d['metadata_modified']) for d in results['results'])
+
+        self._run_jobs()
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        # Both datasets are updated again, even if they did not change
+        results = helpers.call_action('package_search', {}, fq=fq)
+        assert results['count'] == 2
+        for dataset in results['results']:
+            assert dataset['metadata_modified'] != modified[dataset['id']]
+
     def test_harvest_update_existing_resources(self):
 
         existing, new = self._test_harvest_update_resources(self.rdf_mock_url,
@@ -966,6 +1240,14 @@ class TestDCATHarvestFunctional(FunctionalHarvestTest):
                                   self.ttl_remote_file_small,
                                   self.ttl_content_type)
 
+    @patch.object(DCATRDFHarvester, 'HARVEST_OBJECTS_BATCH_SIZE', 1)
+    def test_harvest_delete_rdf_batched(self):
+
+        self._test_harvest_delete(self.rdf_mock_url,
+                                  self.rdf_content,
+                                  self.rdf_remote_file_small,
+                                  self.rdf_content_type)
+
     @responses.activate
     def _test_harvest_delete(self, url, content, content_small, content_type):
 
@@ -1002,6 +1284,101 @@ class TestDCATHarvestFunctional(FunctionalHarvestTest):
 
         assert results['results'][0]['title'] == 'Example dataset 1'
 
+    @responses.activate
+    @pytest.mark.ckan_config('ckanext.dcat.conditional_requests', True)
+    def test_harvest_conditional_request_not_modified(self):
+
+        self._add_responses_solr_passthru()
+
+        etag = '"abcd"'
+
+        def get_callback(request):
+            if request.headers.get('If-None-Match') == etag:
+                return (304, {}, '')
+            return (200, {'ETag': etag, 'Content-Type': self.rdf_content_type},
+                    self.rdf_content)
+
+        responses.add_callback(responses.GET, self.rdf_mock_url,
+                               callback=get_callback)
+        responses.add(responses.HEAD, self.rdf_mock_url,
+                               status=405, content_type=self.rdf_content_type)
+
+        harvest_source = self._create_harvest_source(self.rdf_mock_url)
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        # Run the jobs to mark the previous one as Finished
+        self._run_jobs()
+
+        harvest_job = self._create_harvest_job(harvest_source['id'])
+        job = harvest_model.HarvestJob.get(harvest_job['id'])
+
+        object_ids = DCATRDFHarvester().gather_stage(job)
+
+        # Nothing to create, update or delete
+        assert object_ids == []
+        assert (responses.calls[-1].request.headers['If-None-Match'] == etag)
+
+        fq = "+type:dataset harvest_source_id:{0}".format(harvest_source['id'])
+        results = helpers.call_action('package_search', {}, fq=fq)
+
+        assert results['count'] == 2
+
+    @responses.activate
+    def test_harvest_conditional_request_disabled_by_default(self):
+
+        self._add_responses_solr_passthru()
+
+        responses.add(responses.GET, self.rdf_mock_url,
+                               body=self.rdf_content,
+                               content_type=self.rdf_content_type,
+                               headers={'ETag': '"abcd"'})
+        responses.add(responses.HEAD, self.rdf_mock_url,
+                               status=405, content_type=self.rdf_content_type)
+
+        harvest_source = self._create_harvest_source(self.rdf_mock_url)
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        self._run_jobs()
+
+        harvest_job = self._create_harvest_job(harvest_source['id'])
+        job = harvest_model.HarvestJob.get(harvest_job['id'])
+
+        object_ids = DCATRDFHarvester().gather_stage(job)
+
+        assert len(object_ids) == 2
+        assert 'If-None-Match' not in responses.calls[-1].request.headers
+
+    @responses.activate
+    @pytest.mark.ckan_config('ckanext.dcat.conditional_requests', True)
+    def test_harvest_conditional_request_force_import(self):
+
+        self._add_responses_solr_passthru()
+
+        responses.add(responses.GET, self.rdf_mock_url,
+                      body=self.rdf_content,
+                      content_type=self.rdf_content_type,
+                      headers={'ETag': '"abcd"'})
+        responses.add(responses.HEAD, self.rdf_mock_url,
+                      status=405, content_type=self.rdf_content_type)
+
+        harvest_source = self._create_harvest_source(self.rdf_mock_url)
+
+        self._run_full_job(harvest_source['id'], num_objects=2)
+
+        self._run_jobs()
+
+        harvest_job = self._create_harvest_job(harvest_source['id'])
+        job = harvest_model.HarvestJob.get(harvest_job['id'])
+
+        harvester = DCATRDFHarvester()
+        harvester.force_import = True
+        object_ids = harvester.gather_stage(job)
+
+        assert len(object_ids) == 2
+        assert 'If-None-Match' not in responses.calls[-1].request.headers
+
     def test_harvest_bad_format_rdf(self):
 
         self._test_harvest_bad_format(self.rdf_mock_url,
@@ -1530,12 +1907,13 @@ class TestDCATHarvestFunctionalExtensionPoints(FunctionalHarvestTest):
         # Run a second job
         self._run_full_job(harvest_source['id'], num_objects=2)
 
+        # Only the modified dataset is updated
         assert plugin.calls['update_package_schema_for_create'] == 2
         assert plugin.calls['before_create'] == 2
         assert plugin.calls['after_create'] == 2
-        assert plugin.calls['update_package_schema_for_update'] == 2
-        assert plugin.calls['before_update'] == 2
-        assert plugin.calls['after_update'] == 2
+        assert plugin.calls['update_package_schema_for_update'] == 1
+        assert plugin.calls['before_update'] == 1
+        assert plugin.calls['after_update'] == 1
 
 
 @pytest.mark.usefixtures(
@@ -1666,19 +2044,45 @@ class TestDCATRDFHarvester(object):
     def test_validates_correct_config(self):
         harvester = DCATRDFHarvester()
 
-        for config in ['{}', '{"rdf_format":"text/turtle"}']:
+        for config in ['{}', '{"rdf_format":"text/turtle"}',
+                       '{"rdf_format":"nt", "stream_parsing":true}',
+                       '{"graph_store":"SQLite"}',
+                       '{"tag_filter_include":["Climate"]}']:
             assert config == harvester.validate_config(config)
 
     def test_does_not_validate_incorrect_config(self):
         harvester = DCATRDFHarvester()
 
-        for config in ['invalid', '{invalid}', '{rdf_format:invalid}']:
+        for config in ['invalid', '{invalid}', '{rdf_format:invalid}',
+                       '{"stream_parsing":"yes"}', '{"graph_store":"unknown"}',
+                       '{"format_filter_include":"csv"}']:
             try:
                 harvester.validate_config(config)
                 assert False
             except ValueError:
                 assert True
 
+    def test_get_unique_name(self):
+        harvester = DCATRDFHarvester()
+        harvester._reset_names_taken()
+
+        names = [
+            'example', 'example', 'example-extra', 'example', 'example-1',
+            'other', 'example-1', 'other-', 'other-', 'other', 'example',
+        ]
+
+        # Previous implementation, scanning all the names taken
+        names_taken = []
+        expected = []
+        for name in names:
+            if name in names_taken:
+                suffix = len([i for i in names_taken if i.startswith(name + '-')]) + 1
+                name = '{}-{}'.format(name, suffix)
+            names_taken.append(name)
+            expected.append(name)
+
+        assert [harvester._get_unique_name(name) for name in names] == expected
+
 
 class TestIDCATRDFHarvester(object):
 
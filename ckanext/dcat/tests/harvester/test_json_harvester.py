@@ -1,19 +1,27 @@
 from __future__ import absolute_import
 from builtins import object
+import io
+import json
 
 import responses
 import pytest
 
 try:
+    from unittest import mock
     from unittest.mock import patch
 except ImportError:
+    import mock
     from mock import patch
 
 from ckantoolkit.tests import helpers
 
 import ckan.tests.factories as factories
 
-from ckanext.dcat.harvesters._json import copy_across_resource_ids, DCATJSONHarvester
+from ckanext.dcat.harvesters._json import (
+    copy_across_resource_ids,
+    DCATJSONHarvester,
+    _guids_fingerprint,
+)
 
 from .test_harvester import FunctionalHarvestTest, clean_queues
 
@@ -124,6 +132,14 @@ class TestDCATJSONHarvestFunctional(FunctionalHarvestTest):
                                   self.json_content_type,
                                   exp_titles=['Example dataset 1', 'Example dataset 2'])
 
+    def test_harvest_create_stream_parsing(self):
+
+        self._test_harvest_create(self.json_mock_url,
+                                  self.json_content,
+                                  self.json_content_type,
+                                  exp_titles=['Example dataset 1', 'Example dataset 2'],
+                                  config='{"stream_parsing": true}')
+
     @pytest.mark.ckan_config('ckanext.harvest.user_name', 'harvest_user')
     @responses.activate
     def _test_harvest_create(
@@ -347,6 +363,113 @@ class TestDCATJSONHarvestFunctional(FunctionalHarvestTest):
             exp_num_datasets=0)
 
 
+class TestDCATJSONHarvester(object):
+
+    @pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+    @pytest.mark.ckan_config('ckan.plugins', 'dcat harvest dcat_json_harvester')
+    def test_rename_datasets_for_deletion(self):
+        datasets = [factories.Dataset() for i in range(3)]
+
+        harvester = DCATJSONHarvester()
+        harvester._rename_datasets_for_deletion(
+            [dataset['id'] for dataset in datasets[:2]])
+
+        for dataset in datasets[:2]:
+            new_name = dataset['id'] + '-deleted'
+            assert helpers.call_action('package_show', id=dataset['id'])['name'] == new_name
+
+            # The search index is updated as well
+            results = helpers.call_action(
+                'package_search', fq='id:{0}'.format(dataset['id']))
+            assert results['results'][0]['name'] == new_name
+
+        assert helpers.call_action(
+            'package_show', id=datasets[2]['id'])['name'] == datasets[2]['name']
+
+    def test_get_guids_and_datasets_stream_parsing(self):
+        content = TestDCATJSONHarvestFunctional.json_content_with_distribution
+
+        harvester = DCATJSONHarvester()
+        harvester._set_config('')
+        expected = list(harvester._get_guids_and_datasets(content))
+
+        harvester._set_config('{"stream_parsing": true}')
+        datasets = list(harvester._get_guids_and_datasets(content.encode('utf-8')))
+
+        assert [guid for guid, _ in datasets] == [guid for guid, _ in expected]
+        for (_, as_string), (_, expected_string) in zip(datasets, expected):
+            # The source text is kept as is
+            assert as_string in content
+            assert json.loads(as_string) == json.loads(expected_string)
+
+    def test_get_guids_and_datasets_stream_parsing_no_identifier(self):
+        content = '[{"title": "Dataset 1"},   {"title": "Dataset 2"}]'
+
+        harvester = DCATJSONHarvester()
+        harvester._set_config('')
+        expected = list(harvester._get_guids_and_datasets(content))
+
+        harvester._set_config('{"stream_parsing": true}')
+        datasets = list(harvester._get_guids_and_datasets(content.encode('utf-8')))
+
+        # Same guids regardless of the source formatting
+        assert [guid for guid, _ in datasets] == [guid for guid, _ in expected]
+
+        # Downloads are passed as file objects
+        datasets = list(harvester._get_guids_and_datasets(
+            io.BytesIO(content.encode('utf-8'))))
+
+        assert [guid for guid, _ in datasets] == [guid for guid, _ in expected]
+
+    def test_get_guids_and_datasets_stream_parsing_invalid(self):
+        harvester = DCATJSONHarvester()
+        harvester._set_config('{"stream_parsing": true}')
+
+        with pytest.raises(ValueError):
+            list(harvester._get_guids_and_datasets(b'{"dataset": [{"title": "a"},'))
+
+    def test_guids_fingerprint(self):
+        guids = ['guid-{0}'.format(i) for i in range(1000)]
+
+        assert _guids_fingerprint(guids) == _guids_fingerprint(list(reversed(guids)))
+        assert _guids_fingerprint(guids) != _guids_fingerprint(guids[:-1])
+        assert _guids_fingerprint(['a', 'a', 'b']) != _guids_fingerprint(['a', 'b', 'b'])
+
+    def test_validate_config(self):
+        harvester = DCATJSONHarvester()
+
+        assert json.loads(harvester.validate_config('{"stream_parsing": true}')) == {
+            'stream_parsing': True}
+
+        with pytest.raises(ValueError):
+            harvester.validate_config('{"stream_parsing": "yes"}')
+
+    def test_modify_package_dict_config_compiled_once_per_job(self):
+        harvester = DCATJSONHarvester()
+
+        job = mock.Mock(id='job-1')
+        job.source.config = '{"default_tags": [{"name": "geo"}]}'
+        harvest_object = mock.Mock(job=job)
+
+        with patch.object(harvester, '_set_config',
+                          wraps=harvester._set_config) as set_config:
+            for i in range(3):
+                package_dict = harvester.modify_package_dict(
+                    {'name': 'test-{0}'.format(i)}, {}, harvest_object)
+                assert package_dict['tags'] == [{'name': 'geo'}]
+
+            assert set_config.call_count == 1
+
+            # A new job or source config is compiled again
+            harvest_object.job = mock.Mock(id='job-2')
+            harvest_object.job.source.config = '{}'
+            package_dict = harvester.modify_package_dict(
+                {'name': 'test'}, {}, harvest_object)
+
+            assert set_config.call_count == 2
+            assert 'tags' not in package_dict
+
+
 class TestCopyAcrossResourceIds(object):
     def test_copied_because_same_uri(self):
         harvested_dataset = {'resources': [
@@ -14,7 +14,12 @@ from ckantoolkit import config
 from ckantoolkit.tests import helpers, factories
 
 
-from ckanext.dcat.logic import _pagination_info
+from ckanext.dcat.logic import (
+    _pagination_info,
+    _search_ckan_datasets,
+    _encode_cursor,
+    _decode_cursor,
+)
 from ckanext.dcat.processors import RDFParser
 
 
@@ -67,6 +72,29 @@ def test_dataset_show_without_format():
     assert dcat_dataset['notes'] == dataset['notes']
 
 
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+@pytest.mark.ckan_config('ckanext.dcat.dataset_cache.backend', 'memory')
+def test_dataset_show_cached():
+    dataset = factories.Dataset(
+        notes='Test dataset'
+    )
+
+    content = helpers.call_action('dcat_dataset_show', id=dataset['id'], format='ttl')
+
+    with mock.patch('ckanext.dcat.logic.RDFSerializer') as mock_serializer:
+        cached_content = helpers.call_action('dcat_dataset_show', id=dataset['id'], format='ttl')
+
+        assert cached_content == content
+        assert not mock_serializer.called
+
+    # Updating the dataset invalidates the cached serialization
+    helpers.call_action('package_patch', id=dataset['id'], title='Updated title')
+
+    content = helpers.call_action('dcat_dataset_show', id=dataset['id'], format='ttl')
+
+    assert 'Updated title' in content
+
+
 # Pagination
 
 @pytest.mark.usefixtures("with_request_context")
@@ -292,3 +320,110 @@ class TestPagination(object):
 
         with pytest.raises(toolkit.ValidationError):
             _pagination_info(query, data_dict)
+
+    @pytest.mark.ckan_config('ckanext.dcat.datasets_per_page', 10)
+    @pytest.mark.ckan_config('ckan.site_url', 'http://test.ckan.net')
+    def test_pagination_cursor(self):
+
+        # First page
+        query = {
+            'count': 25,
+            'results': [x for x in range(10)],
+            'next_cursor': 'abc',
+        }
+        data_dict = {
+            'page': None
+        }
+
+        pagination = _pagination_info(query, data_dict)
+
+        assert pagination['count'] == 25
+        assert pagination['current'].endswith('?page=1')
+        assert pagination['first'].endswith('?page=1')
+        assert pagination['next'].endswith('?cursor=abc')
+        assert 'last' not in pagination
+        assert 'previous' not in pagination
+
+        # Page requested with a cursor, the count is the number of datasets
+        # from the cursor on
+        query = {
+            'count': 15,
+            'results': [x for x in range(10)],
+            'next_cursor': 'def',
+        }
+        data_dict = {
+            'page': None,
+            'cursor': 'abc',
+        }
+
+        pagination = _pagination_info(query, data_dict)
+
+        assert pagination['current'].endswith('?cursor=abc')
+        assert pagination['first'].endswith('?page=1')
+        assert pagination['next'].endswith('?cursor=def')
+        assert 'count' not in pagination
+        assert 'last' not in pagination
+        assert 'previous' not in pagination
+
+        # Last page
+        query = {
+            'count': 5,
+            'results': [x for x in range(5)],
+            'next_cursor': None,
+        }
+        data_dict = {
+            'page': None,
+            'cursor': 'def',
+        }
+
+        pagination = _pagination_info(query, data_dict)
+
+        assert pagination['current'].endswith('?cursor=def')
+        assert 'next' not in pagination
+        assert 'previous' not in pagination
+
+
+class TestCursorPagination(object):
+
+    def test_encode_decode_cursor(self):
+        cursor = _encode_cursor({
+            'id': '4b6fe9ca-dc77-4cec-92a4-55c6624a5bd6',
+            'metadata_modified': '2024-01-15T10:30:00.123456',
+        })
+
+        assert '=' not in cursor
+        assert _decode_cursor(cursor) == (
+            '2024-01-15T10:30:00.123Z', '4b6fe9ca-dc77-4cec-92a4-55c6624a5bd6')
+
+    @pytest.mark.parametrize('cursor', [
+        'a',
+        'not-a-cursor',
+        # 2024-01-15T10:30:00|id") OR *:*
+        'MjAyNC0wMS0xNVQxMDozMDowMHxpZCIpIE9SICo6Kg',
+    ])
+    def test_decode_wrong_cursor(self, cursor):
+        with pytest.raises(toolkit.ValidationError):
+            _decode_cursor(cursor)
+
+    @pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+    @pytest.mark.ckan_config('ckanext.dcat.datasets_per_page', 2)
+    @pytest.mark.ckan_config('ckanext.dcat.cursor_pagination', True)
+    def test_search_datasets_with_cursor(self):
+        datasets = [factories.Dataset() for i in range(5)]
+
+        dataset_ids = []
+        data_dict = {}
+        while True:
+            query = _search_ckan_datasets({}, data_dict)
+
+            # Datasets from the cursor on
+            assert query['count'] == 5 - len(dataset_ids)
+            assert len(query['results']) <= 2
+            dataset_ids.extend(d['id'] for d in query['results'])
+
+            if not query['next_cursor']:
+                break
+            data_dict = {'cursor': query['next_cursor']}
+
+        # All datasets returned once
+        assert sorted(dataset_ids) == sorted(d['id'] for d in datasets)
@@ -1,14 +1,18 @@
 from builtins import str
 from builtins import object
+import io
+import tracemalloc
 
 import pytest
 
 from ckantoolkit import config
 
-from rdflib import Graph, URIRef, Literal
+from rdflib import Graph, ConjunctiveGraph, URIRef, Literal
 from rdflib.namespace import Namespace, RDF
 
+import ckanext.dcat.processors as processors
 from ckanext.dcat.processors import (
+    GRAPH_STORE_CONFIG_OPTION,
     RDFParser,
     RDFParserException,
     RDFProfileException,
@@ -18,6 +22,7 @@ from ckanext.dcat.processors import (
 )
 
 from ckanext.dcat.profiles import RDFProfile
+from ckanext.dcat.tests.utils import get_file_contents
 
 DCT = Namespace("http://purl.org/dc/terms/")
 DCAT = Namespace("http://www.w3.org/ns/dcat#")
@@ -55,6 +60,26 @@ def _default_graph():
     return g
 
 
+def _scaled_catalog_graph(g, copies):
+    '''
+    Adds to the graph `copies` copies of the catalog fixture, renaming all
+    its nodes on each copy
+    '''
+    source = Graph()
+    source.parse(data=get_file_contents('dcat/catalog.rdf'), format='xml')
+    nodes = set(source.subjects())
+
+    for i in range(copies):
+        def rename(term):
+            if term not in nodes:
+                return term
+            return type(term)('{0}-{1}'.format(term, i))
+        for s, p, o in source:
+            g.add((rename(s), p, rename(o)))
+
+    return g
+
+
 class MockRDFProfile1(RDFProfile):
 
     def parse_dataset(self, dataset_dict, dataset_ref):
@@ -122,6 +147,245 @@ class TestRDFParser(object):
             assert dataset['profile_1']
             assert dataset['profile_2']
 
+    def test_datasets_in_parallel(self):
+
+        p = RDFParser()
+
+        p._profiles = [MockRDFProfile1, MockRDFProfile2]
+
+        p.g = _default_graph()
+
+        datasets = [d for d in p.datasets()]
+        parallel_datasets = [d for d in p.datasets(workers=2)]
+
+        assert len(parallel_datasets) == 3
+        assert parallel_datasets == datasets
+
+    def test_datasets_in_parallel_real_profiles(self):
+
+        contents = get_file_contents('dcat/catalog.rdf')
+
+        p = RDFParser(profiles=['euro_dcat_ap_2'])
+
+        p.parse(contents)
+
+        datasets = [d for d in p.datasets()]
+        parallel_datasets = [d for d in p.datasets(workers=2)]
+
+        assert len(parallel_datasets) == len(datasets)
+        assert ([d['title'] for d in parallel_datasets]
+                == [d['title'] for d in datasets])
+
+    def test_datasets_in_parallel_sqlite_store(self, monkeypatch):
+
+        contents = get_file_contents('dcat/catalog.rdf')
+
+        p = RDFParser(profiles=['euro_dcat_ap_2'], graph_store='SQLite')
+        p.parse(contents)
+
+        def _datasets_in_parallel(workers):
+            raise AssertionError('SQLite graphs can not be shared with forked processes')
+
+        monkeypatch.setattr(p, '_datasets_in_parallel', _datasets_in_parallel)
+
+        datasets = [d for d in p.datasets(workers=2)]
+        p.close()
+
+        assert len(datasets) == 2
+
+    def test_datasets_in_parallel_stream(self):
+
+        nt_content = Graph().parse(
+            data=get_file_contents('dcat/catalog.rdf'), format='xml'
+        ).serialize(format='nt')
+
+        p = RDFParser(profiles=['euro_dcat_ap_2'])
+        p.parse_stream(io.BytesIO(nt_content.encode('utf-8')), _format='nt')
+
+        datasets = [d for d in p.datasets()]
+        # Each worker opens its own connection to the database
+        parallel_datasets = [d for d in p.datasets(workers=2)]
+        p.close()
+
+        assert len(parallel_datasets) == 2
+        assert parallel_datasets == datasets
+
+    def test_datasets_subject_index_lookups(self, monkeypatch):
+
+        g = _scaled_catalog_graph(ConjunctiveGraph(), 50)
+
+        lookups = []
+
+        def _parse(without_index=False):
+            p = RDFParser(profiles=['euro_dcat_ap_2'])
+            p.g = g
+            if without_index:
+                monkeypatch.setattr(processors, 'SubjectIndex', lambda graph: None)
+
+            del lookups[:]
+            original_triples = g.triples
+
+            def triples(*args, **kwargs):
+                lookups.append(args)
+                return original_triples(*args, **kwargs)
+
+            monkeypatch.setattr(g, 'triples', triples)
+            datasets = [d for d in p.datasets()]
+            monkeypatch.undo()
+
+            return datasets, len(lookups)
+
+        datasets, indexed_lookups = _parse()
+        expected, graph_lookups = _parse(without_index=True)
+
+        assert len(datasets) == 100
+        assert datasets == expected
+        assert indexed_lookups < graph_lookups / 2
+
+    @pytest.mark.parametrize('store,graph_class', [
+        pytest.param('SimpleMemory', Graph, marks=pytest.mark.ckan_config(
+            GRAPH_STORE_CONFIG_OPTION, 'SimpleMemory')),
+        pytest.param('Memory', ConjunctiveGraph, marks=pytest.mark.ckan_config(
+            GRAPH_STORE_CONFIG_OPTION, 'Memory')),
+    ])
+    def test_graph_store(self, store, graph_class):
+
+        p = RDFParser()
+
+        assert type(p.g) is graph_class
+        assert p.g.store.__class__.__name__ == store
+
+    @pytest.mark.ckan_config(GRAPH_STORE_CONFIG_OPTION, 'unknown')
+    def test_graph_store_unknown(self):
+
+        with pytest.raises(ValueError):
+            RDFParser()
+
+    def test_graph_stores_same_datasets(self):
+
+        data = _scaled_catalog_graph(Graph(), 200).serialize(format='nt')
+
+        results = {}
+        for store in ('SimpleMemory', 'Memory', 'SQLite'):
+            p = RDFParser(profiles=['euro_dcat_ap_2'], graph_store=store)
+            p.parse(data, _format='nt')
+            results[store] = [d for d in p.datasets()]
+            p.close()
+
+        assert len(results['SimpleMemory']) == 400
+        assert results['Memory'] == results['SimpleMemory']
+        assert results['SQLite'] == results['SimpleMemory']
+
+    def test_sqlite_graph_store_memory(self):
+
+        data = _scaled_catalog_graph(Graph(), 200).serialize(format='turtle')
+
+        peaks = {}
+        for store in ('SimpleMemory', 'SQLite'):
+            p = RDFParser(profiles=['euro_dcat_ap_2'], graph_store=store)
+
+            tracemalloc.start()
+            p.parse(data, _format='turtle')
+            datasets = [d for d in p.datasets()]
+            peaks[store] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            p.close()
+            assert len(datasets) == 400
+
+        # tracemalloc only traces the allocations of the Python allocator,
+        # not the ones made by SQLite itself (page cache, statements), so
+        # this only checks that the triples are not kept in Python objects
+        assert peaks['SQLite'] < peaks['SimpleMemory']
+
+    def test_parse_json_ld_named_graph(self):
+
+        data = '''{
+            "@id": "http://example.org/graph",
+            "@graph": [{
+                "@id": "http://example.org/datasets/1",
+                "@type": "http://www.w3.org/ns/dcat#Dataset",
+                "http://purl.org/dc/terms/title": "Test Dataset 1"
+            }]
+        }'''
+
+        p = RDFParser()
+        p.parse(data, _format='json-ld')
+
+        datasets = [d for d in p.datasets()]
+
+        assert len(datasets) == 1
+        assert datasets[0]['title'] == 'Test Dataset 1'
+
+    @pytest.mark.parametrize('_format,data', [
+        ('application/ld+json', '''{
+            "@id": "http://example.org/graph",
+            "@graph": [{
+                "@id": "http://example.org/datasets/1",
+                "@type": "http://www.w3.org/ns/dcat#Dataset",
+                "http://purl.org/dc/terms/title": "Test Dataset 1"
+            }]
+        }'''),
+        ('application/n-quads', '''
+            <http://example.org/datasets/1> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Dataset> <http://example.org/graph> .
+            <http://example.org/datasets/1> <http://purl.org/dc/terms/title> "Test Dataset 1" <http://example.org/graph> .
+        '''),
+    ])
+    def test_parse_named_graph_mime_type(self, _format, data):
+
+        p = RDFParser()
+        p.parse(data, _format=_format)
+
+        datasets = [d for d in p.datasets()]
+
+        assert p.g.context_aware
+        assert len(datasets) == 1
+        assert datasets[0]['title'] == 'Test Dataset 1'
+
+    def test_parse_named_graph_keeps_parsed_triples(self):
+
+        p = RDFParser()
+        p.parse(get_file_contents('dcat/catalog.rdf'))
+        p.parse('''{
+            "@id": "http://example.org/graph",
+            "@graph": [{
+                "@id": "http://example.org/datasets/3",
+                "@type": "http://www.w3.org/ns/dcat#Dataset",
+                "http://purl.org/dc/terms/title": "Test Dataset 3"
+            }]
+        }''', _format='json-ld')
+
+        datasets = [d for d in p.datasets()]
+
+        assert len(datasets) == 3
+
+    def test_parse_stream(self):
+
+        data = Graph().parse(
+            data=get_file_contents('dcat/catalog.rdf'), format='xml'
+        ).serialize(format='nt')
+
+        p = RDFParser(profiles=['euro_dcat_ap_2'])
+        p.parse(data, _format='nt')
+        expected = sorted(p.datasets(), key=lambda d: d['title'])
+
+        p = RDFParser(profiles=['euro_dcat_ap_2'])
+        p.parse_stream(io.BytesIO(data.encode('utf-8')), _format='nt')
+        try:
+            datasets = sorted(p.datasets(), key=lambda d: d['title'])
+        finally:
+            p.close()
+
+        assert len(datasets) == 2
+        assert datasets == expected
+
+    def test_parse_stream_unsupported_format(self):
+
+        p = RDFParser()
+
+        with pytest.raises(RDFParserException):
+            p.parse_stream(io.BytesIO(b''), _format='xml')
+
     def test_parse_data(self):
 
         data = '''<?xml version="1.0" encoding="utf-8" ?>
@@ -142,6 +406,24 @@ class TestRDFParser(object):
 
         assert len(p.g) == 2
 
+    def test_parse_file_object(self):
+
+        data = b'''<?xml version="1.0" encoding="utf-8" ?>
+        <rdf:RDF
+         xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+         xmlns:rdfs="http://www.w3.org/2000/01/rdf-schema#">
+        <rdfs:SomeClass rdf:about="http://example.org">
+            <rdfs:label>Some label</rdfs:label>
+        </rdfs:SomeClass>
+        </rdf:RDF>
+        '''
+
+        p = RDFParser()
+
+        p.parse(io.BytesIO(data))
+
+        assert len(p.g) == 2
+
     def test_parse_pagination_next_page_deprecated_vocabulary_only(self):
 
         data = '''<?xml version="1.0" encoding="utf-8" ?>
@@ -1,5 +1,6 @@
 from builtins import str
 from builtins import object
+from unittest import mock
 
 import pytest
 
@@ -7,6 +8,13 @@ from rdflib import Graph, URIRef, Literal
 from rdflib.namespace import Namespace
 
 from ckanext.dcat.profiles import RDFProfile, CleanedURIRef
+from ckanext.dcat.profiles.base import (
+    clear_dataset_schema_cache,
+    get_schema_index,
+    get_organization,
+    invalidate_organization,
+    prefetch_organizations,
+)
 
 from ckanext.dcat.tests.profiles.base.test_base_parser import _default_graph
 
@@ -17,6 +25,143 @@ DCAT = Namespace("http://www.w3.org/ns/dcat#")
 ADMS = Namespace("http://www.w3.org/ns/adms#")
 
 
+class TestDatasetSchemaCache(object):
+
+    def setup_method(self):
+        clear_dataset_schema_cache()
+
+    def teardown_method(self):
+        clear_dataset_schema_cache()
+
+    def test_schema_loaded_once(self):
+        schema = {"dataset_type": "dataset", "dataset_fields": [], "resource_fields": []}
+        schema_show = mock.Mock(return_value=schema)
+
+        with mock.patch(
+            "ckanext.dcat.profiles.base.get_action", return_value=schema_show
+        ):
+            profiles = [RDFProfile(Graph()) for _ in range(3)]
+
+        assert schema_show.call_count == 1
+        for profile in profiles:
+            assert profile._dataset_schema is schema
+
+    def test_no_scheming(self):
+        get_action = mock.Mock(side_effect=KeyError)
+
+        with mock.patch("ckanext.dcat.profiles.base.get_action", get_action):
+            profiles = [RDFProfile(Graph()) for _ in range(3)]
+
+        assert get_action.call_count == 1
+        for profile in profiles:
+            assert profile._dataset_schema is None
+
+    def test_clear_cache(self):
+        schema = {"dataset_type": "dataset", "dataset_fields": [], "resource_fields": []}
+        schema_show = mock.Mock(return_value=schema)
+
+        with mock.patch(
+            "ckanext.dcat.profiles.base.get_action", return_value=schema_show
+        ):
+            RDFProfile(Graph())
+            clear_dataset_schema_cache()
+            RDFProfile(Graph())
+
+        assert schema_show.call_count == 2
+
+
+class TestSchemaIndex(object):
+
+    schema = {
+        "dataset_type": "dataset",
+        "dataset_fields": [
+            {"field_name": "title", "validators": "fluent_text"},
+            {"field_name": "theme", "validators": "ignore_missing scheming_multiple_text"},
+            {"field_name": "notes"},
+            {
+                "field_name": "contact",
+                "repeating_subfields": [{"field_name": "name"}, {"field_name": "email"}],
+            },
+        ],
+        "resource_fields": [
+            {"field_name": "name", "validators": "fluent_core_translated_output"},
+            {"field_name": "language", "validators": "scheming_multiple_text"},
+        ],
+    }
+
+    def test_index(self):
+        index = get_schema_index(self.schema)
+
+        assert index.dataset_fields["notes"] == {"field_name": "notes"}
+        assert "language" not in index.dataset_fields
+        assert index.multilingual_dataset_fields == ["title"]
+        assert index.multiple_text_dataset_fields == {"theme"}
+        assert [f["field_name"] for f in index.repeating_dataset_fields] == ["contact"]
+        assert index.repeating_dataset_subfields == {"contact": {"name", "email"}}
+
+        assert index.resource_fields["language"]["validators"] == "scheming_multiple_text"
+        assert index.multilingual_resource_fields == ["name"]
+        assert index.multiple_text_resource_fields == {"language"}
+        assert index.repeating_resource_fields == []
+
+    def test_index_built_once(self):
+        assert get_schema_index(self.schema) is get_schema_index(self.schema)
+        assert get_schema_index(None) is None
+
+    def test_profile_lookups(self):
+        profile = RDFProfile(Graph())
+        profile._dataset_schema = self.schema
+
+        assert profile._schema_field("theme")["field_name"] == "theme"
+        assert profile._schema_field("language") is None
+        assert profile._schema_resource_field("language")["field_name"] == "language"
+        assert profile._multilingual_dataset_fields() == ["title"]
+        assert profile._multilingual_resource_fields() == ["name"]
+
+        assert profile._set_list_dataset_value({}, "theme", ["a"]) == {"theme": ["a"]}
+        assert profile._set_list_resource_value({}, "language", ["en"]) == {"language": ["en"]}
+        assert profile._set_list_resource_value({}, "name", ["en"]) == {"name": '["en"]'}
+
+
+class TestOrganizationCache(object):
+
+    def teardown_method(self):
+        for org_id in ('org-1', 'org-2', 'org-3'):
+            invalidate_organization(org_id)
+
+    @pytest.mark.ckan_config('ckan.group_and_organization_list_all_fields_max', '2')
+    def test_prefetch_organizations(self):
+        orgs = [{'id': 'org-{0}'.format(i), 'name': 'org-name-{0}'.format(i)}
+                for i in (1, 2, 3)]
+
+        def organization_list(context, data_dict):
+            return [org for org in orgs if org['name'] in data_dict['organizations']]
+
+        with mock.patch('ckanext.dcat.profiles.base.get_action') as get_action:
+            get_action.return_value = organization_list
+            prefetch_organizations(orgs + [orgs[0], None])
+
+            assert get_action.call_count == 2
+            assert get_organization('org-1') == orgs[0]
+            assert get_organization('org-3') == orgs[2]
+
+            prefetch_organizations(orgs)
+
+            # Cached organizations are not requested again
+            assert get_action.call_count == 2
+            assert get_action.call_args_list[0] == mock.call('organization_list')
+
+    def test_get_organization_not_prefetched(self):
+        org = {'id': 'org-1', 'name': 'org-name-1'}
+
+        with mock.patch('ckanext.dcat.profiles.base.get_action') as get_action:
+            get_action.return_value = lambda context, data_dict: org
+            assert get_organization('org-1') == org
+            assert get_organization('org-1') == org
+
+        get_action.assert_called_once_with('organization_show')
+
+
 class TestURIRefPreprocessing(object):
 
     def test_with_valid_items(self):
@@ -9,7 +9,8 @@ from ckanext.dcat.processors import (
     RDFSerializer,
     RDFProfileException,
     DEFAULT_RDF_PROFILES,
-    RDF_PROFILES_CONFIG_OPTION
+    RDF_PROFILES_CONFIG_OPTION,
+    get_profile_class,
 )
 
 from ckanext.dcat.profiles import RDFProfile
@@ -63,6 +64,19 @@ class TestRDFSerializer(BaseSerializeTest):
         assert (sorted([pr.name for pr in s._profiles]) ==
             sorted(DEFAULT_RDF_PROFILES))
 
+    def test_profile_classes_are_registered_once(self):
+
+        s1 = RDFSerializer(profiles=['euro_dcat_ap_2'])
+        s2 = RDFSerializer(profiles=['euro_dcat_ap_2'])
+
+        assert s1._profiles[0] is s2._profiles[0]
+        assert s1._profiles[0] is get_profile_class('euro_dcat_ap_2')
+        assert s1._profiles[0].name == 'euro_dcat_ap_2'
+
+    def test_get_profile_class_not_found(self):
+
+        assert get_profile_class('not_found') is None
+
     def test_profiles_via_config_option(self):
 
         original_config = config.copy()
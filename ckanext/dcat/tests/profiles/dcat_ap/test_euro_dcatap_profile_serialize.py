@@ -9,7 +9,8 @@ import pytest
 from ckantoolkit import config
 
 from dateutil.parser import parse as parse_date
-from rdflib import URIRef, BNode, Literal
+from rdflib import Graph, URIRef, BNode, Literal
+from rdflib.compare import isomorphic
 from rdflib.namespace import RDF
 
 from geomet import wkt
@@ -1356,6 +1357,73 @@ class TestEuroDCATAPProfileSerializeCatalog(BaseSerializeTest):
         assert len(items_per_page) == 1
         assert str(items_per_page[0]) == "5"
 
+    @pytest.mark.parametrize("_format,parse_format", [
+        ("nt", "nt"),
+        ("ttl", "turtle"),
+        ("jsonld", "json-ld"),
+    ])
+    def test_catalog_stream(self, _format, parse_format):
+        dataset_dicts = [
+            {
+                'id': str(uuid.uuid4()),
+                'name': 'test-dataset-{}'.format(i),
+                'title': 'Test dataset {}'.format(i),
+                'notes': 'Lorem ipsum',
+                'resources': [
+                    {
+                        'id': str(uuid.uuid4()),
+                        'url': 'http://example.com/data-{}.csv'.format(i),
+                        'format': 'CSV',
+                    }
+                ]
+            }
+            for i in range(3)
+        ]
+        for dataset_dict in dataset_dicts:
+            for resource in dataset_dict['resources']:
+                resource['package_id'] = dataset_dict['id']
+
+        pagination = {
+            'count': 12,
+            'items_per_page': 3,
+            'current': 'http://example.com/catalog.ttl?page=1',
+            'next': 'http://example.com/catalog.ttl?page=2',
+        }
+
+        s = RDFSerializer(profiles=['euro_dcat_ap'])
+        expected = s.serialize_catalog(
+            {}, dataset_dicts, _format=_format, pagination_info=pagination)
+
+        s = RDFSerializer(profiles=['euro_dcat_ap'])
+        chunks = list(s.serialize_catalog_stream(
+            {}, dataset_dicts, _format=_format, pagination_info=pagination))
+
+        # Catalog and one chunk per dataset (plus the brackets in JSON-LD)
+        assert len(chunks) == (6 if _format == 'jsonld' else 4)
+        if _format == 'jsonld':
+            assert isinstance(json.loads(''.join(chunks)), list)
+
+        g_expected = Graph().parse(data=expected, format=parse_format)
+        g_streamed = Graph().parse(data=''.join(chunks), format=parse_format)
+
+        assert len(list(g_streamed.subjects(RDF.type, DCAT.Dataset))) == 3
+        assert isomorphic(g_expected, g_streamed)
+
+    def test_catalog_stream_not_streamable_format(self):
+        dataset = {
+            'id': '4b6fe9ca-dc77-4cec-92a4-55c6624a5bd6',
+            'name': 'test-dataset',
+            'title': 'test dataset',
+        }
+
+        s = RDFSerializer(profiles=['euro_dcat_ap'])
+        chunks = list(s.serialize_catalog_stream({}, [dataset], _format='xml'))
+
+        assert len(chunks) == 1
+
+        g = Graph().parse(data=chunks[0], format='xml')
+        assert len(list(g.subjects(RDF.type, DCAT.Dataset))) == 1
+
     @pytest.mark.ckan_config(DISTRIBUTION_LICENSE_FALLBACK_CONFIG, 'true')
     def test_set_missing_license_for_resource(self):
         ''' Check the behavior if param in config is set: Add license_id to the resource'''
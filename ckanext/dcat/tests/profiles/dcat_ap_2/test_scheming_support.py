@@ -422,6 +422,31 @@ class TestSchemingSerializeSupport(BaseSerializeTest):
         assert len(publisher) == 1
         assert self._triple(g, publisher[0][2], FOAF.name, org["title"])
 
+    def test_publisher_fallback_org_updated(self):
+
+        org = factories.Organization(
+            title="Some publisher org",
+        )
+        dataset = call_action(
+            "package_create",
+            name="test-dataset-2",
+            title="Test DCAT dataset 2",
+            owner_org=org["id"],
+        )
+
+        s = RDFSerializer()
+        s.serialize_catalog({}, dataset_dicts=[dataset], _format="ttl")
+
+        call_action("organization_patch", id=org["id"], title="Updated org")
+
+        s = RDFSerializer()
+        g = s.g
+        dataset_ref = s.graph_from_dataset(dataset)
+        publisher = [t for t in g.triples((dataset_ref, DCT.publisher, None))]
+
+        assert len(publisher) == 1
+        assert self._triple(g, publisher[0][2], FOAF.name, "Updated org")
+
     def test_publisher_fallback_org_ignored_if_publisher_field_present(self):
 
         org = factories.Organization()
@@ -6,7 +6,8 @@ import pytest
 from ckantoolkit import config
 
 from dateutil.parser import parse as parse_date
-from rdflib import URIRef, BNode, Literal
+from rdflib import Graph, URIRef, BNode, Literal
+from rdflib.compare import isomorphic
 from rdflib.namespace import RDF
 
 from ckantoolkit.tests import helpers, factories
@@ -636,3 +637,45 @@ class TestSchemaOrgProfileSerializeDataset(BaseSerializeTest):
 
         assert self._triple(g, distribution, SCHEMA.encodingFormat, resource['format'])
 
+    def test_serialize_dataset_jsonld(self):
+
+        dataset = {
+            'id': '4b6fe9ca-dc77-4cec-92a4-55c6624a5bd6',
+            'name': 'test-dataset',
+            'title': 'Test DCAT dataset',
+            'notes': 'Lorem <b>ipsum</b>',
+            'version': '1.0b',
+            'metadata_created': '2015-06-26T15:21:09.034694',
+            'metadata_modified': '2015-06-26T15:21:09.075774',
+            'tags': [{'name': 'Tag 1'}, {'name': 'Tag 2'}],
+            'extras': [
+                {'key': 'publisher_name', 'value': 'Publisher'},
+                {'key': 'temporal_start', 'value': '2015-06-26'},
+            ],
+            'resources': [
+                {
+                    'id': 'c041c635-054f-4431-b647-f9186926d021',
+                    'name': 'CSV file',
+                    'url': 'http://example.com/data/file.csv',
+                    'format': 'CSV',
+                    'size': 1234,
+                },
+            ]
+        }
+
+        s = RDFSerializer(profiles=['schemaorg'])
+        output = s.serialize_dataset(dataset, _format='jsonld')
+
+        document = json.loads(output)
+        assert document['@context']['schema'] == str(SCHEMA)
+        dataset_node = [
+            node for node in document['@graph']
+            if node['@id'] == utils.dataset_uri(dataset)][0]
+        assert dataset_node['@type'] == 'schema:Dataset'
+        assert dataset_node['schema:description'] == dataset['notes']
+
+        # Same graph as with the rdflib JSON-LD serializer
+        expected = Graph().parse(
+            data=s.g.serialize(format='json-ld', auto_compact=True),
+            format='json-ld')
+        assert isomorphic(Graph().parse(data=output, format='json-ld'), expected)
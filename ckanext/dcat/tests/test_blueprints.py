@@ -4,6 +4,7 @@ from builtins import range
 import time
 
 from collections import OrderedDict
+from unittest import mock
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
 
 import pytest
@@ -12,7 +13,7 @@ from ckan import plugins as p
 
 from rdflib import Graph
 from ckantoolkit import url_for
-from ckantoolkit.tests import factories
+from ckantoolkit.tests import factories, helpers
 
 from ckanext.dcat.processors import RDFParser
 from ckanext.dcat.profiles import RDF, DCAT
@@ -582,6 +583,59 @@ class TestStructuredData():
         assert '<script type="application/ld+json">' in response.body
         assert '"schema:description": "test description"' in response.body
 
+    @pytest.mark.ckan_config('ckan.plugins', 'dcat structured_data')
+    def test_structured_data_cached(self, app):
+
+        dataset = factories.Dataset(
+            notes='test description'
+        )
+
+        url = url_for('dataset.read', id=dataset['name'])
+
+        response = app.get(url)
+        assert '"schema:description": "test description"' in response.body
+
+        with mock.patch('ckanext.dcat.logic.RDFSerializer') as mock_serializer:
+            response = app.get(url)
+
+            assert '"schema:description": "test description"' in response.body
+            assert not mock_serializer.called
+
+        # Updating the dataset changes its metadata_modified value
+        helpers.call_action('package_patch', id=dataset['id'], notes='updated description')
+
+        response = app.get(url)
+        assert '"schema:description": "updated description"' in response.body
+
+    @pytest.mark.ckan_config('ckan.plugins', 'dcat structured_data')
+    @pytest.mark.ckan_config('ckanext.dcat.structured_data.precompute', 'true')
+    @pytest.mark.ckan_config('ckanext.dcat.dataset_cache.backend', 'file')
+    def test_structured_data_precomputed(self, app, ckan_config, monkeypatch, tmp_path):
+
+        monkeypatch.setitem(
+            ckan_config, 'ckanext.dcat.dataset_cache.directory', str(tmp_path))
+
+        dataset = factories.Dataset(
+            notes='test description'
+        )
+
+        url = url_for('dataset.read', id=dataset['name'])
+
+        with mock.patch('ckanext.dcat.logic.RDFSerializer') as mock_serializer:
+            response = app.get(url)
+
+            assert '"schema:description": "test description"' in response.body
+            assert not mock_serializer.called
+
+    @pytest.mark.ckan_config('ckan.plugins', 'dcat structured_data')
+    @pytest.mark.ckan_config('ckanext.dcat.structured_data.precompute', 'true')
+    def test_structured_data_not_precomputed_without_shared_cache(self, app):
+
+        with mock.patch('ckanext.dcat.logic.RDFSerializer') as mock_serializer:
+            factories.Dataset(notes='test description')
+
+            assert not mock_serializer.called
+
     def test_structured_data_not_generated(self, app):
 
         dataset = factories.Dataset(
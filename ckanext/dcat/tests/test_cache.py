@@ -0,0 +1,256 @@
+from unittest import mock
+
+import pytest
+
+from ckantoolkit.tests import factories, helpers
+
+from ckanext.dcat.cache import (
+    DatasetCache,
+    MemoryDatasetCache,
+    FileDatasetCache,
+    TTLCache,
+    get_dataset_cache,
+    get_shared_dataset_cache,
+    get_structured_data_cache,
+    DATASET_CACHE_BACKEND_CONFIG,
+    DATASET_CACHE_DIRECTORY_CONFIG,
+    STRUCTURED_DATA_CACHE_SIZE_CONFIG,
+)
+
+
+class TestMemoryDatasetCache(object):
+
+    def test_get_set(self):
+        cache = MemoryDatasetCache()
+
+        assert cache.get('id1', '2024-01-01T00:00:00', ['schemaorg'], 'ttl') is None
+
+        cache.set('id1', '2024-01-01T00:00:00', ['schemaorg'], 'ttl', 'output')
+
+        assert cache.get('id1', '2024-01-01T00:00:00', ['schemaorg'], 'ttl') == 'output'
+        assert cache.get('id1', '2024-01-01T00:00:00', ['schemaorg'], 'xml') is None
+        assert cache.get('id1', '2024-01-01T00:00:00', None, 'ttl') is None
+        assert cache.get('id1', '2024-02-01T00:00:00', ['schemaorg'], 'ttl') is None
+
+    def test_new_version_drops_previous_entries(self):
+        cache = MemoryDatasetCache()
+
+        cache.set('id1', '2024-01-01T00:00:00', None, 'ttl', 'output_ttl')
+        cache.set('id1', '2024-01-01T00:00:00', None, 'xml', 'output_xml')
+        cache.set('id1', '2024-02-01T00:00:00', None, 'ttl', 'output_ttl_2')
+
+        assert cache._datasets['id1'] == {'2024-02-01T00:00:00||ttl': 'output_ttl_2'}
+
+    def test_lru_eviction(self):
+        cache = MemoryDatasetCache(size=2)
+
+        cache.set('id1', 'm', None, 'ttl', 'output1')
+        cache.set('id2', 'm', None, 'ttl', 'output2')
+        # Access id1 so id2 becomes the least recently used
+        cache.get('id1', 'm', None, 'ttl')
+        cache.set('id3', 'm', None, 'ttl', 'output3')
+
+        assert cache.get('id1', 'm', None, 'ttl') == 'output1'
+        assert cache.get('id2', 'm', None, 'ttl') is None
+        assert cache.get('id3', 'm', None, 'ttl') == 'output3'
+
+    def test_invalidate(self):
+        cache = MemoryDatasetCache()
+
+        cache.set('id1', 'm', None, 'ttl', 'output1')
+        cache.set('id2', 'm', None, 'ttl', 'output2')
+
+        cache.invalidate('id1')
+
+        assert cache.get('id1', 'm', None, 'ttl') is None
+        assert cache.get('id2', 'm', None, 'ttl') == 'output2'
+
+    def test_invalidate_datasets(self):
+        cache = MemoryDatasetCache()
+
+        for dataset_id in ('id1', 'id2', 'id3'):
+            cache.set(dataset_id, 'm', None, 'ttl', 'output')
+
+        cache.invalidate_datasets(['id1', 'id3'])
+
+        assert cache.get('id1', 'm', None, 'ttl') is None
+        assert cache.get('id2', 'm', None, 'ttl') == 'output'
+        assert cache.get('id3', 'm', None, 'ttl') is None
+
+    def test_base_class_is_abstract(self):
+        with pytest.raises(TypeError):
+            DatasetCache()
+
+
+class TestFileDatasetCache(object):
+
+    def test_get_set_invalidate(self, tmp_path):
+        cache = FileDatasetCache(str(tmp_path))
+
+        assert cache.get('id1', 'm', ['euro_dcat_ap_3'], 'ttl') is None
+
+        cache.set('id1', 'm', ['euro_dcat_ap_3'], 'ttl', 'output Ü')
+        cache.set('id2', 'm', ['euro_dcat_ap_3'], 'ttl', 'output2')
+
+        assert cache.get('id1', 'm', ['euro_dcat_ap_3'], 'ttl') == 'output Ü'
+        assert cache.get('id1', 'm', ['euro_dcat_ap_3'], 'xml') is None
+
+        cache.invalidate('id1')
+
+        assert cache.get('id1', 'm', ['euro_dcat_ap_3'], 'ttl') is None
+        assert cache.get('id2', 'm', ['euro_dcat_ap_3'], 'ttl') == 'output2'
+
+    def test_invalidate_organization(self, tmp_path):
+        cache = FileDatasetCache(str(tmp_path))
+
+        cache.set('id1', 'm', None, 'ttl', 'output1', org_id='org1')
+        cache.set('id2', 'm', None, 'ttl', 'output2', org_id='org2')
+        cache.set('id3', 'm', None, 'ttl', 'output3')
+
+        assert cache.get('id1', 'm', None, 'ttl') is None
+        assert cache.get('id1', 'm', None, 'ttl', org_id='org1') == 'output1'
+
+        cache.invalidate_organization('org1', [])
+
+        assert cache.get('id1', 'm', None, 'ttl', org_id='org1') is None
+        assert cache.get('id2', 'm', None, 'ttl', org_id='org2') == 'output2'
+        assert cache.get('id3', 'm', None, 'ttl') == 'output3'
+
+        # The dataset folder is found even if it moved to another organization
+        cache.invalidate('id2')
+
+        assert cache.get('id2', 'm', None, 'ttl', org_id='org2') is None
+
+    def test_clear_only_removes_its_entries(self, tmp_path):
+        other_file = tmp_path / 'other.txt'
+        other_file.write_text('other')
+        cache = FileDatasetCache(str(tmp_path))
+
+        cache.set('id1', 'm', None, 'ttl', 'output1', org_id='org1')
+        cache.clear()
+
+        assert cache.get('id1', 'm', None, 'ttl', org_id='org1') is None
+        assert other_file.read_text() == 'other'
+        assert [path.name for path in tmp_path.iterdir()] == ['other.txt']
+
+
+class TestTTLCache(object):
+
+    def test_get_set(self):
+        cache = TTLCache()
+
+        assert cache.get('a') is None
+        assert cache.get('a', 'default') == 'default'
+        assert 'a' not in cache
+
+        cache.set('a', None)
+        assert 'a' in cache
+        assert cache.get('a', 'default') is None
+
+    def test_expired(self):
+        cache = TTLCache(ttl=-1)
+
+        cache.set('a', 1)
+        assert 'a' not in cache
+
+    def test_lru_eviction(self):
+        cache = TTLCache(size=2)
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        assert cache.get('a') == 1
+        assert 'b' not in cache
+        assert cache.get('c') == 3
+
+    def test_invalidate(self):
+        cache = TTLCache()
+
+        cache.set('a', 1)
+        cache.invalidate('a')
+
+        assert 'a' not in cache
+
+
+@pytest.mark.ckan_config(DATASET_CACHE_BACKEND_CONFIG, 'memory')
+def test_get_dataset_cache_memory():
+    cache = get_dataset_cache()
+
+    assert isinstance(cache, MemoryDatasetCache)
+    assert get_dataset_cache() is cache
+
+
+def test_get_dataset_cache_disabled():
+    assert get_dataset_cache() is None
+
+
+@pytest.mark.ckan_config(DATASET_CACHE_BACKEND_CONFIG, 'unknown')
+def test_get_dataset_cache_unknown_backend():
+    with pytest.raises(ValueError):
+        get_dataset_cache()
+
+
+@pytest.mark.ckan_config(DATASET_CACHE_BACKEND_CONFIG, 'memory')
+def test_get_shared_dataset_cache_memory():
+    assert get_shared_dataset_cache() is None
+
+
+@pytest.mark.ckan_config(DATASET_CACHE_BACKEND_CONFIG, 'file')
+def test_get_shared_dataset_cache_file(ckan_config, monkeypatch, tmp_path):
+    monkeypatch.setitem(ckan_config, DATASET_CACHE_DIRECTORY_CONFIG, str(tmp_path))
+
+    assert get_shared_dataset_cache() is get_dataset_cache()
+
+
+def test_get_structured_data_cache_memory():
+    cache = get_structured_data_cache()
+
+    assert isinstance(cache, MemoryDatasetCache)
+    assert get_structured_data_cache() is cache
+
+
+@pytest.mark.ckan_config(DATASET_CACHE_BACKEND_CONFIG, 'memory')
+def test_get_structured_data_cache_uses_dataset_cache():
+    assert get_structured_data_cache() is get_dataset_cache()
+
+
+@pytest.mark.ckan_config(STRUCTURED_DATA_CACHE_SIZE_CONFIG, '0')
+def test_get_structured_data_cache_disabled():
+    assert get_structured_data_cache() is None
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+@pytest.mark.ckan_config('ckan.plugins', 'dcat')
+@pytest.mark.ckan_config(DATASET_CACHE_BACKEND_CONFIG, 'memory')
+def test_organization_update_invalidates_its_datasets():
+    org = factories.Organization()
+    dataset = factories.Dataset(owner_org=org['id'])
+    other_dataset = factories.Dataset()
+
+    cache = get_dataset_cache()
+    cache.set(dataset['id'], 'm', None, 'ttl', 'output')
+    cache.set(other_dataset['id'], 'm', None, 'ttl', 'output')
+
+    # The organization details are part of the serializations, but updating
+    # it does not change the dataset metadata_modified
+    helpers.call_action('organization_patch', id=org['id'], title='New title')
+
+    assert cache.get(dataset['id'], 'm', None, 'ttl') is None
+    assert cache.get(other_dataset['id'], 'm', None, 'ttl') == 'output'
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+@pytest.mark.ckan_config('ckan.plugins', 'dcat')
+@pytest.mark.ckan_config(DATASET_CACHE_BACKEND_CONFIG, 'memory')
+def test_dataset_endpoint_uses_the_stored_serialization():
+    dataset = factories.Dataset()
+
+    output = helpers.call_action('dcat_dataset_show', id=dataset['name'], format='ttl')
+
+    # Stored and read with the same key
+    with mock.patch('ckanext.dcat.logic.RDFSerializer') as mock_serializer:
+        assert helpers.call_action(
+            'dcat_dataset_show', id=dataset['id'], format='ttl') == output
+        assert not mock_serializer.called
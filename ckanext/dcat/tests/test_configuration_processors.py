@@ -1,4 +1,7 @@
+from unittest import mock
+
 from ckantoolkit.tests import factories
+from ckan.logic import get_action
 
 from ckanext.dcat.configuration_processors import (
     ParseID,
@@ -7,12 +10,15 @@ from ckanext.dcat.configuration_processors import (
     MappingFields, CompositeMapping,
     Publisher, ContactPoint,
     RemoteGroups,
+    GroupIndex,
     OrganizationFilter,
     FormatFilter,
     TagFilter,
     ResourceFormatOrder,
     KeepExistingResources,
-    UploadToDatastore
+    UploadToDatastore,
+    DatasetFilter,
+    ConfigProcessorPipeline,
 )
 
 
@@ -880,6 +886,44 @@ class TestRemoteGroups:
         group_names = sorted([group_dict.get("name") for group_dict in package["groups"]])
         assert group_names == ["climate", "science"]
 
+    def test_modify_package_remote_groups_compiled(self):
+        factories.Group(name="climate", title="Climate")
+        config = {
+            "remote_groups": "create"
+        }
+        dcat_dict = {
+            "theme": ["CLIMATE", "water"]
+        }
+
+        modify_package_dict = self.processor.compile(config)
+
+        with mock.patch("ckanext.dcat.configuration_processors.get_action",
+                        wraps=get_action) as mock_get_action:
+            for name in ["test-dataset-1", "test-dataset-2"]:
+                package = {"name": name}
+                modify_package_dict(package, dcat_dict)
+
+                group_names = [group_dict.get("name") for group_dict in package["groups"]]
+                assert group_names == ["climate", "water"]
+
+        # Groups are only listed and created once
+        actions = [call.args[0] for call in mock_get_action.call_args_list]
+        assert actions.count("group_list") == 1
+        assert actions.count("group_create") == 1
+
+    def test_group_index(self):
+        group = factories.Group(name="climate", title="Climate Change")
+        group_index = GroupIndex()
+
+        assert group_index.get("climate")["id"] == group["id"]
+        assert group_index.get("Climate change")["id"] == group["id"]
+        assert group_index.get("water") is None
+
+        new_group = group_index.create("water")
+
+        assert new_group["name"] == "water"
+        assert group_index.get("Water") == new_group
+
 
 class TestOrganizationFilter:
 
@@ -1024,6 +1068,107 @@ class TestTagFilter:
             assert True
 
 
+class TestDatasetFilter:
+
+    dcat_dict = {
+        "identifier": "http://example.com/dataset/1",
+        "title": "Test Dataset",
+        "publisher": {"name": "Test Org"},
+        "keyword": ["Climate", "Water"],
+        "distribution": [
+            {"format": "CSV"},
+            {"format": "JSON"},
+            {"title": "No format"}
+        ]
+    }
+
+    package_dict = {
+        "name": "test-dataset",
+        "title": "Test Dataset",
+        "tags": [{"name": "Climate"}, {"name": "Water"}],
+        "resources": [
+            {"format": "CSV"},
+            {"format": "JSON"},
+            {"format": ""}
+        ],
+        "extras": [
+            {"key": "publisher_name", "value": "Test Org"}
+        ]
+    }
+
+    def _matches(self, config):
+        dataset_filter = DatasetFilter(config)
+        return (dataset_filter.matches(self.dcat_dict),
+                dataset_filter.matches_package_dict(self.package_dict))
+
+    def test_no_filters(self):
+        dataset_filter = DatasetFilter({})
+
+        assert not dataset_filter.active
+        assert dataset_filter.matches(self.dcat_dict)
+        assert dataset_filter.matches_package_dict(self.package_dict)
+
+    def test_organizations_filter(self):
+        assert self._matches(
+            {"organizations_filter_include": ["Test Org"]}) == (True, True)
+        assert self._matches(
+            {"organizations_filter_include": ["Other Org"]}) == (False, False)
+        assert self._matches(
+            {"organizations_filter_exclude": ["Test Org"]}) == (False, False)
+        assert self._matches(
+            {"organizations_filter_exclude": ["Other Org"]}) == (True, True)
+
+    def test_format_filter(self):
+        assert self._matches(
+            {"format_filter_include": ["csv", "XML"]}) == (True, True)
+        assert self._matches(
+            {"format_filter_include": ["xml"]}) == (False, False)
+        assert self._matches(
+            {"format_filter_exclude": ["Json"]}) == (False, False)
+        assert self._matches(
+            {"format_filter_exclude": ["xml"]}) == (True, True)
+
+    def test_tag_filter(self):
+        assert self._matches(
+            {"tag_filter_include": ["Water", "Energy"]}) == (True, True)
+        assert self._matches(
+            {"tag_filter_include": ["Energy"]}) == (False, False)
+        assert self._matches(
+            {"tag_filter_exclude": ["Climate"]}) == (False, False)
+        assert self._matches(
+            {"tag_filter_exclude": ["climate"]}) == (True, True)
+
+    def test_tag_filter_single_keyword(self):
+        dataset_filter = DatasetFilter({"tag_filter_include": ["Water"]})
+
+        assert dataset_filter.matches({"keyword": "Water"})
+        assert not dataset_filter.matches({"keyword": "Waterways"})
+        assert not dataset_filter.matches({"keyword": None})
+
+    def test_all_filters(self):
+        config = {
+            "organizations_filter_include": ["Test Org"],
+            "format_filter_exclude": ["xml"],
+            "tag_filter_include": ["Water"]
+        }
+        assert self._matches(config) == (True, True)
+
+        config["tag_filter_exclude"] = ["Climate"]
+        assert self._matches(config) == (False, False)
+
+    def test_publisher_variants(self):
+        dataset_filter = DatasetFilter(
+            {"organizations_filter_include": ["Test Org"]})
+
+        assert dataset_filter.matches({"publisher": "Test Org"})
+        assert dataset_filter.matches({"publisher": {"source": "Test Org"}})
+        assert not dataset_filter.matches({})
+
+        assert dataset_filter.matches_package_dict(
+            {"publisher": [{"name": "Test Org"}]})
+        assert not dataset_filter.matches_package_dict({"extras": []})
+
+
 class TestResourceFormatOrder:
 
     processor = ResourceFormatOrder
@@ -1127,3 +1272,73 @@ class UploadToDatastore:
             assert False
         except ValueError:
             assert True
+
+
+class TestConfigProcessorPipeline:
+
+    processors = [
+        DefaultTags, CleanTags, DefaultExtras, DefaultValues,
+        RemoteGroups, TagFilter, ResourceFormatOrder, KeepExistingResources
+    ]
+
+    def test_unused_processors_are_left_out(self):
+        config = {
+            "default_tags": [{"name": "geo"}],
+            "clean_tags": False,
+            "tag_filter_include": ["Climate"],
+            "resource_format_order": ["csv"],
+            "keep_existing_resources": True
+        }
+
+        pipeline = ConfigProcessorPipeline(self.processors, config)
+
+        assert pipeline.processors == [DefaultTags, ResourceFormatOrder]
+
+    def test_empty_config(self):
+        pipeline = ConfigProcessorPipeline(self.processors, {})
+
+        assert pipeline.processors == []
+
+        package = {"name": "test-dataset"}
+        pipeline.modify_package_dict(package, {})
+
+        assert package == {"name": "test-dataset", "extras": []}
+
+    def test_modify_package_dict(self):
+        config = {
+            "default_tags": [{"name": "geo"}],
+            "default_extras": {"encoding": "utf8"},
+            "resource_format_order": [" ZIP", "csv "]
+        }
+        package = {
+            "name": "test-dataset",
+            "tags": [{"name": "Climate"}],
+            "resources": [
+                {"format": "HTML"},
+                {"format": "CSV"},
+                {"format": "zip"}
+            ]
+        }
+
+        pipeline = ConfigProcessorPipeline(self.processors, config)
+        pipeline.modify_package_dict(package, {})
+
+        assert package["tags"] == [{"name": "Climate"}, {"name": "geo"}]
+        assert package["extras"] == [{"key": "encoding", "value": "utf8"}]
+        assert [r["format"] for r in package["resources"]] == ["zip", "CSV", "HTML"]
+
+    def test_processors_without_config_keys_are_always_used(self):
+
+        class CustomProcessor(DefaultTags):
+
+            config_keys = None
+
+            @staticmethod
+            def modify_package_dict(package_dict, config, dcat_dict):
+                package_dict["custom"] = True
+
+        pipeline = ConfigProcessorPipeline([CustomProcessor], {})
+        package = {}
+        pipeline.modify_package_dict(package, {})
+
+        assert package["custom"]
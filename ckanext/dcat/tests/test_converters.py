@@ -34,6 +34,22 @@ def test_ckan_to_dcat():
     assert dcat_dict == expected_dcat_dict,_poor_mans_dict_diff(
         expected_dcat_dict, dcat_dict)
 
+def test_ckan_to_dcat_duplicate_extras():
+    ckan_dict = {
+        'extras': [
+            {'key': 'dcat_publisher_name', 'value': 'Publisher 1'},
+            {'key': 'guid', 'value': 'id-1'},
+            {'key': 'dcat_publisher_name', 'value': 'Publisher 2'},
+            {'key': 'guid', 'value': 'id-2'},
+        ]
+    }
+
+    dcat_dict = converters.ckan_to_dcat(ckan_dict)
+
+    # The last extra with a key wins
+    assert dcat_dict['publisher']['name'] == 'Publisher 2'
+    assert dcat_dict['identifier'] == 'id-2'
+
 def test_dcat_to_ckan():
     dcat_dict =_get_file_as_dict('ckan/dataset.json')
     expected_ckan_dict =_get_file_as_dict('ckan/ckan_dataset.json')
@@ -0,0 +1,70 @@
+from ckanext.dcat.extras import (
+    ExtrasIndex,
+    get_extras_index,
+    get_extra_value,
+)
+
+
+class TestExtrasIndex(object):
+
+    def test_get(self):
+        dataset_dict = {
+            'extras': [
+                {'key': 'a', 'value': '1'},
+                {'key': 'b', 'value': '2'},
+                {'key': 'a', 'value': '3'},
+            ]
+        }
+        index = ExtrasIndex(dataset_dict)
+
+        assert index.get('a') == '1'
+        assert index.get('b') == '2'
+        assert index.get('c') is None
+        assert index.get('c', 'default') == 'default'
+        assert 'b' in index
+        assert 'c' not in index
+
+    def test_get_extra_first_in_list(self):
+        dataset_dict = {
+            'extras': [
+                {'key': 'dcat_a', 'value': '1'},
+                {'key': 'a', 'value': '2'},
+            ]
+        }
+        index = ExtrasIndex(dataset_dict)
+
+        assert index.get_extra('a', 'dcat_a') == {'key': 'dcat_a', 'value': '1'}
+        assert index.get_extra('c', 'dcat_c') is None
+
+    def test_no_extras(self):
+        assert ExtrasIndex({}).get('a') is None
+        assert ExtrasIndex({'extras': None}).get('a') is None
+
+    def test_value_changes_are_reflected(self):
+        dataset_dict = {'extras': [{'key': 'a', 'value': '1'}]}
+        index = ExtrasIndex(dataset_dict)
+
+        dataset_dict['extras'][0]['value'] = '2'
+        assert index.get('a') == '2'
+
+        # Extras added later are not indexed
+        dataset_dict['extras'].append({'key': 'b', 'value': '3'})
+        assert index.get('b') is None
+
+
+class TestGetExtrasIndex(object):
+
+    def test_new_index_on_each_call(self):
+        dataset_dict = {'extras': [{'key': 'a', 'value': '1'}]}
+        index = get_extras_index(dataset_dict)
+
+        dataset_dict['extras'] = [{'key': 'b', 'value': '2'}]
+
+        assert get_extras_index(dataset_dict) is not index
+        assert get_extras_index(dataset_dict).get('b') == '2'
+
+    def test_get_extra_value(self):
+        dataset_dict = {'extras': [{'key': 'a', 'value': '1'}]}
+
+        assert get_extra_value(dataset_dict, 'a') == '1'
+        assert get_extra_value(dataset_dict, 'b', 'default') == 'default'
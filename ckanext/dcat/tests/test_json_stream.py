@@ -0,0 +1,114 @@
+import io
+import json
+import tracemalloc
+
+import pytest
+
+from ckanext.dcat.json_stream import iter_datasets
+
+
+def _datasets(content, chunk_size=1024):
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return list(iter_datasets(io.BytesIO(content), chunk_size=chunk_size))
+
+
+def _catalog(num_datasets):
+    return {
+        '@context': 'https://project-open-data.cio.gov/v1.1/schema/catalog.jsonld',
+        '@type': 'dcat:Catalog',
+        'conformsTo': 'https://project-open-data.cio.gov/v1.1/schema',
+        'dataset': [
+            {
+                '@type': 'dcat:Dataset',
+                'identifier': 'https://example.com/datasets/{0}'.format(i),
+                'title': 'Dataset "{0}" ñ'.format(i),
+                'keyword': ['a', 'b'],
+                'accrualPeriodicity': 'R/P1Y',
+                'distribution': [{'downloadURL': 'https://example.com/{0}.csv'.format(i)}],
+            }
+            for i in range(num_datasets)
+        ],
+    }
+
+
+class TestIterDatasets(object):
+
+    @pytest.mark.parametrize('chunk_size', [1, 7, 64, 1024 * 1024])
+    def test_catalog(self, chunk_size):
+        catalog = _catalog(20)
+        content = json.dumps(catalog, indent=2, ensure_ascii=False)
+
+        datasets = _datasets(content, chunk_size)
+
+        assert [dataset for dataset, _ in datasets] == catalog['dataset']
+        for dataset, as_string in datasets:
+            # Source text of each dataset
+            assert as_string in content
+            assert json.loads(as_string) == dataset
+
+    def test_list_of_datasets(self):
+        catalog = _catalog(3)
+        content = json.dumps(catalog['dataset'])
+
+        datasets = _datasets(content, chunk_size=10)
+
+        assert [dataset for dataset, _ in datasets] == catalog['dataset']
+
+    def test_text_stream(self):
+        content = json.dumps(_catalog(3), ensure_ascii=False)
+
+        datasets = list(iter_datasets(io.StringIO(content), chunk_size=10))
+
+        assert len(datasets) == 3
+
+    def test_byte_order_mark(self):
+        content = b'\xef\xbb\xbf' + json.dumps(_catalog(1)).encode('utf-8')
+
+        assert len(_datasets(content)) == 1
+
+    @pytest.mark.parametrize('content', [
+        '{}',
+        '[]',
+        '{"dataset": []}',
+        ' { "other": [1, 2], "dataset" : [ ] } ',
+    ])
+    def test_no_datasets(self, content):
+        assert _datasets(content, chunk_size=1) == []
+
+    @pytest.mark.parametrize('content', [
+        '',
+        '"dataset"',
+        '{"dataset": {}}',
+        '{"dataset": [{"title": "a"},]}',
+        '{"dataset": [{"title": "a"}] "other": 1}',
+        '{"dataset": [{"title": "a"}',
+        '[{"title": "a"}] []',
+        '{"dataset": [{"title": }]}',
+    ])
+    def test_wrong_document(self, content):
+        for chunk_size in (1, 1024):
+            with pytest.raises(ValueError):
+                _datasets(content, chunk_size)
+
+    def test_memory_benchmark(self):
+        content = json.dumps(_catalog(5000)).encode('utf-8')
+
+        tracemalloc.start()
+        doc = json.loads(content)
+        strings = [json.dumps(dataset) for dataset in doc['dataset']]
+        loads_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del doc, strings
+
+        tracemalloc.start()
+        count = 0
+        for dataset, as_string in iter_datasets(io.BytesIO(content),
+                                                chunk_size=64 * 1024):
+            count += 1
+        stream_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        assert count == 5000
+        # Only one chunk and one dataset are kept at a time
+        assert stream_peak * 10 < loads_peak
@@ -0,0 +1,129 @@
+import json
+
+from rdflib import Graph, URIRef, BNode, Literal, Namespace
+from rdflib.compare import isomorphic
+from rdflib.namespace import RDF, XSD
+
+from ckanext.dcat.jsonld import graph_to_jsonld, dumps
+
+SCHEMA = Namespace('http://schema.org/')
+
+
+def _graph():
+    g = Graph()
+    g.bind('schema', SCHEMA, replace=True)
+    return g
+
+
+class TestGraphToJSONLD(object):
+
+    def test_single_node(self):
+        g = _graph()
+        dataset = URIRef('https://example.org/dataset/1')
+        g.add((dataset, RDF.type, SCHEMA.Dataset))
+        g.add((dataset, SCHEMA.name, Literal('Test dataset')))
+
+        assert graph_to_jsonld(g) == {
+            '@context': {'schema': 'http://schema.org/'},
+            '@id': 'https://example.org/dataset/1',
+            '@type': 'schema:Dataset',
+            'schema:name': 'Test dataset',
+        }
+
+    def test_several_nodes(self):
+        g = _graph()
+        dataset = URIRef('https://example.org/dataset/1')
+        publisher = BNode('publisher')
+        g.add((dataset, RDF.type, SCHEMA.Dataset))
+        g.add((dataset, SCHEMA.publisher, publisher))
+        g.add((publisher, RDF.type, SCHEMA.Organization))
+
+        document = graph_to_jsonld(g)
+
+        assert document['@graph'] == [
+            {
+                '@id': '_:publisher',
+                '@type': 'schema:Organization',
+            },
+            {
+                '@id': 'https://example.org/dataset/1',
+                '@type': 'schema:Dataset',
+                'schema:publisher': {'@id': '_:publisher'},
+            },
+        ]
+
+    def test_values(self):
+        g = _graph()
+        dataset = URIRef('https://example.org/dataset/1')
+        g.add((dataset, SCHEMA.name, Literal('Test', lang='en')))
+        g.add((dataset, SCHEMA.name, Literal('Prueba', lang='es')))
+        g.add((dataset, SCHEMA.dateModified,
+               Literal('2024-01-01', datatype=XSD.date)))
+        g.add((dataset, SCHEMA.size, Literal('12', datatype=XSD.integer)))
+        g.add((dataset, SCHEMA.isAccessibleForFree,
+               Literal('true', datatype=XSD.boolean)))
+        g.add((dataset, URIRef('http://example.org/ns/custom#value'),
+               Literal('x')))
+
+        document = graph_to_jsonld(g)
+
+        assert document['@context'] == {
+            'schema': 'http://schema.org/',
+            'xsd': 'http://www.w3.org/2001/XMLSchema#',
+        }
+        assert document['schema:name'] == [
+            {'@value': 'Test', '@language': 'en'},
+            {'@value': 'Prueba', '@language': 'es'},
+        ]
+        assert document['schema:dateModified'] == {
+            '@value': '2024-01-01', '@type': 'xsd:date'}
+        assert document['schema:size'] == 12
+        assert document['schema:isAccessibleForFree'] is True
+        assert document['http://example.org/ns/custom#value'] == 'x'
+
+    def test_values_sorted(self):
+        g = _graph()
+        dataset = URIRef('https://example.org/dataset/1')
+        for keyword in ('c', 'a', 'd', 'b'):
+            g.add((dataset, SCHEMA.keywords, Literal(keyword)))
+        g.add((dataset, RDF.type, SCHEMA.Thing))
+        g.add((dataset, RDF.type, SCHEMA.Dataset))
+
+        document = graph_to_jsonld(g)
+
+        assert document['schema:keywords'] == ['a', 'b', 'c', 'd']
+        assert document['@type'] == ['schema:Dataset', 'schema:Thing']
+
+    def test_same_graph_as_rdflib(self):
+        g = _graph()
+        dataset = URIRef('https://example.org/dataset/1')
+        distribution = BNode()
+        g.add((dataset, RDF.type, SCHEMA.Dataset))
+        g.add((dataset, SCHEMA.name, Literal('Test <b>dataset</b>')))
+        g.add((dataset, SCHEMA.keywords, Literal('Tag 1')))
+        g.add((dataset, SCHEMA.keywords, Literal('Tag 2')))
+        g.add((dataset, SCHEMA.distribution, distribution))
+        g.add((distribution, RDF.type, SCHEMA.DataDownload))
+        g.add((distribution, SCHEMA.contentSize,
+               Literal('1.5', datatype=XSD.decimal)))
+        g.add((distribution, SCHEMA.url,
+               URIRef('http://example.org/data/file.csv')))
+
+        output = dumps(graph_to_jsonld(g))
+
+        expected = Graph().parse(
+            data=g.serialize(format='json-ld', auto_compact=True),
+            format='json-ld')
+        assert isomorphic(Graph().parse(data=output, format='json-ld'), expected)
+
+    def test_dumps(self):
+        document = {'@id': 'https://example.org/dataset/1', 'schema:name': 'Ñandú'}
+
+        output = dumps(document)
+
+        assert json.loads(output) == document
+        assert output == (
+            '{\n'
+            '  "@id": "https://example.org/dataset/1",\n'
+            '  "schema:name": "Ñandú"\n'
+            '}')
@@ -0,0 +1,129 @@
+import io
+import multiprocessing
+from unittest import mock
+
+from rdflib import Graph, URIRef
+from rdflib.compare import isomorphic
+from rdflib.namespace import RDF
+
+from ckanext.dcat import partitioning
+from ckanext.dcat.partitioning import PartitionedTripleStore, DCAT
+from ckanext.dcat.tests.utils import get_file_contents
+
+
+def _load(data):
+    store = PartitionedTripleStore()
+    store.load(io.BytesIO(data.encode('utf-8')))
+    return store
+
+
+# Store inherited by forked processes
+_worker_store = None
+
+
+def _count_in_worker(dataset):
+    _worker_store.reopen()
+    return len(_worker_store.dataset_graph(dataset, Graph()))
+
+
+class TestPartitionedTripleStore(object):
+
+    def test_dataset_graphs(self):
+        graph = Graph().parse(
+            data=get_file_contents('dcat/catalog.rdf'), format='xml')
+
+        store = _load(graph.serialize(format='nt'))
+        try:
+            assert len(store) == len(graph)
+
+            datasets = list(store.datasets())
+            assert sorted(datasets) == [
+                URIRef('https://data.some.org/catalog/datasets/1'),
+                URIRef('https://data.some.org/catalog/datasets/2'),
+            ]
+
+            union = Graph()
+            for dataset in datasets:
+                dataset_graph = store.dataset_graph(dataset, Graph())
+
+                # Only the dataset itself, but catalog details are shared
+                assert list(dataset_graph.subjects(RDF.type, DCAT.Dataset)) == [dataset]
+                assert len(list(dataset_graph.subjects(RDF.type, DCAT.Catalog))) == 1
+
+                for triple in dataset_graph:
+                    union.add(triple)
+
+            assert isomorphic(union, graph)
+        finally:
+            store.close()
+
+    def test_nquads(self):
+        data = '''
+<http://example.org/1> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Dataset> <http://example.org/graph> .
+<http://example.org/1> <http://purl.org/dc/terms/title> "Dataset 1"@en <http://example.org/graph> .
+<http://example.org/1> <http://www.w3.org/ns/dcat#distribution> _:d1 .
+_:d1 <http://purl.org/dc/terms/title> "Distribution 1" _:g .
+'''
+        store = _load(data)
+        try:
+            dataset_graph = store.dataset_graph(URIRef('http://example.org/1'), Graph())
+
+            assert len(dataset_graph) == 4
+        finally:
+            store.close()
+
+    def test_fallback_without_parser_internals(self):
+        graph = Graph().parse(
+            data=get_file_contents('dcat/catalog.rdf'), format='xml')
+
+        with mock.patch.object(partitioning, 'INSERT_BATCH_SIZE', 5), \
+                mock.patch.object(partitioning._LineParser, 'supported',
+                                  return_value=False):
+            store = _load(graph.serialize(format='nt'))
+        try:
+            assert len(store) == len(graph)
+
+            union = Graph()
+            for dataset in store.datasets():
+                for triple in store.dataset_graph(dataset, Graph()):
+                    union.add(triple)
+
+            # Blank nodes are the same across batches
+            assert isomorphic(union, graph)
+        finally:
+            store.close()
+
+    def test_other_datasets_are_not_followed(self):
+        data = '''
+<http://example.org/1> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Dataset> .
+<http://example.org/1> <http://purl.org/dc/terms/relation> <http://example.org/2> .
+<http://example.org/2> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Dataset> .
+<http://example.org/2> <http://purl.org/dc/terms/title> "Dataset 2" .
+'''
+        store = _load(data)
+        try:
+            dataset_graph = store.dataset_graph(URIRef('http://example.org/1'), Graph())
+
+            assert len(dataset_graph) == 2
+        finally:
+            store.close()
+
+    def test_reopen_in_forked_process(self):
+        graph = Graph().parse(
+            data=get_file_contents('dcat/catalog.rdf'), format='xml')
+
+        store = _load(graph.serialize(format='nt'))
+        try:
+            dataset = sorted(store.datasets())[0]
+            expected = len(store.dataset_graph(dataset, Graph()))
+
+            global _worker_store
+            _worker_store = store
+            context = multiprocessing.get_context('fork')
+            with context.Pool(processes=1) as pool:
+                assert pool.apply(_count_in_worker, (dataset,)) == expected
+
+            # The parent connection can still be used
+            assert len(store.dataset_graph(dataset, Graph())) == expected
+        finally:
+            store.close()
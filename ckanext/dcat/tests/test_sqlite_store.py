@@ -0,0 +1,63 @@
+import os
+
+from rdflib import Graph, URIRef, Literal
+from rdflib.compare import isomorphic
+from rdflib.namespace import Namespace, RDF
+
+from ckanext.dcat.sqlite_store import SQLiteStore
+from ckanext.dcat.tests.utils import get_file_contents
+
+DCT = Namespace("http://purl.org/dc/terms/")
+DCAT = Namespace("http://www.w3.org/ns/dcat#")
+
+
+class TestSQLiteStore(object):
+
+    def test_parse(self):
+        data = get_file_contents('dcat/catalog.rdf')
+
+        expected = Graph().parse(data=data, format='xml')
+        g = Graph(store=SQLiteStore())
+        try:
+            g.parse(data=data, format='xml')
+
+            assert len(g) == len(expected)
+            assert isomorphic(g, expected)
+            assert g.namespace_manager.store.namespace('dcat') == URIRef(DCAT)
+        finally:
+            g.close()
+
+    def test_triples(self):
+        g = Graph(store=SQLiteStore())
+        try:
+            dataset = URIRef('http://example.org/datasets/1')
+            g.add((dataset, RDF.type, DCAT.Dataset))
+            g.add((dataset, DCT.title, Literal('Dataset 1', lang='en')))
+            g.add((dataset, DCT.title, Literal('Conjunto 1', lang='es')))
+            g.add((dataset, DCT.title, Literal('Dataset 1', lang='en')))
+
+            assert len(g) == 3
+            assert list(g.subjects(RDF.type, DCAT.Dataset)) == [dataset]
+            assert list(g.objects(dataset, DCT.title)) == [
+                Literal('Dataset 1', lang='en'),
+                Literal('Conjunto 1', lang='es'),
+            ]
+            assert (dataset, DCT.title, Literal('Conjunto 1', lang='es')) in g
+            assert (dataset, DCT.title, Literal('Conjunto 1')) not in g
+
+            g.remove((dataset, DCT.title, None))
+
+            assert len(g) == 1
+        finally:
+            g.close()
+
+    def test_close_removes_database(self, tmpdir):
+        store = SQLiteStore(str(tmpdir))
+        Graph(store=store).add(
+            (URIRef('http://example.org/1'), RDF.type, DCAT.Dataset))
+
+        assert len(os.listdir(str(tmpdir))) == 1
+
+        store.close()
+
+        assert os.listdir(str(tmpdir)) == []
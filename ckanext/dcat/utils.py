@@ -18,7 +18,13 @@ from ckan.exceptions import HelperError
 from ckan import model
 import ckan.plugins.toolkit as toolkit
 
+from ckanext.dcat.cache import (
+    get_structured_data_cache,
+    get_shared_dataset_cache,
+    dataset_cache_version,
+)
 from ckanext.dcat.exceptions import RDFProfileException
+from ckanext.dcat.extras import get_extra_value
 
 from ckan.views.home import index as index_endpoint
 from ckan.views.dataset import read as read_endpoint
@@ -28,6 +34,9 @@ _ = toolkit._
 log = logging.getLogger(__name__)
 
 DCAT_EXPOSE_SUBCATALOGS = 'ckanext.dcat.expose_subcatalogs'
+STRUCTURED_DATA_PRECOMPUTE = 'ckanext.dcat.structured_data.precompute'
+
+STRUCTURED_DATA_PROFILES = ['schemaorg']
 
 CONTENT_TYPES = {
     'rdf': 'application/rdf+xml',
@@ -42,6 +51,7 @@ DCAT_CLEAN_TAGS = 'ckanext.dcat.clean_tags'
 DEFAULT_CATALOG_ENDPOINT = '/catalog.{_format}'
 ENABLE_RDF_ENDPOINTS_CONFIG = 'ckanext.dcat.enable_rdf_endpoints'
 ENABLE_CONTENT_NEGOTIATION_CONFIG = 'ckanext.dcat.enable_content_negotiation'
+STREAM_CATALOG_CONFIG = 'ckanext.dcat.stream_catalog'
 
 
 def _get_package_type(id):
@@ -108,6 +118,22 @@ def helper_available(helper_name):
         return False
     return True
 
+def _structured_data_cache_format(_format):
+    # Kept apart from the serializations returned by the dataset endpoints
+    return 'structured_data:{0}'.format(_format)
+
+
+def _format_structured_data(data):
+    # parse result again to prevent UnicodeDecodeError and add formatting
+    try:
+        json_data = json.loads(data)
+        return json.dumps(json_data, sort_keys=True,
+                          indent=4, separators=(',', ': '), cls=json.JSONEncoderForHTML)
+    except ValueError:
+        # result was not JSON, return anyway
+        return data
+
+
 def structured_data(dataset_id, profiles=None, _format='jsonld'):
     '''
     Returns a string containing the structured data of the given
@@ -115,9 +141,30 @@ def structured_data(dataset_id, profiles=None, _format='jsonld'):
     the default profiles are used).
 
     This string can be used in the frontend.
+
+    The string is cached until the dataset `metadata_modified` value
+    changes (see `get_structured_data_cache()`), so the RDF serialization
+    is not run on every page view.
     '''
     if not profiles:
-        profiles = ['schemaorg']
+        profiles = STRUCTURED_DATA_PROFILES
+
+    cache = get_structured_data_cache()
+    cache_format = _structured_data_cache_format(_format)
+    pkg = model.Package.get(dataset_id) if cache else None
+    if pkg and (pkg.state != 'active' or not pkg.metadata_modified):
+        pkg = None
+
+    if pkg:
+        output = cache.get(pkg.id, dataset_cache_version(pkg),
+                           profiles, cache_format, org_id=pkg.owner_org)
+        if output is not None:
+            try:
+                toolkit.check_access('package_show', {}, {'id': pkg.id})
+                return output
+            except toolkit.NotAuthorized:
+                # Let the action handle it
+                pass
 
     data = toolkit.get_action('dcat_dataset_show')(
         {},
@@ -127,14 +174,49 @@ def structured_data(dataset_id, profiles=None, _format='jsonld'):
             'format': _format,
         }
     )
-    # parse result again to prevent UnicodeDecodeError and add formatting
-    try:
-        json_data = json.loads(data)
-        return json.dumps(json_data, sort_keys=True,
-                          indent=4, separators=(',', ': '), cls=json.JSONEncoderForHTML)
-    except ValueError:
-        # result was not JSON, return anyway
-        return data
+    output = _format_structured_data(data)
+
+    if pkg:
+        cache.set(pkg.id, dataset_cache_version(pkg),
+                  profiles, cache_format, output, org_id=pkg.owner_org)
+
+    return output
+
+
+def precompute_structured_data(dataset_id, profiles=None, _format='jsonld'):
+    '''
+    Generates the structured data of the given dataset as the dataset page
+    would, and stores it in the dataset cache so it is available the first
+    time that the page is rendered.
+
+    This is only done if the dataset cache is shared by all processes, as
+    otherwise only the current one (eg a background job) would benefit from
+    it. Returns the structured data string, or None if it was not stored.
+    '''
+    cache = get_shared_dataset_cache()
+    pkg = model.Package.get(dataset_id) if cache else None
+    if not pkg or pkg.state != 'active' or not pkg.metadata_modified:
+        return None
+
+    if not profiles:
+        profiles = STRUCTURED_DATA_PROFILES
+
+    data = toolkit.get_action('dcat_dataset_show')(
+        {'ignore_auth': True},
+        {
+            'id': pkg.id,
+            'profiles': profiles,
+            'format': _format,
+        }
+    )
+    output = _format_structured_data(data)
+
+    cache.set(pkg.id, dataset_cache_version(pkg),
+              profiles, _structured_data_cache_format(_format), output,
+              org_id=pkg.owner_org)
+
+    return output
+
 
 def catalog_uri():
     '''
@@ -445,6 +527,7 @@ def read_catalog_page(_format):
 
     data_dict = {
         'page': toolkit.request.params.get('page'),
+        'cursor': toolkit.request.params.get('cursor'),
         'modified_since': toolkit.request.params.get('modified_since'),
         'q': toolkit.request.params.get('q'),
         'fq': toolkit.request.params.get('fq'),
@@ -452,6 +535,9 @@ def read_catalog_page(_format):
         'profiles': _profiles,
     }
 
+    if toolkit.asbool(config.get(STREAM_CATALOG_CONFIG, False)):
+        return _stream_catalog_page(_format, data_dict)
+
     try:
         response = toolkit.get_action('dcat_catalog_show')({}, data_dict)
     except (toolkit.ValidationError, RDFProfileException) as e:
@@ -464,6 +550,25 @@ def read_catalog_page(_format):
     return response
 
 
+def _stream_catalog_page(_format, data_dict):
+    '''
+    Returns a chunked response for the catalog endpoint, sending each dataset
+    as soon as it is serialized
+    '''
+    from flask import Response, stream_with_context
+    from ckanext.dcat.logic import dcat_catalog_stream
+
+    try:
+        chunks = dcat_catalog_stream({}, data_dict)
+    except (toolkit.ValidationError, RDFProfileException) as e:
+        toolkit.abort(409, str(e))
+
+    response = Response(stream_with_context(chunks))
+    response.headers['Content-type'] = CONTENT_TYPES[_format]
+
+    return response
+
+
 def endpoints_enabled():
     return toolkit.asbool(config.get(ENABLE_RDF_ENDPOINTS_CONFIG, True))
 
@@ -518,14 +623,8 @@ def is_dcat_modified_field_changed(old_package_dict, new_package_dict):
     new_dcat_modified = ''
     if not old_package_dict or not new_package_dict:
         return False
-    for extra in old_package_dict.get('extras', {}):
-        if extra.get('key') == 'dcat_modified':
-            old_dcat_modified = extra.get('value')
-            break
-    for extra in new_package_dict.get('extras', {}):
-        if extra.get('key') == 'dcat_modified':
-            new_dcat_modified = extra.get('value')
-            break
+    old_dcat_modified = get_extra_value(old_package_dict, 'dcat_modified', '')
+    new_dcat_modified = get_extra_value(new_package_dict, 'dcat_modified', '')
     if old_dcat_modified != new_dcat_modified:
         return True
     return False